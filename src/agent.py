@@ -0,0 +1,193 @@
+"""Agent keeps unlocked password file (SessionController) in memory and
+serves commands of other invocations over Unix domain socket, so they
+don't have to ask for password and decrypt whole file again.
+
+Protocol is same as for SessionController.process.  Each request and
+response is dict encoded as JSON on one line.  Socket is accessible only
+by its owner.  Agent exits when nobody sends request for timeout
+seconds.
+"""
+import json
+import os
+import selectors
+import socket
+import time
+from typing import Any, Optional
+
+import constants
+from session import SessionController
+
+
+def is_supported() -> bool:
+    """True if platform has Unix domain sockets"""
+    return hasattr(socket, 'AF_UNIX')
+
+def encode(data: dict) -> bytes:
+    """Serialize DATA to one line of JSON"""
+    return json.dumps(data).encode('utf-8') + b'\n'
+
+def decode(line: bytes) -> Any:
+    """Parse one line of JSON.  Raise ValueError if it is not valid"""
+    return json.loads(line.decode('utf-8'))
+
+def is_running(socket_path: str) -> bool:
+    """True if some agent accepts connections on SOCKET_PATH"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+    except OSError:
+        return False
+    return True
+
+
+class AgentServer:
+    """Serve commands for BACKEND (object with method process taking and
+    returning dict) on Unix socket SOCKET_PATH.  Connections are
+    multiplexed by selectors in one thread, so client which stays
+    connected doesn't block others and backend doesn't have to be thread
+    safe.  Agent exits after TIMEOUT seconds without request of any
+    client"""
+
+    def __init__(self, backend: Any, socket_path: str, timeout: float) -> None:
+        self.backend = backend
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.server: Optional[socket.socket] = None
+
+    def bind(self):
+        """Create listening socket with permissions 0600.  Socket left
+        by agent which didn't exit cleanly is replaced"""
+        if is_running(self.socket_path):
+            raise OSError("Agent is already running on {}".format(self.socket_path))
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Nobody else can connect, even before chmod
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o600)
+        server.listen()
+        self.server = server
+
+    def serve(self):
+        """Bind socket and accept clients until there is no request for
+        self.timeout seconds"""
+        self.bind()
+        self.run()
+
+    def run(self):
+        """Accept clients on bound socket and answer their requests, until
+        it is idle.  Each connection has buffer of received bytes, which
+        don't form whole line yet"""
+        assert self.server is not None
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ)
+        last_request = time.monotonic()
+        try:
+            while True:
+                remaining = last_request + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    return
+                for key, _ in selector.select(remaining):
+                    if key.fileobj is self.server:
+                        connection, _ = self.server.accept()
+                        # Client, which doesn't read responses, is dropped
+                        connection.settimeout(constants.AGENT_SEND_TIMEOUT)
+                        selector.register(connection, selectors.EVENT_READ, bytearray())
+                        continue
+                    handled = self.handle(key.fileobj, key.data)  # type: ignore
+                    if handled is None:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()  # type: ignore
+                    elif handled:
+                        last_request = time.monotonic()
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.fileobj is not self.server:
+                    key.fileobj.close()  # type: ignore
+            selector.close()
+            self.close()
+
+    def handle(self, connection: socket.socket, buffer: bytearray) -> Optional[int]:
+        """Read available data of CONNECTION to BUFFER and answer requests
+        on whole lines.  Return number of answered requests, None if
+        client disconnected or failed"""
+        try:
+            data = connection.recv(constants.AGENT_BUFFER_SIZE)
+            if not data:
+                return None
+            buffer.extend(data)
+            handled = 0
+            while b'\n' in buffer:
+                end = buffer.index(b'\n') + 1
+                line = bytes(buffer[:end])
+                del buffer[:end]
+                connection.sendall(encode(self.process_line(line)))
+                handled += 1
+            return handled
+        except OSError:  # Also timeout
+            return None
+
+    def process_line(self, line: bytes) -> dict:
+        """Decode request from LINE and return response of backend.  Any
+        failure of request is returned as error"""
+        try:
+            data = decode(line)
+        except ValueError:
+            return SessionController.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        if not isinstance(data, dict):
+            return SessionController.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        try:
+            return self.backend.process(data)
+        except Exception:  # pylint: disable=W0703
+            # Bad request of one client must not stop agent for others
+            return SessionController.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+
+    def close(self):
+        """Stop listening and remove socket"""
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            os.remove(self.socket_path)
+
+
+class AgentClient:
+    """Backend, which passes commands to running agent.  Raise OSError if
+    agent is not running.  If agent doesn't answer in TIMEOUT seconds,
+    connection is closed and every command fails"""
+
+    def __init__(self, socket_path: str, timeout=constants.AGENT_CLIENT_TIMEOUT) -> None:
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(timeout)
+        try:
+            self.connection.connect(socket_path)
+        except OSError:
+            self.connection.close()
+            raise
+        self.stream = self.connection.makefile('rwb')
+
+    def process(self, data: dict) -> dict:
+        """Send DATA to agent and return its response"""
+        try:
+            self.stream.write(encode(data))
+            self.stream.flush()
+            line = self.stream.readline()
+            if line:
+                return decode(line)
+        except OSError:  # Also timeout, late response would answer next command
+            self.close()
+        except ValueError:
+            pass
+        return SessionController.error_to_dict(constants.RESPONSE_ERROR_AGENT)
+
+    def close(self):
+        """Disconnect from agent"""
+        try:
+            self.stream.close()
+        except OSError:  # Unsent request after agent exited
+            pass
+        self.connection.close()
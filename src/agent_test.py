@@ -0,0 +1,163 @@
+"""Tests for agent module"""
+# Disable missing docstring
+# pylint: disable=C0111
+
+import os
+import stat
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+import agent
+import constants
+import helpers
+import session
+
+
+@unittest.skipUnless(agent.is_supported(), "Unix sockets are not supported")
+class AgentTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, "agent", "agent.sock")
+        self.backend = unittest.mock.MagicMock()
+        self.backend.process.side_effect = self.process
+
+    def process(self, data):
+        if data[constants.COMMAND] == constants.COMMAND_STATS:
+            return session.SessionController.ok_to_dict(
+                constants.COMMAND_STATS, {constants.RESPONSE_STATS_FILE_PATH: "/vault"})
+        return session.SessionController.ok_to_dict(data[constants.COMMAND], [data])
+
+    def start(self, timeout=1.0):
+        server = agent.AgentServer(self.backend, self.socket_path, timeout)
+        server.bind()
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        return thread
+
+    def test_request(self):
+        thread = self.start()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.socket_path).st_mode))
+        self.assertTrue(agent.is_running(self.socket_path))
+        client = agent.AgentClient(self.socket_path)
+        for term in ("abc", "def"):
+            data = {constants.COMMAND: constants.COMMAND_SEARCH,
+                    constants.COMMAND_SEARCH_VALUE: term}
+            ret = client.process(data)
+            self.assertEqual(constants.RESPONSE_OK, ret[constants.RESPONSE])
+            self.assertEqual([data], ret[constants.RESPONSE_VALUES])
+        client.stream.write(b'not json\n')
+        client.stream.flush()
+        ret = agent.decode(client.stream.readline())
+        self.assertEqual(constants.RESPONSE_ERROR, ret[constants.RESPONSE])
+        client.close()
+        with self.assertRaises(OSError):
+            agent.AgentServer(self.backend, self.socket_path, 1).bind()
+        self.assertTrue(thread.is_alive())
+        thread.join(10)
+
+    def test_concurrent_clients(self):
+        thread = self.start(timeout=0.5)
+        # Interactive client stays connected, but doesn't block others
+        idle = agent.AgentClient(self.socket_path)
+        idle.process({constants.COMMAND: constants.COMMAND_STATS})
+        for _ in range(5):
+            client = agent.AgentClient(self.socket_path, timeout=5)
+            ret = client.process({constants.COMMAND: constants.COMMAND_SEARCH})
+            self.assertEqual(constants.RESPONSE_OK, ret[constants.RESPONSE])
+            client.close()
+        # Two requests in one packet
+        idle.stream.write(agent.encode({constants.COMMAND: "a"}) +
+                          agent.encode({constants.COMMAND: "b"}))
+        idle.stream.flush()
+        self.assertEqual("a", agent.decode(idle.stream.readline())[constants.COMMAND])
+        self.assertEqual("b", agent.decode(idle.stream.readline())[constants.COMMAND])
+        # Connected client without requests doesn't keep agent alive
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(constants.RESPONSE_ERROR,
+                         idle.process({constants.COMMAND: "a"})[constants.RESPONSE])
+        idle.close()
+
+    def test_malformed_requests(self):
+        os.makedirs(os.path.dirname(self.socket_path))
+        handle, file_path = tempfile.mkstemp(dir=os.path.dirname(self.socket_path))
+        os.close(handle)
+        self.backend = session.SessionController({constants.SETTINGS_FILE_PATH: file_path,
+                                                  constants.SETTINGS_PASSWORD: "abcd"})
+        thread = self.start(timeout=0.5)
+        client = agent.AgentClient(self.socket_path)
+        ret = client.process({constants.COMMAND: constants.COMMAND_ADD,
+                              constants.COMMAND_ADD_KEY: "my key",
+                              constants.COMMAND_ADD_VALUE: "my value"})
+        self.assertEqual(constants.RESPONSE_OK, ret[constants.RESPONSE])
+        for data in ({constants.COMMAND_SEARCH_VALUE: 5},
+                     {constants.COMMAND_SHOW_INDICES: ["x"]},
+                     {constants.COMMAND_SHOW_INDICES: [-1]},
+                     {constants.COMMAND_DELETE_INDICES: []},
+                     {constants.COMMAND_ADD_KEY: 5, constants.COMMAND_ADD_VALUE: "v"}):
+            for command in (constants.COMMAND_SEARCH, constants.COMMAND_SHOW,
+                            constants.COMMAND_DELETE, constants.COMMAND_ADD):
+                client.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                constants.COMMAND_SEARCH_VALUE: "my key"})
+                data[constants.COMMAND] = command
+                ret = client.process(data)
+                self.assertIn(ret[constants.RESPONSE], (constants.RESPONSE_OK,
+                                                        constants.RESPONSE_ERROR))
+        # Failure of backend is returned to client
+        self.backend.process = unittest.mock.Mock(side_effect=AttributeError)
+        ret = client.process({constants.COMMAND: constants.COMMAND_STATS})
+        self.assertEqual(constants.RESPONSE_ERROR_INVALID_ARGUMENT, ret[constants.RESPONSE_ERROR])
+        del self.backend.process
+        ret = client.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                              constants.COMMAND_SEARCH_VALUE: "my key"})
+        self.assertEqual("my value", ret[constants.RESPONSE_VALUES][0][constants.SECRET_VALUE])
+        self.assertTrue(thread.is_alive())
+        client.close()
+        thread.join(10)
+
+    def test_client_timeout(self):
+        server = agent.AgentServer(self.backend, self.socket_path, 1)
+        server.bind()
+        self.addCleanup(server.close)
+        client = agent.AgentClient(self.socket_path, timeout=0.1)
+        ret = client.process({constants.COMMAND: constants.COMMAND_STATS})
+        self.assertEqual(constants.RESPONSE_ERROR_AGENT, ret[constants.RESPONSE_ERROR])
+        client.close()
+
+    def test_idle_timeout(self):
+        thread = self.start(timeout=0.1)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        with self.assertRaises(OSError):
+            agent.AgentClient(self.socket_path)
+
+    def test_connect_agent(self):
+        settings = {constants.SETTINGS_AGENT_SOCKET: self.socket_path,
+                    constants.SETTINGS_FILE_PATH: "/vault"}
+        backend = helpers.Module(None)
+        self.assertTrue(helpers.connect_agent(settings, helpers.Module(None), backend))
+        self.assertFalse(backend.is_loaded())
+
+        thread = self.start(timeout=0.5)
+        # Agent has other file unlocked
+        other = dict(settings)
+        other[constants.SETTINGS_FILE_PATH] = "/work.vault"
+        self.assertTrue(helpers.connect_agent(other, helpers.Module(None), backend))
+        self.assertFalse(backend.is_loaded())
+        self.assertTrue(helpers.connect_agent(settings, helpers.Module(None), backend))
+        self.assertTrue(backend.is_loaded())
+        # Password is not asked
+        self.assertTrue(helpers.get_password(settings, helpers.Module(None), backend))
+        self.assertNotIn(constants.SETTINGS_PASSWORD, settings)
+        ret = backend.process({constants.COMMAND: constants.COMMAND_STATS})
+        self.assertEqual(constants.COMMAND_STATS, ret[constants.COMMAND])
+        backend.module.close()
+        thread.join(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,322 @@
+"""Benchmarks for password manager.  They are not part of tests, run them
+like:
+
+ python src/benchmark.py cipher --entries 10000 --size 64
+ python src/benchmark.py parse --entries 10000 --size 64
+ python src/benchmark.py search --entries 100000
+ python src/benchmark.py prune --entries 100000
+
+Other benchmarks of search (complete, deadline, fulltext, live, shards)
+take same arguments as search.
+"""
+import argparse
+import difflib
+import functools
+import heapq
+import os
+import random
+import re
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import constants
+import container
+import core
+import corpus
+import index
+
+CHECKED_QUERIES = 3  # Queries compared with slow full search
+
+
+def timed_result(func: Callable, *args) -> Tuple[Any, float]:
+    """Return result of FUNC called with ARGS and time in seconds spent by
+    the call"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def timed(func: Callable, *args) -> float:
+    """Return time in seconds spent by calling FUNC with ARGS"""
+    return timed_result(func, *args)[1]
+
+def benchmark_ciphers(args: argparse.Namespace):
+    """Compare encryption and decryption throughput of cipher backends on
+    ARGS.ENTRIES random secrets of ARGS.SIZE bytes"""
+    secrets = [os.urandom(args.size) for _ in range(args.entries)]
+    megabytes = args.entries * args.size / 10**6
+    print("{:<20}{:>16}{:>16}{:>16}{:>16}".format(
+        "cipher", "encrypt MB/s", "encrypt ent/s", "decrypt MB/s", "decrypt ent/s"))
+    for name, cipher_class in sorted(core.CIPHERS.items()):
+        cipher = cipher_class("benchmark password")
+        tokens, encrypt = timed_result(list, map(cipher.encrypt_raw, secrets))
+        decrypt = timed(list, map(cipher.decrypt_raw, tokens))
+        print("{:<20}{:>16.1f}{:>16.0f}{:>16.1f}{:>16.0f}".format(
+            name, megabytes / encrypt, args.entries / encrypt,
+            megabytes / decrypt, args.entries / decrypt))
+
+def is_relevant_for_search(character: str) -> bool:
+    """Junk filter of old search, which hints SequenceMatcher about junk
+    letters"""
+    return core.KEY_SEARCH_JUNK_PATTERN.match(character) is not None
+
+def traced(func: Callable, *args) -> Tuple[int, int]:
+    """Call FUNC with ARGS and return tuple (memory allocated at peak,
+    memory still allocated at the end) in bytes.  Result of FUNC is kept
+    until measurement ends"""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, current
+
+ENTRY_PATTERN = re.compile(r'(\d+)\s+(\d+)\s+(.*)', re.DOTALL)
+
+def parse_entry_regex(entry: bytes) -> Tuple[str, str]:
+    """Old core.parse_entry, which matched regular expression"""
+    match = re.fullmatch(ENTRY_PATTERN, entry.decode('utf-8'))
+    if not match:
+        raise ValueError
+    data = match.groups()
+    text = core.process_entry(data[2])
+    return (core.process_entry(text[0:int(data[0])]),
+            core.process_entry(text[int(data[0]) + 1:int(data[0]) + 1 + int(data[1])]))
+
+def parse_hex(records: list, cipher: core.Cipher) -> list:
+    """Old core.parse_contents of hex RECORDS, one entry per record"""
+    decrypted = filter(len, map(cipher.decrypt, map(bytes.fromhex, records)))
+    return list(map(parse_entry_regex, decrypted))
+
+def benchmark_parse(args: argparse.Namespace):
+    """Measure time and memory needed to decrypt and parse ARGS.ENTRIES
+    entries with values of ARGS.SIZE characters, stored one per record
+    and in blocks.  Baseline is old parser of hex records using regular
+    expression.  Memory is not count of allocations, which tracemalloc
+    can't report, but peak temporary bytes: peak while parsing one record
+    minus memory kept by result, so it shows size of copies made by
+    parser"""
+    cipher = core.AesGcmCipher("benchmark password")
+    entries = [core.serialize_entry("key " + str(i), "v" * args.size)
+               for i in range(args.entries)]
+    print("{:<12}{:>16}{:>20}{:>20}".format(
+        "layout", "parse ent/s", "peak temp B/rec", "kept B/entry"))
+    hexed = [cipher.encrypt(x).hex() for x in entries]
+    seconds = min(timed(parse_hex, hexed, cipher) for _ in range(3))
+    peak, kept = traced(parse_hex, hexed[:1], cipher)
+    _, kept_all = traced(parse_hex, hexed, cipher)
+    print("{:<12}{:>16.0f}{:>20.0f}{:>20.0f}".format(
+        "regex hex", args.entries / seconds, peak - kept, kept_all / args.entries))
+    for name, block_size in (("entries", 0), ("blocks", constants.BLOCK_SIZE)):
+        data = core.pack_records(entries, cipher, block_size)
+        records = list(container.unpack_records(data))
+        seconds = min(timed(core.parse_contents, records, cipher, None, True)
+                      for _ in range(3))
+        peak, kept = traced(core.decrypt_and_parse, cipher, True, records[0])
+        _, kept_all = traced(core.parse_contents, records, cipher, None, True)
+        print("{:<12}{:>16.0f}{:>20.0f}{:>20.0f}".format(
+            name, args.entries / seconds, peak - kept, kept_all / args.entries))
+
+def search_queries(args: argparse.Namespace) -> Tuple[List[str], List[str]]:
+    """Return ARGS.ENTRIES random keys (see corpus.create_corpus) and
+    queries made of their beginnings"""
+    keys = corpus.create_corpus(args.entries)
+    rnd = random.Random(1)
+    return keys, [rnd.choice(keys)[:rnd.randint(3, 9)] for _ in range(20)]
+
+def full_search(normalized: List[str], query: str) -> List[int]:
+    """Full search of QUERY on NORMALIZED keys, which is reference for
+    faster searches"""
+    return core.search(normalized, core.normalize_key(query), lambda x: x)
+
+def benchmark_engine(engine: str, keys: List[str], queries: List[str],
+                     expected: List[List[int]]):
+    """Print row of benchmark_search for ENGINE.  EXPECTED are results of
+    full search for first QUERIES"""
+    build = timed(index.create_index, [core.normalize_key(x) for x in keys], engine)
+    store = core.KeyValueStore([(x, "") for x in keys], engine)
+    store.find_key("warm up")
+    seconds = timed(list, map(store.find_key, queries))
+    assert store.columns.index is not None
+    checked = queries[:len(expected)]
+    candidates = [store.columns.index.candidates(core.normalize_key(x), len(y))
+                  for x, y in zip(checked, expected)]
+    recalled = sum(len(set(x) & set(y)) for x, y in zip(candidates, expected))
+    same = list(map(store.find_key, checked)) == expected
+    print("{:<10}{:>12.3f}{:>12.4f}{:>10.2f}{:>8}".format(
+        engine, build, seconds / len(queries),
+        recalled / sum(map(len, expected)), str(same)))
+
+def benchmark_search(args: argparse.Namespace):
+    """Compare full search on keys with search engines (see
+    index.ENGINES) on ARGS.ENTRIES random keys.  Recall is share of
+    results of full search, which are found by trigram scoring of engine
+    alone (without SequenceMatcher).  Final results of engines are always
+    checked against full search, which is slow, so only few queries are
+    used for it"""
+    keys, queries = search_queries(args)
+    normalized = [core.normalize_key(x) for x in keys]
+    checked = queries[:CHECKED_QUERIES]
+    expected, full = timed_result(list, map(functools.partial(full_search, normalized), checked))
+    print("full search {:.4f} s/query".format(full / len(checked)))
+    print("{:<10}{:>12}{:>12}{:>10}{:>8}".format("engine", "build s", "s/query",
+                                                 "recall", "same"))
+    for engine in sorted(index.ENGINES):
+        benchmark_engine(engine, keys, queries, expected)
+
+def search_deadline(normalized: List[str], by_length: Any, deadline: float,
+                    query: str) -> Tuple[List[int], bool]:
+    """Search QUERY on NORMALIZED keys ordered BY_LENGTH (see
+    core.search_until) for DEADLINE seconds.  Return found indices and
+    True if search was stopped"""
+    scored, partial = core.search_until(normalized, core.normalize_key(query), by_length,
+                                        time.monotonic() + deadline)
+    return [x[0] for x in scored], partial
+
+def benchmark_deadline(args: argparse.Namespace):
+    """Compare search on ARGS.ENTRIES random keys stopped at deadlines
+    with full search.  Recall is share of results of full search found
+    before deadline"""
+    keys, queries = search_queries(args)
+    normalized = [core.normalize_key(x) for x in keys]
+    checked = queries[:CHECKED_QUERIES]
+    expected, full = timed_result(list, map(functools.partial(full_search, normalized), checked))
+    print("full search {:.4f} s/query".format(full / len(checked)))
+    by_length = core.length_order(normalized)
+    for deadline in (1000, 0.1, 0.01):
+        search = functools.partial(search_deadline, normalized, by_length, deadline)
+        bounded, seconds = timed_result(list, map(search, checked))
+        recalled = sum(len(set(x[0]) & set(y)) for x, y in zip(bounded, expected))
+        print("deadline {} s: {:.4f} s/query, partial {}, recall {:.2f}".format(
+            deadline, seconds / len(checked), sum(1 for x in bounded if x[1]),
+            recalled / sum(map(len, expected))))
+
+def benchmark_shards(args: argparse.Namespace):
+    """Compare full search on ARGS.ENTRIES random keys with same search
+    in ARGS.WORKERS processes (see core.SearchShards).  Start is time of
+    starting processes and sending keys to them"""
+    keys, queries = search_queries(args)
+    normalized = [core.normalize_key(x) for x in keys]
+    checked = queries[:CHECKED_QUERIES]
+    expected, full = timed_result(list, map(functools.partial(full_search, normalized), checked))
+    shards, start = timed_result(core.SearchShards, normalized, args.workers)
+    try:
+        found, sharded = timed_result(list, map(
+            lambda x: shards.search(core.normalize_key(x), constants.MAX_RESULTS), checked))
+    finally:
+        shards.close()
+    print("full search {:.4f} s/query, sharded ({} workers, start {:.3f} s) "
+          "{:.4f} s/query, same {}".format(full / len(checked), args.workers, start,
+                                           sharded / len(checked), found == expected))
+
+def benchmark_complete(args: argparse.Namespace):
+    """Measure build of prefix index (see index.PrefixIndex) on
+    ARGS.ENTRIES random keys and completion of random prefixes"""
+    keys = corpus.create_corpus(args.entries)
+    rnd = random.Random(1)
+    store = core.KeyValueStore([(x, "") for x in keys])
+    build = timed(store.complete, "")
+    prefixes = [rnd.choice(keys)[:rnd.randint(1, 6)] for _ in range(100)]
+    seconds = timed(list, map(store.complete, prefixes))
+    print("completion build {:.3f} s, {:.6f} s/query".format(build, seconds / len(prefixes)))
+
+def benchmark_live(args: argparse.Namespace):
+    """Measure live search (see KeyValueStore.find_live) on ARGS.ENTRIES
+    random keys, while query is typed one character after another"""
+    keys = corpus.create_corpus(args.entries)
+    store = core.KeyValueStore([(x, "") for x in keys])
+    typed = random.Random(1).choice(keys)
+    steps = [timed(store.find_live, typed[:x]) for x in range(1, len(typed) + 1)]
+    print("live search of {!r}, s/keystroke: {}".format(
+        typed, " ".join("{:.4f}".format(x) for x in steps)))
+
+def entry_text(entry: Tuple[str, str]) -> str:
+    """Text of ENTRY searched by old full-text search"""
+    return entry[0] + entry[1]
+
+def benchmark_fulltext(args: argparse.Namespace):
+    """Compare old full-text search (SequenceMatcher over every key and
+    value) with BM25 index (see index.FullTextIndex) on ARGS.ENTRIES
+    random entries"""
+    keys = corpus.create_corpus(args.entries)
+    rnd = random.Random(1)
+    entries = [(x, "user {} pin {}".format(rnd.choice(keys), rnd.randint(0, 9999)))
+               for x in keys]
+    words = ["bank", "github pin", "user mail", "wifi router 12"]
+    scan = timed(core.search, entries, words[0], entry_text, is_relevant_for_search)
+    store = core.KeyValueStore(entries)
+    build = timed(store.find_fulltext, "warm up")
+    seconds = timed(list, map(store.find_fulltext, words))
+    print("full-text scan {:.4f} s/query, bm25 build {:.3f} s, {:.5f} s/query".format(
+        scan, build, seconds / len(words)))
+
+class CountingMatcher(difflib.SequenceMatcher):
+    """SequenceMatcher, which counts calls of ratio"""
+    calls = 0
+
+    def ratio(self):
+        CountingMatcher.calls += 1
+        return super().ratio()
+
+def search_unpruned(entries, text: str, func, junk_filter=None, max_results=10) -> list:
+    """core.search without pruning, which computes ratio of every entry"""
+    matcher = difflib.SequenceMatcher(junk_filter, autojunk=False)
+    matcher.set_seq2(text)
+    indices = ((i, core._get_ratio(matcher, func(x)))  # pylint: disable=W0212
+               for i, x in enumerate(entries))
+    return [x[0] for x in heapq.nlargest(max_results, indices, key=lambda x: x[1])]
+
+def benchmark_prune(args: argparse.Namespace):
+    """Compare core.search with search computing ratio of all ARGS.ENTRIES
+    random keys.  Skipped is share of entries, whose ratio was not needed,
+    because its upper bound couldn't beat MAX_RESULTS-th best"""
+    keys = corpus.create_corpus(args.entries)
+    rnd = random.Random(1)
+    queries = [rnd.choice(keys)[:rnd.randint(3, 12)] for _ in range(5)]
+    print("{:<16}{:>14}{:>14}{:>10}{:>8}".format("query", "unpruned s", "pruned s",
+                                                 "skipped", "same"))
+    for query in queries:
+        expected, unpruned = timed_result(search_unpruned, keys, query, lambda x: x,
+                                          is_relevant_for_search)
+        CountingMatcher.calls = 0
+        original = core.SequenceMatcher
+        core.SequenceMatcher = CountingMatcher  # type: ignore
+        try:
+            found, pruned = timed_result(core.search, keys, query, lambda x: x,
+                                         is_relevant_for_search)
+        finally:
+            core.SequenceMatcher = original  # type: ignore
+        print("{:<16}{:>14.4f}{:>14.4f}{:>10.4f}{:>8}".format(
+            query, unpruned, pruned, 1 - CountingMatcher.calls / len(keys),
+            str(found == expected)))
+
+BENCHMARKS: Dict[str, Any] = {
+    "cipher": benchmark_ciphers,
+    "parse": benchmark_parse,
+    "complete": benchmark_complete,
+    "deadline": benchmark_deadline,
+    "fulltext": benchmark_fulltext,
+    "live": benchmark_live,
+    "prune": benchmark_prune,
+    "search": benchmark_search,
+    "shards": benchmark_shards,
+}
+
+def main():
+    """Parse arguments and run selected benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--entries", type=int, default=10000,
+                        help="Number of entries used by benchmark")
+    parser.add_argument("--size", type=int, default=64,
+                        help="Size of one entry in bytes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of search processes (see SearchShards)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,84 @@ SPLITTER_NEWLINE = "|\n"
 MAX_RESULTS = 10
 PROMPT_SYMBOL = "> "
 PROGRAM_NAME = "passman"
+
+# Journal.  Tombstone is special record appended to file, which marks entries
+# as deleted.  File is rewritten (compacted) when there are more stale records
+# than JOURNAL_COMPACT_MIN and also more than JOURNAL_COMPACT_RATIO * entries
+JOURNAL_TOMBSTONE = "delete"
+JOURNAL_COMPACT_MIN = 64
+JOURNAL_COMPACT_RATIO = 0.5
+
+# Suffix of temporary file written next to password file
+TMP_SUFFIX = ".tmp"
+
+# Size of chunks in which password file is read
+READ_CHUNK_SIZE = 64 * 1024
+
+# Parallel encryption and decryption is used only for files with at
+# least PARALLEL_MIN_RECORDS records.  Records are processed in batches
+PARALLEL_MIN_RECORDS = 2048
+PARALLEL_BATCH_SIZE = 512
+
+# Entries are encrypted together in blocks of about BLOCK_SIZE bytes (0
+# means each entry is encrypted separately)
+BLOCK_SIZE = 4096
+
+# Cipher used for new files.  One of: fernet, aes-gcm, chacha20-poly1305
+CIPHER = "aes-gcm"
+
+# Size of random key, which encrypts entries in new files
+KEY_SIZE = 32
+
+# Events emitted by password file to its listeners after change
+CHANGE_INSERT = "insert"
+CHANGE_DELETE = "delete"
+
+# Search on keys is split among worker processes (SETTINGS_SEARCH_WORKERS)
+# only for files with at least this many entries
+SEARCH_SHARDS_MIN_ENTRIES = 50000
+
+# Modes of search, on keys only or on keys and values.  Live mode is for
+# search while typing, it finds only keys containing query as subsequence
+SEARCH_MODE_KEY = "key"
+SEARCH_MODE_FULL = "full"
+SEARCH_MODE_LIVE = "live"
+# Modes, which don't rank keys by similarity, but return matching keys
+# sorted: equal to term, starting with term, matching glob or regular
+# expression (anywhere in key, use ^ and $ to match whole key)
+SEARCH_MODE_EXACT = "exact"
+SEARCH_MODE_PREFIX = "prefix"
+SEARCH_MODE_GLOB = "glob"
+SEARCH_MODE_REGEX = "regex"
+SEARCH_MATCH_MODES = (SEARCH_MODE_EXACT, SEARCH_MODE_PREFIX, SEARCH_MODE_GLOB,
+                      SEARCH_MODE_REGEX)
+SEARCH_MODES = (SEARCH_MODE_KEY, SEARCH_MODE_FULL, SEARCH_MODE_LIVE) + SEARCH_MATCH_MODES
+# Number of search results remembered, repeated search is answered from
+# cache until password file changes
+SEARCH_CACHE_SIZE = 128
+
+# Max number of keys offered by completion
+COMPLETE_MAX_RESULTS = 100
+
+# Search uses index only if there are at least this many entries, smaller
+# files are searched by comparing query with every key
+SEARCH_INDEX_MIN_ENTRIES = 1000
+# Number of entries selected by index, which are scored first.  Their
+# scores decide which other entries must be scored too
+SEARCH_INDEX_CANDIDATES = 300
+
+# Known text stored encrypted in header of file.  If it can be decrypted,
+# password is correct
+VERIFIER = "passman verifier"
+
+# Count of decrypted records kept in memory in lazy mode
+LAZY_CACHE_SIZE = 256
+
+# Client of agent waits this many seconds for response
+AGENT_CLIENT_TIMEOUT = 60
+# Agent drops client, which doesn't read response for this many seconds
+AGENT_SEND_TIMEOUT = 5
+AGENT_BUFFER_SIZE = 65536
 ###############
 
 
@@ -18,6 +96,12 @@ SECRET_VALUE = "value"
 # Search
 COMMAND_SEARCH = "search"
 COMMAND_SEARCH_VALUE = "term"
+COMMAND_SEARCH_MODE = "mode"  # One of SEARCH_MODES, default is SEARCH_MODE_KEY
+
+# Search for more terms at once, returns list of {COMMAND_SEARCH_VALUE:
+# term, RESPONSE_VALUES: found entries}.  Results of last search are kept
+COMMAND_SEARCH_MANY = "search_many"
+COMMAND_SEARCH_MANY_VALUE = "terms"
 
 # Add
 COMMAND_ADD = "add"
@@ -34,12 +118,20 @@ COMMAND_DELETE_INDICES = "DELETE_INDICES"
 COMMAND_DELETE_KEYWORD = "indices"
 COMMAND_DELETE_KEYWORD_HELP = "Specify which indices from search should be deleted"
 
+# Complete key (used by frontend, returns list of keys)
+COMMAND_COMPLETE = "complete"
+COMMAND_COMPLETE_VALUE = "prefix"
+
 # Stats
 COMMAND_STATS = "stats"
 
 # Quit
 COMMAND_QUIT = "quit"
 
+# Change password
+COMMAND_CHANGE_PASSWORD = "change_password"
+COMMAND_CHANGE_PASSWORD_VALUE = "new_password"
+
 # Response
 RESPONSE = "status"
 RESPONSE_ERROR = "error"
@@ -47,6 +139,9 @@ RESPONSE_OK = "ok"
 RESPONSE_MISSING = "missing"
 
 RESPONSE_VALUES = "values"
+# True in response of search, which stopped at deadline, so better results
+# may exist (see SETTINGS_SEARCH_DEADLINE)
+RESPONSE_PARTIAL = "partial"
 
 RESPONSE_ERROR_UNKNOWN_COMMAND = "Unknown command"
 RESPONSE_ERROR_ARGUMENTS = "Bad or missing arguments"
@@ -54,10 +149,15 @@ RESPONSE_ERROR_OUT_OF_RANGE = "Given index is out of range"
 RESPONSE_ERROR_REQUIRES_SEARCH = "Given command requires search before executing"
 RESPONSE_ERROR_UNKNOWN_ERROR = "Unknown error occured, command was not successful"
 RESPONSE_ERROR_INVALID_ARGUMENT = "Invalid argument passed to command"
+RESPONSE_ERROR_INVALID_PASSWORD = "Invalid password"
+RESPONSE_ERROR_AGENT = "Connection to agent was lost"
 
 # Values in dict returned by stats command
 RESPONSE_STATS_DECRYPTION_RATE = "decryption_rate"  # <0,1>
 RESPONSE_STATS_STATUS = "status"  # ok or error
+RESPONSE_STATS_CACHE_HITS = "search_cache_hits"
+RESPONSE_STATS_CACHE_MISSES = "search_cache_misses"
+RESPONSE_STATS_FILE_PATH = "file_path"  # Absolute path of password file
 ##########################################
 
 #################################################################################
@@ -65,20 +165,49 @@ RESPONSE_STATS_STATUS = "status"  # ok or error
 # Settings
 SETTINGS_FILE_PATH = "file_path"
 SETTINGS_PASSWORD = "password"
+SETTINGS_CONVERT = "convert"
+# Memory map password file and decrypt entries only when accessed
+SETTINGS_LAZY = "lazy"
+SETTINGS_LAZY_CACHE_SIZE = "lazy_cache_size"
+SETTINGS_BLOCK_SIZE = "block_size"
+SETTINGS_CIPHER = "cipher"
+# Number of processes used for encryption and decryption of big files (0
+# or 1 means no parallelism)
+SETTINGS_WORKERS = "workers"
+# Implementation of search index (see index.ENGINES), default is fastest
+# available
+SETTINGS_SEARCH_ENGINE = "search_engine"
+SETTINGS_SEARCH_CACHE_SIZE = "search_cache_size"
+# Number of processes, which keep parts of keys and search in them (0 or 1
+# means search in main process)
+SETTINGS_SEARCH_WORKERS = "search_workers"
+# Search on keys or full-text search stops after this many seconds and
+# returns best results found so far (unlimited if not set)
+SETTINGS_SEARCH_DEADLINE = "search_deadline"
+# Run as agent, which keeps password file unlocked and serves commands over
+# Unix socket.  Other invocations connect to it, if it is running
+SETTINGS_AGENT = "agent"
+SETTINGS_AGENT_SOCKET = "agent_socket"
+# Agent exits after this many seconds without request
+SETTINGS_AGENT_TIMEOUT = "agent_timeout"
 
 
 SETTINGS_INTERACTION_COMMANDS_LIST = "interaction_commands"
 
 DEFAULT_SETTINGS = {
     SETTINGS_FILE_PATH: "~/pass_man/passwords.txt",
+    SETTINGS_AGENT_SOCKET: "~/pass_man/agent.sock",
+    SETTINGS_AGENT_TIMEOUT: 15 * 60,
     # List of classes for interactive session
     SETTINGS_INTERACTION_COMMANDS_LIST: [
         "HelpInteractionCommand",
         "AddInteractionCommand",
         "DeleteInteractionCommand",
         "SearchInteractionCommand",
+        "LookupInteractionCommand",
         "ViewInteractionCommand",
         "QuitInteractionCommand",
+        "PasswordInteractionCommand",
     ],
 }
 
@@ -92,12 +221,30 @@ UNHANDLED_EXCEPTION = "Sorry, unhandled exception occured.\
 
 SEARCH_INTERACTION_PROMPT = "Search"
 SEARCH_INTERACTION_INFO = "Please enter search term"
+# Flag before search term, which selects full-text search
+SEARCH_INTERACTION_FULL = "--full"
+# Flag, which starts search while typing
+SEARCH_INTERACTION_LIVE = "--live"
+# Flags of match modes are "--" + mode (--exact, --prefix, --glob, --regex)
+SEARCH_INTERACTION_FLAG = "--"
+SEARCH_INTERACTION_LIVE_RESULTS = 5
+SEARCH_INTERACTION_NOTHING = "Nothing found"
+SEARCH_INTERACTION_PARTIAL = "Search stopped at deadline, better matches may exist"
+
+LOOKUP_INTERACTION_PROMPT = "Lookup"
+LOOKUP_INTERACTION_INFO = "Please enter search terms separated by ;"
+LOOKUP_INTERACTION_SEPARATOR = ";"
 
 ADD_INTERACTION_KEY_MISSING = "Please enter key which will represent this entry.\
                                \nThen enter value. Value must end with two empty lines"
 
 ADD_INTERACTION_VALUE_MISSING = "Now enter value"
 
+PASSWORD_INTERACTION_NEW = "New password: "
+PASSWORD_INTERACTION_REPEAT = "Repeat new password: "
+PASSWORD_INTERACTION_MISMATCH = "Passwords are empty or don't match, password was not changed"
+PASSWORD_INTERACTION_CHANGED = "Password changed"
+
 HELP_INTERACTION = """Here you can see list of available commands.  Command can be
 represented by many synonyms and to call it you can usually type only
 first few letters.  If you want to cancel command press Ctrl+C, second
@@ -110,14 +257,23 @@ HELP_AMBIGUOUS = "Sorry, command is ambiguous, try entering more characters:"
 HELP_SEARCH_MANY = "Hint: To print other values, use show command"
 HELP_SHOW_COMMAND = """[indices] After search, you can show full entry key and value.
 Command takes as arguments indices returned by search"""
-HELP_SEARCH_COMMAND = """[search term] Search in stored entries by key and return top
-matches.  Indices next to shown entries are important for some other
-commands like delete, which takes as argument theses indices"""
+HELP_SEARCH_COMMAND = """[--full|--live|--exact|--prefix|--glob|--regex] [search term]
+Search in stored entries by key and return top matches.  With --full,
+words of term are searched in keys and values and entries containing
+rare words rank first.  With --live, best keys are shown while typing,
+Enter finishes search.  Other flags show keys equal to term, starting
+with term, matching glob (like git*.com) or regular expression, sorted.
+Indices next to shown entries are important for some other commands like
+delete, which takes as argument theses indices"""
+HELP_LOOKUP_COMMAND = """[term; term; ...] Search for more terms at once and show best
+match of each.  Results of previous search command are not changed"""
 HELP_ADD_COMMAND = """[key] [value] Add new entry.  Entry is represented by key and
 value.  Key should be one word representing whole entry (for example
 url of webpage).  Value can be more than one line long.  After
 entering value, enter two newlines in row which terminates command."""
 HELP_DELETE_COMMAND = """[indices] Delete specified (by indices) entries."""
+HELP_PASSWORD_COMMAND = """Change password of password file.  New password is entered
+twice.  Entries are not encrypted again, so it is fast even for big files."""
 HELP_QUIT_COMMAND = """[indices] Clear screen and exit password manager (equal to
 Ctrl-C)."""
 
@@ -129,6 +285,36 @@ ARG_PASSOWRD_DESCRIPTION = (
     "You can specify password as argument, and it won't be requested interactively"
 )
 
+ARG_CONVERT = "--convert"
+ARG_CONVERT_DESCRIPTION = "Convert password file from old text format to binary format"
+
+ARG_CIPHER = "--cipher"
+ARG_CIPHER_DESCRIPTION = "Cipher used for new files, or for file converted by --convert"
+
+ARG_LAZY = "--lazy"
+ARG_LAZY_DESCRIPTION = "Decrypt entries only when they are needed (saves memory for big files)"
+
+ARG_WORKERS = "--workers"
+ARG_WORKERS_DESCRIPTION = "Number of processes used for encryption and decryption of big files"
+
+ARG_SEARCH_WORKERS = "--search-workers"
+ARG_SEARCH_WORKERS_DESCRIPTION = "Number of processes searching in parts of big files \
+(started once, when file is unlocked)"
+
+ARG_SEARCH_DEADLINE = "--search-deadline"
+ARG_SEARCH_DEADLINE_DESCRIPTION = "Seconds after which search returns best results found \
+so far"
+
+ARG_AGENT = "--agent"
+ARG_AGENT_DESCRIPTION = "Unlock password file and keep it in memory for other invocations \
+(until it is idle for --timeout seconds)"
+
+ARG_SOCKET = "--socket"
+ARG_SOCKET_DESCRIPTION = "Unix socket used for communication with agent"
+
+ARG_TIMEOUT = "--timeout"
+ARG_TIMEOUT_DESCRIPTION = "Idle timeout of agent in seconds"
+
 ARG_FILEPATH = "--file"
 ARG_FILEPATH_SHORT = "-f"
 ARG_FILEPATH_DESCRIPTION = "Specify file which should be used for storing passwords,\
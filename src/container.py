@@ -0,0 +1,198 @@
+"""Binary container for password file.  File starts with header, which
+is followed by records:
+
+ header - MAGIC, version (1 byte), length of fields (4 bytes), fields
+ field  - tag (1 byte), length (4 bytes), value
+ record - kind (1 byte), length (4 bytes), payload
+
+All numbers are little endian.  Fields hold metadata about whole file,
+records hold raw ciphertext of entries and tombstones.  Kind of record
+is only hint for readers, which don't want to decrypt record.
+
+Block record holds more entries encrypted together.  Its payload starts
+with count of entries (2 bytes), followed by ciphertext of block.
+Decrypted block is sequence of length (4 bytes) prefixed entries.
+Blocks never contain tombstones.
+"""
+import mmap
+import os
+import shutil
+import struct
+from typing import Dict, Iterator, List, Tuple, Union
+
+MAGIC = b'PMAN'
+VERSION = 1
+
+HEADER_FORMAT = struct.Struct('<4sBI')
+FIELD_FORMAT = struct.Struct('<BI')
+RECORD_FORMAT = struct.Struct('<BI')
+BLOCK_FORMAT = struct.Struct('<H')
+BLOCK_ENTRY_FORMAT = struct.Struct('<I')
+MAX_BLOCK_ENTRIES = 0xFFFF
+
+# Tags of header fields
+FIELD_CIPHER = 1  # Name of cipher used for records (ascii)
+FIELD_VERIFIER = 2  # Known plaintext encrypted by cipher, to check password
+FIELD_WRAPPED_KEY = 3  # Data key encrypted by key derived from password
+
+# Kinds of records
+RECORD_ENTRY = 1
+RECORD_TOMBSTONE = 2
+RECORD_BLOCK = 3
+
+
+class FormatError(ValueError):
+    """Raised when data are not valid container"""
+
+
+class TruncatedError(FormatError):
+    """Raised when record ends after end of data.  Records are read in
+    order, so it is always last record (its write was interrupted)"""
+
+
+def is_container(data: Union[bytes, mmap.mmap]) -> bool:
+    """True if DATA (beginning of file or mapped file) start with
+    container magic"""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+def pack_header(fields: Dict[int, bytes]) -> bytes:
+    """Create header containing FIELDS.  FIELDS maps tag to value"""
+    packed = b''.join(FIELD_FORMAT.pack(tag, len(value)) + value
+                      for tag, value in sorted(fields.items()))
+    return HEADER_FORMAT.pack(MAGIC, VERSION, len(packed)) + packed
+
+def unpack_header(data) -> Tuple[Dict[int, bytes], int]:
+    """Parse header at beginning of DATA.  Return fields and offset of
+    first record"""
+    if len(data) < HEADER_FORMAT.size:
+        raise FormatError("File header is truncated")
+    magic, version, length = HEADER_FORMAT.unpack_from(data)
+    if magic != MAGIC:
+        raise FormatError("File is not password container")
+    if version > VERSION:
+        raise FormatError("Unsupported container version {}".format(version))
+    end = HEADER_FORMAT.size + length
+    if len(data) < end:
+        raise FormatError("File header is truncated")
+    return unpack_fields(data, HEADER_FORMAT.size, end), end
+
+def unpack_fields(data, offset: int, end: int) -> Dict[int, bytes]:
+    """Parse header fields stored in DATA between OFFSET and END"""
+    fields: Dict[int, bytes] = dict()
+    while offset < end:
+        tag, size = FIELD_FORMAT.unpack_from(data, offset)
+        offset += FIELD_FORMAT.size
+        fields[tag] = bytes(data[offset:offset + size])
+        offset += size
+    return fields
+
+def header_size(data) -> int:
+    """Return size of header at beginning of DATA"""
+    if len(data) < HEADER_FORMAT.size:
+        raise FormatError("File header is truncated")
+    return HEADER_FORMAT.size + HEADER_FORMAT.unpack_from(data)[2]
+
+def replace_header(file_path: str, header: bytes, tmp_path: str) -> int:
+    """Replace header of container file at FILE_PATH by HEADER.  Records
+    are copied after new header to TMP_PATH, which is synced to disk and
+    then replaces original file.  Header is never overwritten in place,
+    because interrupted write would destroy the only copy of wrapped
+    key.  Return how much records moved (difference of sizes)"""
+    with open(file_path, 'rb') as opened_file:
+        old_size = header_size(opened_file.read(HEADER_FORMAT.size))
+        opened_file.seek(old_size)
+        with open(tmp_path, 'wb') as new_file:
+            new_file.write(header)
+            shutil.copyfileobj(opened_file, new_file)
+            new_file.flush()
+            os.fsync(new_file.fileno())
+    os.replace(tmp_path, file_path)
+    return len(header) - old_size
+
+def read_header(stream) -> Dict[int, bytes]:
+    """Read header from beginning of binary STREAM and return its fields.
+    After return, STREAM is positioned at first record"""
+    data = stream.read(HEADER_FORMAT.size)
+    if len(data) < HEADER_FORMAT.size:
+        raise FormatError("File header is truncated")
+    length = HEADER_FORMAT.unpack(data)[2]
+    data += stream.read(length)
+    return unpack_header(data)[0]
+
+def pack_record(kind: int, payload: bytes) -> bytes:
+    """Prefix PAYLOAD with record header"""
+    return RECORD_FORMAT.pack(kind, len(payload)) + payload
+
+def record_at(data, offset: int) -> Tuple[int, bytes, int]:
+    """Read record which starts at OFFSET in DATA.  Return tuple (kind,
+    payload, offset of next record).  If DATA is memoryview, payload is
+    view into it (not copy)"""
+    if len(data) - offset < RECORD_FORMAT.size:
+        raise TruncatedError("Record header is truncated")
+    kind, size = RECORD_FORMAT.unpack_from(data, offset)
+    start = offset + RECORD_FORMAT.size
+    if len(data) - start < size:
+        raise TruncatedError("Record is truncated")
+    return kind, data[start:start + size], start + size
+
+def iter_record_offsets(data, offset: int = 0) -> Iterator[Tuple[int, int]]:
+    """Iterate over records in DATA starting at OFFSET without copying
+    payloads.  Yield tuples (kind, offset of record)"""
+    while offset < len(data):
+        if len(data) - offset < RECORD_FORMAT.size:
+            raise TruncatedError("Record header is truncated")
+        kind, size = RECORD_FORMAT.unpack_from(data, offset)
+        if len(data) - offset - RECORD_FORMAT.size < size:
+            raise TruncatedError("Record is truncated")
+        yield kind, offset
+        offset += RECORD_FORMAT.size + size
+
+def read_records(stream) -> Iterator[Tuple[int, bytes]]:
+    """Read records from binary STREAM one by one, until end of stream.
+    Yield tuples (kind, payload)"""
+    while True:
+        data = stream.read(RECORD_FORMAT.size)
+        if not data:
+            return
+        if len(data) < RECORD_FORMAT.size:
+            raise TruncatedError("Record header is truncated")
+        kind, size = RECORD_FORMAT.unpack(data)
+        payload = stream.read(size)
+        if len(payload) < size:
+            raise TruncatedError("Record is truncated")
+        yield kind, payload
+
+def unpack_records(data, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """Iterate over records in DATA starting at OFFSET.  Yield tuples
+    (kind, payload)"""
+    while offset < len(data):
+        kind, payload, offset = record_at(data, offset)
+        yield kind, payload
+
+def pack_block(entries: List[bytes]) -> bytes:
+    """Join serialized ENTRIES to plaintext of one block"""
+    return b''.join(BLOCK_ENTRY_FORMAT.pack(len(x)) + x for x in entries)
+
+def iter_block(data) -> Iterator[memoryview]:
+    """Iterate over serialized entries in decrypted block DATA.  Entries
+    are views into DATA, so they are not copied"""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < BLOCK_ENTRY_FORMAT.size:
+            raise FormatError("Block entry is truncated")
+        size = BLOCK_ENTRY_FORMAT.unpack_from(view, offset)[0]
+        offset += BLOCK_ENTRY_FORMAT.size
+        if len(view) - offset < size:
+            raise FormatError("Block entry is truncated")
+        yield view[offset:offset + size]
+        offset += size
+
+def unpack_block(data) -> List[bytes]:
+    """Split decrypted block DATA to serialized entries"""
+    return [bytes(x) for x in iter_block(data)]
+
+def block_count(data, offset: int) -> int:
+    """Return count of entries in block record, which starts at OFFSET in
+    DATA"""
+    return BLOCK_FORMAT.unpack_from(data, offset + RECORD_FORMAT.size)[0]
@@ -0,0 +1,46 @@
+"""Tests for binary container format"""
+import unittest
+
+import container
+
+
+# pylint: disable=C0111
+class ContainerTestCase(unittest.TestCase):
+    def test_header(self):
+        fields = {1: b'abc', 7: b''}
+        header = container.pack_header(fields)
+        self.assertTrue(container.is_container(header))
+        self.assertEqual((fields, len(header)), container.unpack_header(header))
+
+    def test_records(self):
+        records = [(container.RECORD_ENTRY, b'first'),
+                   (container.RECORD_TOMBSTONE, b''),
+                   (container.RECORD_ENTRY, b'\x00|\n')]
+        data = container.pack_header({})
+        data += b''.join(container.pack_record(*x) for x in records)
+        _, offset = container.unpack_header(data)
+        self.assertEqual(records, list(container.unpack_records(data, offset)))
+
+    def test_block(self):
+        entries = [b'1 1 a b', b'', b'3 3 abc \x00\x01\x02']
+        self.assertEqual(entries, container.unpack_block(container.pack_block(entries)))
+        views = list(container.iter_block(container.pack_block(entries)))
+        self.assertTrue(all(isinstance(x, memoryview) for x in views))
+        self.assertEqual(entries, views)
+        record = container.pack_record(container.RECORD_BLOCK,
+                                       container.BLOCK_FORMAT.pack(3) + b'cipher')
+        self.assertEqual(3, container.block_count(b'xx' + record, 2))
+        with self.assertRaises(container.FormatError):
+            container.unpack_block(container.pack_block(entries)[:-1])
+
+    def test_truncated(self):
+        data = container.pack_record(container.RECORD_ENTRY, b'abcdef')
+        with self.assertRaises(container.FormatError):
+            list(container.unpack_records(data[:-1]))
+        with self.assertRaises(container.FormatError):
+            container.unpack_header(container.pack_header({1: b'abc'})[:-1])
+        self.assertFalse(container.is_container(b'abcd|\nabcd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,29 @@
 """Core - file with classes for core tasks in password manager, like
 working with files, encryption, and searching
 """
+import bisect
+import collections
+import concurrent.futures
+import fnmatch
+import functools
 import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
 import re
 import base64
 import hashlib
+import time
 from difflib import SequenceMatcher
-from typing import List, Iterable, Tuple
+from typing import Any, Callable, Deque, Dict, List, Iterable, Iterator, Optional, Tuple
 
 import cryptography
 
 import constants
+import container
+from index import DEADLINE_CHECK, NGRAM_SIZE, FullTextIndex, PrefixIndex, TrigramIndex, \
+    create_index, glob_prefix, regex_prefix
 
 # Disable TODO errors
 #pylint: disable=W0511
@@ -18,77 +31,404 @@ import constants
 #pylint: disable=R0903
 
 WHITESPACE_PATTERN = re.compile(r'\s')
-PASSWORD_ENTRY_PATTERN = re.compile(r'(\d+)\s+(\d+)\s+(.*)', re.DOTALL)
 KEY_SEARCH_JUNK_PATTERN = re.compile(r'\W+')
 
 
+class InvalidPasswordError(ValueError):
+    """Raised when password doesn't match verifier in file header"""
+
+
+class PartialResults(Exception):
+    """Raised by search, which stopped at its deadline.  FOUND are best
+    results found until then.  Being exception, they are not cached"""
+
+    def __init__(self, found: List[int]) -> None:
+        super().__init__(found)
+        self.found = found
+
+
 class PasswordFileManager:
     """Class for reading and writing binary data to file.  Takes list of
     entries and writes them in such a way, that they can be easily
     distinguished.
 
-    PasswordFileManager is meant to be iterable.  Internal
-    implementation will be probably changed in future, for better
-    memory eficiency
+    PasswordFileManager is meant to be iterable.  In lazy mode, binary
+    file is memory mapped and contents hold only references to entries
+    in records (see make_ref).  Records are decrypted when accessed and
+    last few of them are cached.
 
     version - is counter updated on each change.  Other objects
     reading from this one should always check this number and if it is
-    changed, act accordingly
+    changed, act accordingly.  They can also subscribe to changes, then
+    they are called after each one (see notify)
     """
 
     # TODO: Checks for empty file, and file modified since read
     # TODO: Options for ignoring errors
 
-    def __init__(self, file_path: str, password: str) -> None:
+    def __init__(self, file_path: str, password: str,
+                 settings: Optional[Dict[str, Any]] = None) -> None:
+        settings = settings or dict()
         self.file_path = file_path
-        # Read contents to memory
-        contents = list(self.read_contents())
-        self.cipher = Cipher(password)
-        self.contents = parse_contents(contents, self.cipher)
+        # File format, new (empty) files are always binary containers
+        self.binary = True
+        self.empty = False
+        self.fields: Dict[int, bytes] = dict()
+        self.mapped: Optional[mmap.mmap] = None
+        self.workers = settings.get(constants.SETTINGS_WORKERS, 0)
+        self.block_size = settings.get(constants.SETTINGS_BLOCK_SIZE,
+                                       constants.BLOCK_SIZE)
+        cache_size = settings.get(constants.SETTINGS_LAZY_CACHE_SIZE,
+                                  constants.LAZY_CACHE_SIZE)
+        self.load_record = functools.lru_cache(maxsize=cache_size)(self._load_record)
+        stats = LoadStats()
+        if settings.get(constants.SETTINGS_LAZY, False):
+            self.mapped = map_file(self.file_path)
+        cipher_name = settings.get(constants.SETTINGS_CIPHER, constants.CIPHER)
+        # Contents are list of (key, value) tuples, or references if mapped
+        self.contents: List[Any] = list()
+        if self.mapped is not None:
+            try:
+                self.fields, offset = container.unpack_header(self.mapped)
+                self.cipher = self.create_cipher(password, cipher_name)
+            except ValueError:
+                self.close()
+                raise
+            self.contents = self.map_contents(offset, stats)
+        else:
+            records = self.read_contents(stats)
+            self.cipher = self.create_cipher(password, cipher_name)
+            self.contents = parse_contents(records, self.cipher,
+                                           stats, raw=self.binary,
+                                           workers=self.workers)
+        # Serialized records (entries and tombstones) not yet written to file
+        self.journal: List[bytes] = list()
+        # Records in file (or journal) which don't represent any entry
+        self.stale = stats.stale
+        # File ends with incomplete record, so it can't be appended to
+        self.truncated = stats.truncated > 0
         self.position = 0
         self.version = 0
+        self.listeners: List[Callable[[str, Any], None]] = list()
         # Ratio of decrypted/all (should be 1).  1 is also default
         # for empty -> decrypting empty file should always succeed
         self.success = 1
 
-        if contents:
-            self.success = len(self.contents) // len(contents)
+        if stats.records:
+            self.success = stats.decrypted // stats.records
 
     def __iter__(self):
         """Create iterator"""
+        if self.mapped is not None:
+            return self.PasswordFileManagerIterator(self)
         return self.PasswordFileManagerIterator(self.contents)
 
     def __getitem__(self, index) -> Tuple[str, str]:
-        """Indexing operator"""
-        return self.contents[index]
+        """Indexing operator.  Entries of mapped record, which can't be
+        decrypted, are dropped (like eager mode skips them), so INDEX then
+        refers to entry after them"""
+        while True:
+            entry = self.contents[index]
+            if not isinstance(entry, int):
+                return entry
+            offset, position = split_ref(entry)
+            entries = self.load_record(offset)
+            if entries:
+                return entries[position]
+            self.drop_record(offset)
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def create_cipher(self, password: str, name: str) -> 'Cipher':
+        """Create cipher used by file.  Binary files specify cipher in
+        header (files without it use Fernet), legacy files always use
+        Fernet.  NAME is cipher for new files.
+
+        Entries are encrypted by random data key, which is stored in
+        header encrypted by key derived from PASSWORD.  Files without it
+        use key derived from password directly.  If header contains
+        wrapped key or verifier, password is checked before anything else
+        is decrypted.  Raise InvalidPasswordError if it is wrong"""
+        if self.empty:
+            self.fields[container.FIELD_CIPHER] = name.encode('ascii')
+        name = self.fields.get(container.FIELD_CIPHER, b'').decode('ascii')
+        if not self.binary or not name:
+            name = Cipher.NAME
+        if name not in CIPHERS:
+            raise container.FormatError("Unknown cipher {}".format(name))
+        cipher_class = CIPHERS[name]
+        if self.empty:
+            self.fields[container.FIELD_WRAPPED_KEY] = cipher_class(password).encrypt_raw(
+                os.urandom(constants.KEY_SIZE))
+
+        key = derive_key(password)
+        wrapped = self.fields.get(container.FIELD_WRAPPED_KEY)
+        if wrapped is not None:
+            key = cipher_class(password).decrypt_raw(wrapped)
+            if not key:
+                raise InvalidPasswordError(constants.RESPONSE_ERROR_INVALID_PASSWORD)
+        cipher = cipher_class.from_key(key)
+        if self.empty:
+            self.fields[container.FIELD_VERIFIER] = create_verifier(cipher)
+        verifier = self.fields.get(container.FIELD_VERIFIER)
+        if verifier is not None and not check_verifier(cipher, verifier):
+            raise InvalidPasswordError(constants.RESPONSE_ERROR_INVALID_PASSWORD)
+        return cipher
+
+    def map_contents(self, offset: int, stats: 'LoadStats') -> List[Any]:
+        """Build list of entry references from mapped file, starting at
+        OFFSET.  Only tombstones and first record (to check password) are
+        decrypted, so STATS count only them"""
+        assert self.mapped is not None
+        contents: List[Any] = list()
+        try:
+            for kind, position in container.iter_record_offsets(self.mapped, offset):
+                if kind == container.RECORD_TOMBSTONE:
+                    stats.records += 1
+                    record = self._decrypt_record(position)
+                    if record:
+                        stats.decrypted += 1
+                        stats.stale += apply_record(contents, parse_record(record))
+                    continue
+                count = self.record_entries(position)
+                contents.extend(make_ref(position, x) for x in range(count))
+        except container.TruncatedError:  # Interrupted append
+            stats.truncated += 1
+        # Without verifier, try at least one record
+        if container.FIELD_VERIFIER not in self.fields and contents:
+            stats.records += 1
+            if self._decrypt_record(split_ref(contents[0])[0]):
+                stats.decrypted += 1
+        return contents
 
-    def read_contents(self):
-        """Load contents of file to memory"""
-        contents = read_file(self.file_path).split(constants.SPLITTER)
-        # Remove empty entries
-        return filter(lambda x: True if x else False,
-                      map(delete_whitespace, contents))
+    def drop_record(self, offset: int):
+        """Remove entries of mapped record at OFFSET, which can't be
+        decrypted, and count it in success.  Record stays in file until
+        compaction, like in eager mode"""
+        indices = [i for i, x in enumerate(self.contents)
+                   if isinstance(x, int) and split_ref(x)[0] == offset]
+        deleted = delete_indices(self.contents, indices)
+        self.success = 0
+        self.notify(constants.CHANGE_DELETE, deleted)
+
+    def record_entries(self, offset: int) -> int:
+        """Return count of entries in record at OFFSET in mapped file"""
+        assert self.mapped is not None
+        if self.mapped[offset] == container.RECORD_BLOCK:
+            return container.block_count(self.mapped, offset)
+        return 1
+
+    def _decrypt_record(self, offset: int) -> bytes:
+        """Decrypt record at OFFSET in mapped file.  Ciphertext is not
+        copied out of mapped file"""
+        assert self.mapped is not None
+        with memoryview(self.mapped) as view:
+            kind, payload, _ = container.record_at(view, offset)
+            if kind == container.RECORD_BLOCK:
+                payload = payload[container.BLOCK_FORMAT.size:]
+            return self.cipher.decrypt_raw(payload)
+
+    def _load_record(self, offset: int) -> List[Tuple[str, str]]:
+        """Decrypt and parse entries of record at OFFSET in mapped file.
+        Use load_record, which caches results.  Return empty list if
+        record can't be decrypted"""
+        assert self.mapped is not None
+        decrypted = self._decrypt_record(offset)
+        if not decrypted:
+            return []
+        if self.mapped[offset] == container.RECORD_BLOCK:
+            return list(map(parse_entry, container.iter_block(decrypted)))
+        return [parse_entry(decrypted)]
+
+    def resolve(self, entry: Any) -> Tuple[str, str]:
+        """Return (key, value) for ENTRY from contents, which can be also
+        reference to mapped file"""
+        if isinstance(entry, int):
+            offset, position = split_ref(entry)
+            return self.load_record(offset)[position]
+        return entry
+
+    def read_contents(self, stats: Optional['LoadStats'] = None):
+        """Return iterator over records in file.  File is read in chunks,
+        so whole file is never in memory.  Also detect format of file, set
+        self.binary and read header.  Records are opened again only when
+        iterator starts, so iterator, which is dropped (password is
+        wrong), leaves no file open.  Truncated last record is counted in
+        STATS"""
+        offset = 0
+        with open(self.file_path, 'rb') as opened_file:
+            magic = opened_file.read(len(container.MAGIC))
+            self.binary = not magic or container.is_container(magic)
+            self.empty = not magic
+            if self.binary and not self.empty:
+                opened_file.seek(0)
+                self.fields = container.read_header(opened_file)
+                offset = opened_file.tell()
+        if self.empty:
+            return iter(())
+        if not self.binary:
+            return stream_file(self.file_path, 0, functools.partial(
+                stream_legacy_records, chunk_size=constants.READ_CHUNK_SIZE))
+        return stream_file(self.file_path, offset,
+                           functools.partial(stream_records, stats=stats))
+
+    def subscribe(self, listener: Callable[[str, Any], None]):
+        """Call LISTENER after each change of entries (see notify)"""
+        self.listeners.append(listener)
+
+    def notify(self, event: str, data: Any):
+        """Increment version and pass EVENT to listeners.  Events are:
+
+         CHANGE_INSERT - DATA is (key, value) appended after last entry
+         CHANGE_DELETE - DATA is list of deleted indices, in order in which
+         they were deleted (each index is valid after previous deletion)"""
+        self.version += 1
+        for listener in self.listeners:
+            listener(event, data)
 
     def append_entry(self, first, second):
-        """Append entry to list. For now, also write to file"""
+        """Append entry to list and journal.  Written to file on next
+        save_contents"""
         self.contents.append((first, second))
+        self.journal.append(serialize_entry(first, second))
+        self.notify(constants.CHANGE_INSERT, (first, second))
 
     def save_contents(self):
-        """Write current contents of this object to file"""
-        write_file(self.file_path,
-                   serialize_contents(self.contents, self.cipher))
+        """Write changes to file.  Journal is appended to end of file, whole
+        file is rewritten only if it contains too many stale records, or
+        ends with truncated record"""
+        limit = max(constants.JOURNAL_COMPACT_MIN,
+                    len(self.contents) * constants.JOURNAL_COMPACT_RATIO)
+        if self.stale > limit or self.truncated or \
+           (self.binary and not file_size(self.file_path)):
+            self.compact()
+        elif self.journal:
+            prefix = b'' if self.binary else constants.SPLITTER_NEWLINE.encode('ascii')
+            write_records(self.file_path, prefix, self.journal, self.cipher,
+                          raw=self.binary, block_size=self.block_size, append=True)
+            self.journal.clear()
+
+    def compact(self):
+        """Write current contents of this object to file, dropping
+        tombstones and deleted entries.  Add verifier to header of binary
+        files which don't have it yet.  New file is written next to old
+        one and replaces it, so interrupted write doesn't destroy it"""
+        if self.binary and self.success == 1 and \
+           container.FIELD_VERIFIER not in self.fields:
+            self.fields[container.FIELD_VERIFIER] = create_verifier(self.cipher)
+        if self.mapped is not None:
+            self.compact_mapped()
+        else:
+            header = container.pack_header(self.fields) if self.binary else b''
+            serialized = map(lambda x: serialize_entry(x[0], x[1]), self.contents)
+            tmp_path = self.file_path + constants.TMP_SUFFIX
+            write_records(tmp_path, header, serialized, self.cipher,
+                          raw=self.binary, workers=self.workers,
+                          block_size=self.block_size)
+            os.replace(tmp_path, self.file_path)
+        self.journal.clear()
+        self.stale = 0
+        self.truncated = False
+
+    def compact_mapped(self):
+        """Compact memory mapped file.  Records whose entries are all still
+        present are copied without decryption, other entries are encrypted
+        again.  After write, all entries are mapped"""
+        assert self.mapped is not None
+        header = container.pack_header(self.fields)
+        references: List[Any] = list()
+        pending: List[bytes] = list()  # Entries which must be encrypted
+        # Mapped file is still needed, so write new one next to it
+        tmp_path = self.file_path + constants.TMP_SUFFIX
+        with open(tmp_path, 'wb') as opened_file:
+            opened_file.write(header)
+
+            def write(record: bytes, count: int):
+                references.extend(make_ref(opened_file.tell(), x) for x in range(count))
+                opened_file.write(record)
+
+            groups = [(offset, list(group)) for offset, group in itertools.groupby(
+                self.contents, lambda x: split_ref(x)[0] if isinstance(x, int) else None)]
+            for offset, entries in groups:
+                count = 0 if offset is None else self.record_entries(offset)
+                if entries == [make_ref(offset, x) for x in range(count)]:
+                    for record in pack_entries(pending, self.cipher, self.block_size):
+                        write(*record)
+                    pending.clear()
+                    write(self.mapped[offset:container.record_at(self.mapped, offset)[2]],
+                          count)
+                    continue
+                if offset is not None and not self.load_record(offset):
+                    self.drop_record(offset)  # Skipped like in eager mode
+                    continue
+                for entry in map(self.resolve, entries):
+                    pending.append(serialize_entry(entry[0], entry[1]))
+            for record in pack_entries(pending, self.cipher, self.block_size):
+                write(*record)
+        self.mapped.close()
+        os.replace(tmp_path, self.file_path)
+        self.mapped = map_file(self.file_path)
+        self.contents = references
+        self.load_record.cache_clear()
+
+    def convert(self, cipher: Optional['Cipher'] = None):
+        """Rewrite file as binary container.  If CIPHER is given, all
+        entries are encrypted again by it"""
+        assert self.mapped is None
+        self.binary = True
+        if cipher is not None:
+            self.cipher = cipher
+            self.fields[container.FIELD_CIPHER] = cipher.NAME.encode('ascii')
+            self.fields.pop(container.FIELD_VERIFIER, None)
+            self.fields.pop(container.FIELD_WRAPPED_KEY, None)
+        self.compact()
+
+    def change_password(self, password: str):
+        """Encrypt data key in header by new PASSWORD.  Entries are not
+        encrypted again, only header is written.  Legacy files must be
+        converted to binary first.  New file, which has no header yet, is
+        written whole"""
+        if not self.binary:
+            self.convert()
+        wrapped = type(self.cipher)(password).encrypt_raw(self.cipher.key)
+        self.fields[container.FIELD_WRAPPED_KEY] = wrapped
+        if file_size(self.file_path):
+            self.write_header()
+        else:
+            self.compact()
+
+    def write_header(self):
+        """Write self.fields as header of binary file"""
+        mapped = self.mapped is not None
+        self.close()
+        moved = container.replace_header(self.file_path,
+                                         container.pack_header(self.fields),
+                                         self.file_path + constants.TMP_SUFFIX)
+        if mapped:
+            self.mapped = map_file(self.file_path)
+            # References contain offsets of records in file
+            self.contents = [make_ref(split_ref(x)[0] + moved, split_ref(x)[1])
+                             if isinstance(x, int) else x for x in self.contents]
+            self.load_record.cache_clear()
+
+    def close(self):
+        """Release mapped file"""
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
 
     def delete_entry(self, index):
         """Remove entry from memory (shifts entries one index up)"""
-        if index < len(self.contents):
-            del self.contents[index]
+        self.delete_indices([index])
 
     def delete_indices(self, indices: List[int]):
         """Delete all entries passed as indices via argument"""
-        indices = sorted(indices, reverse=True)
-        for index in indices:
-            if index < len(self.contents):
-                del self.contents[index]
+        deleted = delete_indices(self.contents, indices)
+        if deleted:
+            self.journal.append(serialize_tombstone(indices))
+            self.stale += len(deleted) + 1
+            self.notify(constants.CHANGE_DELETE, deleted)
 
 
     class PasswordFileManagerIterator:
@@ -104,48 +444,386 @@ class PasswordFileManager:
                 return self.contents[self.position]
             raise StopIteration
 
+
+class LoadStats:
+    """Counters collected while parsing password file
+
+    records - count of records, which were decrypted or tried (lazy mode
+    tries only tombstones and first record)
+    decrypted - records which were successfully decrypted
+    stale - tombstones and entries deleted by them
+    truncated - incomplete records at end of file (dropped)"""
+
+    def __init__(self) -> None:
+        self.records = 0
+        self.decrypted = 0
+        self.stale = 0
+        self.truncated = 0
+
 ###########################################################################
 
+class KeyColumns:
+    """Keys of entries of KeyValueStore, their normalized forms (see
+    normalize_key) and search structures over them: trigram index
+    created by ENGINE, sorted keys (prefixes), worker processes (shards)
+    and order by length.  Keys are loaded and structures are built by
+    KeyValueStore on first use, insert and delete then keep them in sync
+    with entries"""
+
+    def __init__(self, engine: Optional[str] = None) -> None:
+        self.engine = engine
+        self.keys: Optional[List[str]] = None
+        self.normalized: Optional[List[str]] = None
+        self.index: Optional[TrigramIndex] = None
+        self.prefixes: Optional[PrefixIndex] = None
+        self.shards: Optional[SearchShards] = None
+        self.by_length: Optional[Tuple[List[int], List[int]]] = None
+
+    def insert(self, key: str):
+        """Append KEY of new entry, if keys are loaded"""
+        self.by_length = None
+        if self.keys is None or self.normalized is None:
+            return
+        normalized = normalize_key(key)
+        self.keys.append(key)
+        self.normalized.append(normalized)
+        if self.shards is not None:
+            self.shards.insert(normalized)
+        if self.index is not None:
+            self.index.insert(normalized)
+        if self.prefixes is not None:
+            self.prefixes.insert(key)
+
+    def delete(self, position: int):
+        """Remove key of entry at POSITION, if keys are loaded"""
+        self.by_length = None
+        if self.keys is None or self.normalized is None:
+            return
+        key = self.keys.pop(position)
+        normalized = self.normalized.pop(position)
+        if self.shards is not None:
+            self.shards.delete(position)
+        if self.index is not None:
+            self.index.delete(position, normalized)
+        if self.prefixes is not None:
+            self.prefixes.delete(position, key)
+
+
 class KeyValueStore:
     """Wrapper around search function, which works with keys and
     values. Additionally provides hints to search, for ignoring non
     word characters.
-    """
 
-    # TODO: Check if data changed and therefore should be updated.
+    Keys are compared in normalized form (see normalize_key), which is
+    computed once for each key and kept next to keys in columns (see
+    KeyColumns).  Query is normalized same way, so search ignores case and
+    non-word characters and SequenceMatcher needs no junk filter.
+
+    Search on keys of big files uses trigram index (see index.py),
+    which is built on first search.  Results are same as from full
+    search.  ENGINE selects implementation of index (see
+    index.ENGINES), default is NumPy if it is installed.  Full-text
+    search ranks entries by BM25 over words of keys and values (see
+    index.FullTextIndex), its index is also built on first search.
+
+    If ENTRIES can be subscribed to (PasswordFileManager), keys and
+    index are updated on each change, instead of being built again.
+    version is version of ENTRIES, which store reflects.
+
+    Searches, which compare query with every key, are split among WORKERS
+    processes (see SearchShards) after start_shards.
+
+    Keys are completed from sorted keys (see index.PrefixIndex), built
+    on first completion.  Same index finds keys by exact match, prefix,
+    glob or regular expression (find_match).  These searches compare
+    keys as they are and return them sorted.
+
+    find_key and find_fulltext can be given deadline.  Search stops when
+    it passes and returns best results found so far, partial is then
+    True.  Keys are scored in order of their upper bound of ratio given
+    by length (see closest_lengths), so search on keys can also stop
+    early, when no other key can be better.  columns.by_length is order
+    of keys by length, built for such search.  Partial results are not cached.
+
+    find_live is search for typing query one character after another.
+    Only keys containing query as subsequence are scored.  narrowing is
+    stack of (query, indices of such keys), query is extension of query
+    below it.  Next query is filtered from keys of its longest prefix on
+    stack, so stack works as cache also for backspace.
+
+    Results are cached by (query, mode, max_results, version), so cached
+    results of old version are never returned.  Other entries are
+    expected not to change.  Query of search on keys is normalized (see
+    normalize_key) before it's cached, so queries differing only in case
+    or punctuation share results.  Other queries are used as they are.
+    """
 
     KEY = 0
     VALUE = 1
 
-    def __init__(self, entries: Iterable[Tuple[str, str]]) -> None:
+    def __init__(self, entries: Iterable[Tuple[str, str]], engine: Optional[str] = None,
+                 cache_size=constants.SEARCH_CACHE_SIZE, workers=0) -> None:
         """Take reference to ENTRIES.  Expected format is iterable of
         key,value tuples.
         """
         self.entries = entries
+        self.workers = workers
+        self.cached_search = functools.lru_cache(maxsize=cache_size)(self._search)
+        self.columns = KeyColumns(engine)
+        self.fulltext: Optional[FullTextIndex] = None
+        self.narrowing: List[Tuple[str, List[int]]] = list()
+        self.partial = False
+        if hasattr(entries, 'subscribe'):
+            entries.subscribe(self.on_change)  # type: ignore
+
+    @property
+    def version(self) -> int:
+        """Version of entries, which store reflects"""
+        return getattr(self.entries, 'version', 0)
+
+    def on_change(self, event: str, data: Any):
+        """Apply change of entries (see PasswordFileManager.notify)"""
+        self.narrowing = list()
+        if event == constants.CHANGE_INSERT:
+            self.columns.insert(data[self.KEY])
+            if self.fulltext is not None:
+                self.fulltext.insert(self.entry_text(data))
+        elif event == constants.CHANGE_DELETE:
+            for position in data:
+                self.columns.delete(position)
+                if self.fulltext is not None:
+                    self.fulltext.delete(position)
+
+    def start_shards(self):
+        """Start worker processes for search, if there are WORKERS and
+        enough keys.  Called once, when password file is unlocked"""
+        normalized = self.load_keys()
+        if self.columns.shards is None and self.workers > 1 and \
+           len(normalized) >= constants.SEARCH_SHARDS_MIN_ENTRIES:
+            self.columns.shards = SearchShards(normalized, self.workers)
+
+    def close(self):
+        """Stop worker processes"""
+        if self.columns.shards is not None:
+            self.columns.shards.close()
+            self.columns.shards = None
+
+    def find_key(self, key: str, max_results=10, deadline: Optional[float] = None) -> List[int]:
+        """Search only on keys.  Stop after DEADLINE seconds, if given"""
+        return self.find(normalize_key(key), constants.SEARCH_MODE_KEY, max_results, deadline)
+
+    def find_fulltext(self, text: str, max_results=10,
+                      deadline: Optional[float] = None) -> List[int]:
+        """Search on keys and also on values.  Stop after DEADLINE
+        seconds, if given"""
+        return self.find(text, constants.SEARCH_MODE_FULL, max_results, deadline)
+
+    def find(self, text: str, mode: str, max_results: int,
+             deadline: Optional[float] = None) -> List[int]:
+        """Search in MODE by cached_search.  Set partial, if search
+        stopped at DEADLINE"""
+        self.partial = False
+        try:
+            return list(self.cached_search(text, mode, max_results, self.version, deadline))
+        except PartialResults as error:
+            self.partial = True
+            return error.found
+
+    def find_live(self, text: str, max_results=10) -> List[int]:
+        """Search on keys containing normalized TEXT as subsequence, best
+        ratio first"""
+        normalized = self.load_keys()
+        text = normalize_key(text)
+        while self.narrowing and not text.startswith(self.narrowing[-1][0]):
+            self.narrowing.pop()
+        if not text:
+            return []
+        if not self.narrowing or self.narrowing[-1][0] != text:
+            indices = self.narrowing[-1][1] if self.narrowing else range(len(normalized))
+            pattern = re.compile(".*?".join(map(re.escape, text)), re.DOTALL)
+            self.narrowing.append((text, [x for x in indices
+                                          if pattern.search(normalized[x])]))
+        found = self.narrowing[-1][1]
+        scored = search_scored(found, text, normalized.__getitem__, max_results=max_results)
+        return [found[x] for x, _ in scored]
+
+    def find_match(self, text: str, mode: str, max_results=10) -> List[int]:
+        """Search on keys equal to TEXT (SEARCH_MODE_EXACT), starting with
+        TEXT (SEARCH_MODE_PREFIX), matching glob TEXT (SEARCH_MODE_GLOB)
+        or containing match of regular expression TEXT
+        (SEARCH_MODE_REGEX).  Raise re.error if TEXT is not valid regular
+        expression"""
+        return self.find(text, mode, max_results)
+
+    def complete(self, prefix: str, max_results=constants.COMPLETE_MAX_RESULTS) -> List[str]:
+        """Return sorted distinct keys starting with PREFIX"""
+        return self.build_prefixes().complete(prefix, max_results)
+
+    def build_prefixes(self) -> PrefixIndex:
+        """Return index of sorted keys, create it if it doesn't exist"""
+        self.load_keys()
+        if self.columns.prefixes is None:
+            self.columns.prefixes = PrefixIndex(self.columns.keys)  # type: ignore
+        return self.columns.prefixes
+
+    def search_match(self, text: str, mode: str, max_results: int) -> List[int]:
+        """Search in one of match modes (see find_match) without cache.
+        Glob and regular expressions are checked only on keys starting
+        with their literal prefix"""
+        prefixes = self.build_prefixes()
+        if mode == constants.SEARCH_MODE_EXACT:
+            return prefixes.find(text, max_results)
+        if mode == constants.SEARCH_MODE_PREFIX:
+            return prefixes.matching(text, max_results)
+        if mode == constants.SEARCH_MODE_GLOB:
+            return prefixes.matching(glob_prefix(text), max_results,
+                                     re.compile(fnmatch.translate(text)).match)
+        return prefixes.matching(regex_prefix(text), max_results, re.compile(text).search)
+
+    def cache_info(self) -> Any:
+        """Return hits and misses of search cache (see functools.lru_cache)"""
+        return self.cached_search.cache_info()
+
+    def _search(self, text: str, mode: str, max_results: int, version: int,
+                deadline: Optional[float] = None) -> List[int]:
+        """Search in MODE, use cached_search, which caches results.
+        VERSION is only part of key of cache.  Raise PartialResults, if
+        search takes more than DEADLINE seconds"""
+        # pylint: disable=W0613
+        until = None if deadline is None else time.monotonic() + deadline
+        if mode == constants.SEARCH_MODE_FULL:
+            return self.search_fulltext(text, max_results, until)
+        if mode in constants.SEARCH_MATCH_MODES:
+            return self.search_match(text, mode, max_results)
+        return self.search_key(text, max_results, until)
+
+    def find_key_many(self, texts: List[str], max_results=10) -> List[List[int]]:
+        """Search for each of TEXTS on keys.  Big files are searched by
+        index (and cache) for each text, small ones are searched for all
+        texts in one pass over keys"""
+        normalized = self.build_index()
+        if self.columns.index is not None or self.columns.shards is not None:
+            return [self.find_key(x, max_results) for x in texts]
+        return search_many(normalized, [normalize_key(x) for x in texts], lambda x: x,
+                           max_results=max_results)
 
-    def find_key(self, key: str, max_results=10):
-        """Search only on keys"""
-        return search(self.entries, key, lambda x: x[self.KEY],
-                      junk_filter=is_relevant_for_search, max_results=max_results)
+    def load_keys(self) -> List[str]:
+        """Create list of keys and their normalized forms, if they don't
+        exist yet.  Return normalized keys"""
+        if self.columns.keys is None or self.columns.normalized is None:
+            self.columns.keys = [x[self.KEY] for x in self.entries]
+            self.columns.normalized = list(map(normalize_key, self.columns.keys))
+        return self.columns.normalized
 
-    def find_fulltext(self, text: str, max_results=10):
-        """Search on keys and also on values"""
-        return search(self.entries, text, lambda x: x[self.KEY] + x[self.VALUE],
-                      junk_filter=is_relevant_for_search, max_results=max_results)
+    def build_index(self) -> List[str]:
+        """Load keys and create index, if file is big enough.  Return
+        normalized keys"""
+        normalized = self.load_keys()
+        if self.columns.index is None and len(normalized) >= constants.SEARCH_INDEX_MIN_ENTRIES:
+            self.columns.index = create_index(normalized, self.columns.engine)
+        return normalized
 
+    def search_key(self, key: str, max_results: int, until: Optional[float] = None) -> List[int]:
+        """Search normalized KEY on keys without cache.  Raise
+        PartialResults, when time.monotonic() reaches UNTIL"""
+        self.build_index()
+        if self.columns.index is None or len(key) < NGRAM_SIZE:
+            return self.scan_keys(key, max_results, until)
+        return self.find_key_indexed(key, max_results, until)
+
+    def scan_keys(self, key: str, max_results: int, until: Optional[float] = None) -> List[int]:
+        """Compare normalized KEY with every key, in shards if they are
+        started.  If some worker died, shards are closed and keys are
+        searched here.  With UNTIL, keys are scored by search_until"""
+        normalized = self.load_keys()
+        if self.columns.shards is not None:
+            try:
+                return self.columns.shards.search(key, max_results, until)
+            except (OSError, EOFError):
+                self.close()
+        if until is None:
+            return search(normalized, key, lambda x: x, max_results=max_results)
+        if self.columns.by_length is None:
+            self.columns.by_length = length_order(normalized)
+        scored, partial = search_until(normalized, key, self.columns.by_length, until, max_results)
+        if partial:
+            raise PartialResults([x[0] for x in scored])
+        return [x[0] for x in scored]
+
+    def find_key_indexed(self, key: str, max_results: int,
+                         until: Optional[float] = None) -> List[int]:
+        """Score candidates from index first.  Score of MAX_RESULTS-th best
+        is threshold, which every other entry must be able to reach,
+        otherwise it is skipped.  KEY is normalized.  Raise
+        PartialResults with best scored entries, when time.monotonic()
+        reaches UNTIL"""
+        assert self.columns.index is not None and self.columns.normalized is not None
+        normalized = self.columns.normalized
+        matcher = SequenceMatcher(None, autojunk=False)
+        matcher.set_seq2(key)
+        scores = {x: _get_ratio(matcher, normalized[x])
+                  for x in self.columns.index.candidates(key, constants.SEARCH_INDEX_CANDIDATES)}
+        threshold = min(heapq.nlargest(max_results, scores.values()), default=0)
+        if len(scores) < max_results or not threshold:
+            # Entries without common character have score 0, so all must
+            # be compared
+            return self.scan_keys(key, max_results, until)
+        partial = False
+        for count, index in enumerate(self.columns.index.bounded(key, threshold)):
+            if until is not None and count % DEADLINE_CHECK == 0 and time.monotonic() >= until:
+                partial = True
+                break
+            if index not in scores:
+                scores[index] = _get_ratio(matcher, normalized[index])
+        # Sort by index first, so ties are resolved like in full search
+        largest = heapq.nlargest(max_results, sorted(scores.items()), key=lambda x: x[1])
+        if partial:
+            raise PartialResults([x[0] for x in largest])
+        return [x[0] for x in largest]
+
+    def search_fulltext(self, text: str, max_results: int,
+                        until: Optional[float] = None) -> List[int]:
+        """Search on keys and values without cache.  Raise
+        PartialResults, when time.monotonic() reaches UNTIL"""
+        if self.fulltext is None:
+            self.fulltext = FullTextIndex(self.entry_text(x) for x in self.entries)
+        found, partial = self.fulltext.search_until(text, max_results, until)
+        if partial:
+            raise PartialResults(found)
+        return found
+
+    @classmethod
+    def entry_text(cls, entry: Tuple[str, str]) -> str:
+        """Text of ENTRY indexed by full-text search"""
+        return entry[cls.KEY] + " " + entry[cls.VALUE]
 
 ###########################################################################
 
 
 class Cipher:
     """Class for encryption decryption. In future cryptography library
-    will probably be removed and replaced with direct calls to openssl"""
+    will probably be removed and replaced with direct calls to openssl
+
+    This is default (Fernet) cipher, other ciphers are subclasses
+    registered in CIPHERS under their NAME"""
+
+    NAME = "fernet"
 
     def __init__(self, password: str) -> None:
+        self.set_key(derive_key(password))
+
+    @classmethod
+    def from_key(cls, key: bytes) -> 'Cipher':
+        """Create cipher from 32 byte KEY instead of password"""
+        cipher = cls.__new__(cls)
+        cipher.set_key(key)
+        return cipher
+
+    def set_key(self, key: bytes):
+        """Use 32 byte KEY for encryption"""
         from cryptography.fernet import Fernet
-        hashed = hashlib.sha256(str(password).encode('utf-8'))
-        key = base64.urlsafe_b64encode(hashed.digest())
-        self.fernet = Fernet(key)
+        self.key = key
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
 
     def encrypt(self, secret: bytes) -> bytes:
         """Encrypt SECRET bytes with PASSWORD"""
@@ -165,12 +843,109 @@ class Cipher:
                 cryptography.exceptions.InvalidKey, TypeError):
             return b''
 
+    def encrypt_raw(self, secret: bytes) -> bytes:
+        """Encrypt SECRET and return raw ciphertext (fernet token without
+        base64 encoding)"""
+        return base64.urlsafe_b64decode(self.encrypt(secret))
+
+    def decrypt_raw(self, cipher_text: bytes) -> bytes:
+        """Decrypt raw CIPHER_TEXT created by encrypt_raw"""
+        return self.decrypt(base64.urlsafe_b64encode(cipher_text))
+
+
+class AeadCipher(Cipher):
+    """Base for AEAD ciphers from cryptography library.  Ciphertext is
+    random nonce followed by encrypted data and tag.  Raw ciphertext is
+    same as normal one"""
+
+    NONCE_SIZE = 12
+
+    def set_key(self, key: bytes):
+        """Use 32 byte KEY for encryption"""
+        self.key = key
+        self.aead = self.create_aead(key)
+
+    def __getstate__(self):
+        """AEAD objects can't be pickled (for worker processes), so only
+        key is pickled"""
+        return self.key
+
+    def __setstate__(self, key: bytes):
+        self.set_key(key)
+
+    @staticmethod
+    def create_aead(key: bytes) -> Any:
+        """Return AEAD object from cryptography library"""
+        raise NotImplementedError()
+
+    def encrypt(self, secret: bytes) -> bytes:
+        """Encrypt SECRET bytes with PASSWORD"""
+        nonce = os.urandom(self.NONCE_SIZE)
+        try:
+            return nonce + self.aead.encrypt(nonce, secret, None)
+        except (TypeError, ValueError):
+            return b''
+
+    def decrypt(self, cipher_text: bytes) -> bytes:
+        """Decrypt CIPHER_TEXT bytes with PASSWORD"""
+        from cryptography.exceptions import InvalidTag
+        try:
+            return self.aead.decrypt(cipher_text[:self.NONCE_SIZE],
+                                     cipher_text[self.NONCE_SIZE:], None)
+        except (InvalidTag, TypeError, ValueError):
+            return b''
+
+    def encrypt_raw(self, secret: bytes) -> bytes:
+        return self.encrypt(secret)
+
+    def decrypt_raw(self, cipher_text: bytes) -> bytes:
+        return self.decrypt(cipher_text)
+
+
+class AesGcmCipher(AeadCipher):
+    """AES-256 in GCM mode"""
+    NAME = "aes-gcm"
+
+    @staticmethod
+    def create_aead(key: bytes) -> Any:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        return AESGCM(key)
+
+
+class ChaChaCipher(AeadCipher):
+    """ChaCha20 with Poly1305 authentication"""
+    NAME = "chacha20-poly1305"
+
+    @staticmethod
+    def create_aead(key: bytes) -> Any:
+        from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+        return ChaCha20Poly1305(key)
+
+
+CIPHERS: Dict[str, Any] = {
+    Cipher.NAME: Cipher,
+    AesGcmCipher.NAME: AesGcmCipher,
+    ChaChaCipher.NAME: ChaChaCipher,
+}
+
 ###########################################################################
 
 ###########################################
 ##############  METHODS  ##################
 ###########################################
 
+def create_verifier(cipher: Cipher) -> bytes:
+    """Encrypt known text by CIPHER.  Stored in header of file"""
+    return cipher.encrypt_raw(constants.VERIFIER.encode('ascii'))
+
+def check_verifier(cipher: Cipher, verifier: bytes) -> bool:
+    """True if VERIFIER from file can be decrypted by CIPHER"""
+    return cipher.decrypt_raw(verifier) == constants.VERIFIER.encode('ascii')
+
+def derive_key(password: str) -> bytes:
+    """Derive 32 byte key from PASSWORD"""
+    return hashlib.sha256(str(password).encode('utf-8')).digest()
+
 def read_file(file_path: str) -> str:
     """Simple function for reading file"""
     with open(file_path, 'r') as opened_file:
@@ -182,15 +957,76 @@ def write_file(file_path: str, contents: str):
     with open(file_path, 'w') as opened_file:
         opened_file.write(contents)
 
+def read_binary_file(file_path: str) -> bytes:
+    """Read whole file as bytes"""
+    with open(file_path, 'rb') as opened_file:
+        return opened_file.read()
+
+def stream_file(file_path: str, offset: int, stream: Callable) -> Iterator[Any]:
+    """Open FILE_PATH at OFFSET, when first record is requested, and yield
+    records read by STREAM from opened file (STREAM closes it)"""
+    opened_file = open(file_path, 'rb', buffering=constants.READ_CHUNK_SIZE)
+    opened_file.seek(offset)
+    yield from stream(opened_file)
+
+def stream_records(opened_file,
+                   stats: Optional[LoadStats] = None) -> Iterator[Tuple[int, bytes]]:
+    """Yield records (kind, payload) from binary OPENED_FILE (positioned
+    after header).  File is closed at the end.  With STATS, truncated
+    last record is dropped and counted, otherwise FormatError is raised"""
+    with opened_file:
+        try:
+            yield from container.read_records(opened_file)
+        except container.TruncatedError:
+            if stats is None:
+                raise
+            stats.truncated += 1
+
+def stream_legacy_records(opened_file, chunk_size: int) -> Iterator[str]:
+    """Read legacy (hex) records from OPENED_FILE in chunks of CHUNK_SIZE
+    and yield them one by one without whitespace.  File is closed at the
+    end"""
+    with opened_file:
+        rest = ''
+        while True:
+            chunk = opened_file.read(chunk_size)
+            if not chunk:
+                break
+            parts = (rest + chunk.decode('ascii')).split(constants.SPLITTER)
+            rest = parts.pop()
+            for part in filter(len, map(delete_whitespace, parts)):
+                yield part
+        rest = delete_whitespace(rest)
+        if rest:
+            yield rest
+
+def map_file(file_path: str) -> Optional[mmap.mmap]:
+    """Memory map binary password file for reading.  Return None if file
+    is empty or it is not binary container"""
+    with open(file_path, 'rb') as opened_file:
+        if not os.fstat(opened_file.fileno()).st_size:
+            return None
+        mapped = mmap.mmap(opened_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if not container.is_container(mapped):
+        mapped.close()
+        return None
+    return mapped
+
+def file_size(file_path: str) -> int:
+    """Return size of file, or 0 if file doesn't exist"""
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
 def delete_whitespace(dirty_string: str) -> str:
     """Delete all spaces and newlines from DIRTY_STRING"""
     return re.sub(WHITESPACE_PATTERN, '', dirty_string)
 
-def is_relevant_for_search(character: str) -> bool:
-    """Function for hinting SequenceMatcher about junk letters"""
-    if re.match(KEY_SEARCH_JUNK_PATTERN, character) is None:
-        return False
-    return True
+def normalize_key(key: str) -> str:
+    """Form of KEY compared by search, without case and non-word
+    characters"""
+    return KEY_SEARCH_JUNK_PATTERN.sub("", key.casefold())
 
 def process_entry(entry: str) -> str:
     """
@@ -208,37 +1044,265 @@ def serialize_entry(key, value) -> bytes:
     value = process_entry(str(value))
     return '{} {} {} {}'.format(len(key), len(value), key, value).encode('utf-8')
 
-def parse_entry(entry: bytes) -> Tuple[str, str]:
+def parse_entry(entry) -> Tuple[str, str]:
+    """
+    Given decrypted entry (bytes or memoryview), return search key and
+    secret value. If format is incorrect, or entry is corrupted, throws
+    various exceptions.  Lengths are in characters, so entry is decoded
+    once and header is split by str.split, which runs in C
+    """
+    text = str(entry, 'utf-8')
+    parts = text.split(None, 2)
+    if len(parts) == 2 and text[-1:].isspace():  # Empty key and value
+        parts.append("")
+    key_length, value_length, rest = parts
+    if text[:1].isspace() or not key_length.isdecimal() or not value_length.isdecimal():
+        raise ValueError("Invalid entry header")
+    start = int(key_length)
+    return (process_entry(rest[:start]),
+            process_entry(rest[start + 1:start + 1 + int(value_length)]))
+
+def serialize_tombstone(indices: Iterable[int]) -> bytes:
     """
-    Given decrypted entry, return search key and secret value. If
-    format is incorrect, or entry is corrupted, throws various exceptions
+    Transform indices of deleted entries to format:
+    delete index index ...
     """
-    text = entry.decode('utf-8')
-    match = re.fullmatch(PASSWORD_ENTRY_PATTERN, text)
-    if not match:
-        raise ValueError
-    data = match.groups()
-    text = process_entry(data[2])
-    return (process_entry(text[0:int(data[0])]),
-            process_entry(text[int(data[0]) + 1 :
-                               int(data[0]) + 1 + int(data[1])]))
-
-def parse_contents(contents, cipher: Cipher) -> List[Tuple[str, str]]:
+    parts = [constants.JOURNAL_TOMBSTONE] + list(map(str, indices))
+    return ' '.join(parts).encode('utf-8')
+
+def parse_tombstone(entry: bytes) -> Optional[List[int]]:
+    """Given decrypted entry, return list of deleted indices if entry is
+    tombstone.  Return None for any other entry"""
+    tombstone = constants.JOURNAL_TOMBSTONE.encode('utf-8')
+    if bytes(entry[:len(tombstone)]) != tombstone:  # Entries start with digit
+        return None
+    parts = entry.split()
+    if parts[0] != tombstone:
+        return None
+    return list(map(int, parts[1:]))
+
+def delete_indices(contents: list, indices: Iterable[int]) -> List[int]:
+    """Delete INDICES from list CONTENTS (out of range indices are
+    ignored).  Return list of deleted indices in order of deletion"""
+    deleted = list()
+    for index in sorted(indices, reverse=True):
+        if index < len(contents):
+            del contents[index]
+            deleted.append(index)
+    return deleted
+
+def parse_record(record: bytes) -> Any:
+    """Parse decrypted RECORD from file.  Return (key, value) tuple for
+    entry, or list of deleted indices for tombstone"""
+    indices = parse_tombstone(record)
+    if indices is None:
+        return parse_entry(record)
+    return indices
+
+def apply_record(contents: list, parsed: Any) -> int:
+    """Apply one PARSED record (see parse_record) to CONTENTS.  Entry is
+    appended, tombstone deletes entries.  Return number of records which
+    became stale"""
+    if isinstance(parsed, list):
+        return len(delete_indices(contents, parsed)) + 1
+    contents.append(parsed)
+    return 0
+
+def make_ref(offset: int, position: int) -> int:
+    """Create reference to entry at POSITION in record at OFFSET in
+    file.  Reference is just int, so it doesn't cost much memory"""
+    return (offset << 16) | position
+
+def split_ref(reference: int) -> Tuple[int, int]:
+    """Inverse of make_ref, return tuple (offset, position)"""
+    return reference >> 16, reference & 0xFFFF
+
+def decrypt_and_parse(cipher: Cipher, raw: bool, record) -> Optional[list]:
+    """Decrypt one RECORD from file and parse it.  Raw records are tuples
+    (kind, payload), others are hex strings.  Return list of parsed
+    entries (one, or more for block), or None if record couldn't be
+    decrypted"""
+    kind = container.RECORD_ENTRY
+    if raw:
+        kind, payload = record
+        if kind == container.RECORD_BLOCK:
+            payload = memoryview(payload)[container.BLOCK_FORMAT.size:]
+        decrypted = cipher.decrypt_raw(payload)
+    else:
+        decrypted = cipher.decrypt(bytes.fromhex(record))
+    if not decrypted:
+        return None
+    if kind == container.RECORD_BLOCK:
+        # Blocks never contain tombstones
+        return list(map(parse_entry, container.iter_block(decrypted)))
+    return [parse_record(decrypted)]
+
+def decrypt_and_parse_batch(cipher: Cipher, raw: bool, batch: list) -> list:
+    """Decrypt and parse list of records.  Executed by worker processes"""
+    return [decrypt_and_parse(cipher, raw, record) for record in batch]
+
+def parse_records(contents, cipher: Cipher, raw=False, workers=0) -> Iterator[Any]:
+    """Decrypt and parse records in CONTENTS and yield them in original
+    order (see decrypt_and_parse).  Big files are processed by pool of
+    WORKERS processes (see map_batches)"""
+    task = functools.partial(decrypt_and_parse_batch, cipher, raw)
+    for batch in map_batches(task, contents, workers):
+        yield from batch
+
+def map_batches(func, iterable, workers=0) -> Iterator[Any]:
+    """Split ITERABLE to batches of PARALLEL_BATCH_SIZE items, call FUNC
+    on each batch and yield results in original order.  If WORKERS is
+    more than 1 and there are at least PARALLEL_MIN_RECORDS items,
+    batches are processed by pool of WORKERS processes.  Only few
+    batches are in flight at once, so ITERABLE is never read whole to
+    memory"""
+    iterator = iter(iterable)
+    if workers > 1:
+        head = list(itertools.islice(iterator, constants.PARALLEL_MIN_RECORDS))
+        iterator = itertools.chain(head, iterator)
+        if len(head) < constants.PARALLEL_MIN_RECORDS:
+            workers = 0
+    batches = split_to_batches(iterator, constants.PARALLEL_BATCH_SIZE)
+    if workers <= 1:
+        yield from map(func, batches)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending: Deque[concurrent.futures.Future] = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(func, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def split_to_batches(iterable, size: int) -> Iterator[list]:
+    """Split ITERABLE to lists of SIZE items (last can be shorter)"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def parse_contents(contents, cipher: Cipher, stats: Optional[LoadStats] = None,
+                   raw=False, workers=0) -> List[Tuple[str, str]]:
     """Given iterable object, containing entries from password file for
     each entry parse its contents (also decrypt) and return as list of
-    tuples (key, value)
+    tuples (key, value).  Tombstones are replayed in order in which
+    they were written.
 
     Argument:
-     Iterable object
+     Iterable object - hex strings, or (kind, raw ciphertext) if RAW is True
+     STATS - optional object, which is filled with counters
+     WORKERS - number of processes used for decryption of big files
 
     Return:
      List of tuples (key, value)
 
     """
-    tmp = map(bytes.fromhex, contents)
-    decrypted = map(cipher.decrypt, tmp)
-    decrypted = filter(len, decrypted)
-    return list(map(parse_entry, decrypted))
+    if stats is None:
+        stats = LoadStats()
+    result: List[Tuple[str, str]] = list()
+    for parsed in parse_records(contents, cipher, raw, workers):
+        stats.records += 1
+        if parsed is None:
+            continue
+        stats.decrypted += 1
+        for item in parsed:
+            stats.stale += apply_record(result, item)
+    return result
+
+def serialize_records(records: Iterable[bytes], cipher: Cipher) -> str:
+    """Given iterable of serialized records, encrypt them, transform to
+    hex and join to string"""
+    hserialized = map(lambda x: cipher.encrypt(x).hex(), records)
+    return constants.SPLITTER_NEWLINE.join(hserialized)
+
+def encrypt_batch(cipher: Cipher, raw: bool, block_size: int,
+                  batch: List[bytes]) -> bytes:
+    """Encrypt list of serialized records and encode them for file.  Raw
+    records are packed as container records (see pack_entries), other
+    are hex encoded and joined by separator.  Executed by worker
+    processes"""
+    if raw:
+        return pack_records(batch, cipher, block_size)
+    return serialize_records(batch, cipher).encode('ascii')
+
+def write_records(file_path: str, prefix: bytes, records: Iterable[bytes],
+                  cipher: Cipher, raw=False, workers=0, block_size=0, append=False):
+    """Encrypt serialized RECORDS and write them to file after PREFIX
+    (header).  Records are written batch by batch as they are encrypted,
+    by pool of WORKERS processes for big files (see map_batches).  RAW
+    selects binary or legacy (hex) encoding, binary entries are grouped
+    to blocks of BLOCK_SIZE"""
+    separator = b'' if raw else constants.SPLITTER_NEWLINE.encode('ascii')
+    task = functools.partial(encrypt_batch, cipher, raw, block_size)
+    with open(file_path, 'ab' if append else 'wb') as opened_file:
+        opened_file.write(prefix)
+        for index, chunk in enumerate(map_batches(task, records, workers)):
+            if index:
+                opened_file.write(separator)
+            opened_file.write(chunk)
+
+def record_kind(record: bytes) -> int:
+    """Return container kind of serialized RECORD"""
+    if parse_tombstone(record) is None:
+        return container.RECORD_ENTRY
+    return container.RECORD_TOMBSTONE
+
+def pack_block(entries: List[bytes], cipher: Cipher) -> bytes:
+    """Encrypt serialized ENTRIES together as one block record"""
+    payload = cipher.encrypt_raw(container.pack_block(entries))
+    return container.pack_record(container.RECORD_BLOCK,
+                                 container.BLOCK_FORMAT.pack(len(entries)) + payload)
+
+def pack_entries(records: Iterable[bytes], cipher: Cipher,
+                 block_size=0) -> Iterator[Tuple[bytes, int]]:
+    """Encrypt serialized RECORDS and pack them as container records.  If
+    BLOCK_SIZE is set, consecutive entries are encrypted together in
+    blocks of about BLOCK_SIZE bytes.  Tombstones are always separate
+    records.  Yield tuples (packed record, count of entries in it)"""
+    block: List[bytes] = list()
+    size = 0
+    for record in records:
+        kind = record_kind(record)
+        if kind == container.RECORD_ENTRY and block_size:
+            if block and (size + len(record) > block_size or
+                          len(block) == container.MAX_BLOCK_ENTRIES):
+                yield pack_block(block, cipher), len(block)
+                block, size = list(), 0
+            block.append(record)
+            size += len(record)
+            continue
+        if block:
+            yield pack_block(block, cipher), len(block)
+            block, size = list(), 0
+        count = 1 if kind == container.RECORD_ENTRY else 0
+        yield container.pack_record(kind, cipher.encrypt_raw(record)), count
+    if block:
+        yield pack_block(block, cipher), len(block)
+
+def pack_records(records: Iterable[bytes], cipher: Cipher, block_size=0) -> bytes:
+    """Given iterable of serialized records, encrypt them and pack them
+    as container records (see pack_entries)"""
+    return b''.join(x[0] for x in pack_entries(records, cipher, block_size))
+
+def convert_file(file_path: str, password: str,
+                 cipher_name: Optional[str] = None) -> bool:
+    """Convert legacy (hex) password file to binary container.  If
+    CIPHER_NAME is given, entries are encrypted again by this cipher.
+    File is converted only if all entries were decrypted.  Return True on
+    success"""
+    try:
+        pass_file = PasswordFileManager(file_path, password)
+    except InvalidPasswordError:
+        return False
+    if pass_file.success != 1:
+        return False
+    cipher = CIPHERS[cipher_name](password) if cipher_name else None
+    pass_file.convert(cipher)
+    return True
 
 def serialize_contents(contents, cipher: Cipher) -> str:
     """Given iterable of tuples (str, str), transform them to password
@@ -246,8 +1310,7 @@ def serialize_contents(contents, cipher: Cipher) -> str:
     to string
     """
     serialized = map(lambda x: serialize_entry(x[0], x[1]), contents)
-    hserialized = map(lambda x: cipher.encrypt(x).hex(), serialized)
-    return constants.SPLITTER_NEWLINE.join(hserialized)
+    return serialize_records(serialized, cipher)
 
 
 def _get_ratio(sequence_matcher, text):
@@ -262,12 +1325,218 @@ def search(entries, text: str, func, junk_filter=None, max_results=10) -> List[i
     best match. Match max MAX_RESULTS entries. FUNC is given one entry
     and must transform it to one string.
     """
-    matcher: SequenceMatcher = SequenceMatcher(junk_filter,
-                                               autojunk=False)
+    return [x[0] for x in search_scored(entries, text, func, junk_filter, max_results)]
+
+def search_scored(entries, text: str, func, junk_filter=None,
+                  max_results=10) -> List[Tuple[int, float]]:
+    """Same as search, but return list of (index, ratio)."""
+    return search_scored_many(entries, [text], func, junk_filter, max_results)[0]
+
+def search_many(entries, texts: List[str], func, junk_filter=None,
+                max_results=10) -> List[List[int]]:
+    """Search for each of TEXTS, like search.  ENTRIES are iterated only
+    once and FUNC is called once for each entry"""
+    return [[x[0] for x in scored]
+            for scored in search_scored_many(entries, texts, func, junk_filter, max_results)]
+
+def search_scored_many(entries, texts: List[str], func, junk_filter=None,
+                       max_results=10) -> List[List[Tuple[int, float]]]:
+    """Search for each of TEXTS and return lists of (index, ratio).
+
+    Best entries of each text are kept in min-heap of (ratio, -index).
+    Ratio is computed only if its upper bounds (real_quick_ratio,
+    quick_ratio) are better than worst kept entry, equal ratio is not
+    enough, because ties are resolved by index.
+    """
+    matchers: List[SequenceMatcher] = list()
+    for text in texts:
+        matcher = SequenceMatcher(junk_filter, autojunk=False)
+        matcher.set_seq2(text)
+        matchers.append(matcher)
+    if max_results <= 0:
+        return [[] for _ in texts]
+    heaps: List[List[Tuple[float, int]]] = [list() for _ in texts]
+    for index, entry in enumerate(entries):
+        string = func(entry)
+        for matcher, best in zip(matchers, heaps):
+            matcher.set_seq1(string)
+            if len(best) < max_results:
+                heapq.heappush(best, (matcher.ratio(), -index))
+                continue
+            worst = best[0][0]
+            if matcher.real_quick_ratio() <= worst or matcher.quick_ratio() <= worst:
+                continue
+            ratio = matcher.ratio()
+            if ratio > worst:
+                heapq.heapreplace(best, (ratio, -index))
+    return [[(-x[1], x[0]) for x in sorted(best, reverse=True)] for best in heaps]
+
+def length_order(keys: List[str]) -> Tuple[List[int], List[int]]:
+    """Return indices of KEYS sorted by length of key and their lengths"""
+    order = sorted(range(len(keys)), key=lambda x: len(keys[x]))
+    return order, [len(keys[x]) for x in order]
+
+def length_bound(first: int, second: int) -> float:
+    """Upper bound of ratio of texts with lengths FIRST and SECOND, same
+    as SequenceMatcher.real_quick_ratio"""
+    total = first + second
+    return 2.0 * min(first, second) / total if total else 1.0
+
+def closest_lengths(by_length: Tuple[List[int], List[int]],
+                    length: int) -> Iterator[Tuple[float, int]]:
+    """Yield (length_bound, index) of keys in BY_LENGTH (see
+    length_order) for text of LENGTH, highest bound first.  Both sides
+    of LENGTH are walked from it, so keys are not sorted again"""
+    order, lengths = by_length
+    upper = bisect.bisect_left(lengths, length)
+    lower = upper - 1
+    while lower >= 0 or upper < len(order):
+        lower_bound = length_bound(lengths[lower], length) if lower >= 0 else -1.0
+        upper_bound = length_bound(lengths[upper], length) if upper < len(order) else -1.0
+        if upper_bound >= lower_bound:
+            yield upper_bound, order[upper]
+            upper += 1
+        else:
+            yield lower_bound, order[lower]
+            lower -= 1
+
+def search_until(keys: List[str], text: str, by_length: Tuple[List[int], List[int]],
+                 until: float, max_results=10) -> Tuple[List[Tuple[int, float]], bool]:
+    """Search for TEXT in KEYS like search_scored (without junk filter),
+    but stop when time.monotonic() reaches UNTIL.  Return (best scored
+    keys, partial).
+
+    Keys are scored in order of closest_lengths, so keys, which can be
+    most similar to TEXT, are scored first.  When bound of next key is
+    worse than worst kept key, no other key can be better, so search
+    ends early and results are same as from search_scored.
+    """
+    if max_results <= 0:
+        return [], False
+    matcher = SequenceMatcher(None, autojunk=False)
     matcher.set_seq2(text)
-    # Create list of (index, rating)
-    indices = map(lambda x: (x[0], _get_ratio(matcher, func(x[1]))),
-                  enumerate(entries))
-    # Get only top MAX_RESULTS
-    largest = heapq.nlargest(max_results, indices, key=lambda x: x[1])
-    return list(map(lambda x: x[0], largest))
+    best: List[Tuple[float, int]] = list()
+    partial = False
+    for count, (bound, index) in enumerate(closest_lengths(by_length, len(text))):
+        if len(best) >= max_results and bound < best[0][0]:
+            break
+        if count % DEADLINE_CHECK == 0 and count and time.monotonic() >= until:
+            partial = True
+            break
+        matcher.set_seq1(keys[index])
+        if len(best) < max_results:
+            heapq.heappush(best, (matcher.ratio(), -index))
+            continue
+        # Equal ratio is enough here, smaller index wins ties
+        if matcher.quick_ratio() < best[0][0]:
+            continue
+        item = (matcher.ratio(), -index)
+        if item > best[0]:
+            heapq.heapreplace(best, item)
+    return [(-x[1], x[0]) for x in sorted(best, reverse=True)], partial
+
+def merge_scored(results: Iterable[List[Tuple[int, float]]],
+                 max_results: int) -> List[int]:
+    """Merge RESULTS of search_scored on disjoint parts of entries (with
+    global indices) to MAX_RESULTS best indices.  Order is same as if
+    search was done on all entries at once"""
+    merged = sorted(itertools.chain.from_iterable(results), key=lambda x: (-x[1], x[0]))
+    return [x[0] for x in merged[:max_results]]
+
+def shard_worker(connection, keys: List[str]):
+    """Serve requests of SearchShards for KEYS until connection is closed.
+    Request is tuple (command, argument), see SearchShards"""
+    by_length = None
+    while True:
+        try:
+            command, argument = connection.recv()
+        except EOFError:
+            return
+        if command == constants.CHANGE_INSERT:
+            keys.append(argument)
+            by_length = None
+        elif command == constants.CHANGE_DELETE:
+            del keys[argument]
+            by_length = None
+        else:
+            text, max_results, until = argument
+            if until is None:
+                connection.send((search_scored(keys, text, lambda x: x, None, max_results),
+                                 False))
+                continue
+            if by_length is None:
+                by_length = length_order(keys)
+            connection.send(search_until(keys, text, by_length, until, max_results))
+
+
+class SearchShards:
+    """Keys split to WORKERS parts (shards), each kept by its own worker
+    process.  Processes are started once and live until close, so query
+    only sends search term to them.  Each shard returns its own best
+    results, which are merged (see merge_scored), so results are same as
+    from search on all keys.
+
+    Keys are compared without junk filter, KeyValueStore gives them
+    normalized.  Changes are sent to shard which contains changed key
+    (insert always to last shard).  sizes holds number of keys in each
+    shard.  Deadline of search is sent to workers as time.monotonic(),
+    which is same for all processes"""
+
+    def __init__(self, keys: List[str], workers: int) -> None:
+        self.connections: list = list()
+        self.processes: list = list()
+        self.sizes: List[int] = list()
+        step = -(-len(keys) // workers)  # Round up
+        for start in range(0, max(len(keys), 1), max(step, 1)):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=shard_worker, daemon=True,
+                                              args=(child, keys[start:start + step]))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+            self.sizes.append(len(keys[start:start + step]))
+
+    def search(self, text: str, max_results: int, until: Optional[float] = None) -> List[int]:
+        """Return indices of MAX_RESULTS keys most similar to TEXT, like
+        search.  Raise OSError or EOFError if some worker died.  Raise
+        PartialResults, if some worker stopped at UNTIL"""
+        for connection in self.connections:
+            connection.send((constants.COMMAND_SEARCH, (text, max_results, until)))
+        results = list()
+        partial = False
+        offset = 0
+        for connection, size in zip(self.connections, self.sizes):
+            scored, stopped = connection.recv()
+            results.append([(offset + x, y) for x, y in scored])
+            partial = partial or stopped
+            offset += size
+        if partial:
+            raise PartialResults(merge_scored(results, max_results))
+        return merge_scored(results, max_results)
+
+    def insert(self, key: str):
+        """Add KEY after last key"""
+        self.connections[-1].send((constants.CHANGE_INSERT, key))
+        self.sizes[-1] += 1
+
+    def delete(self, position: int):
+        """Remove key at POSITION"""
+        for shard, size in enumerate(self.sizes):
+            if position < size:
+                self.connections[shard].send((constants.CHANGE_DELETE, position))
+                self.sizes[shard] -= 1
+                return
+            position -= size
+        raise IndexError(position)
+
+    def close(self):
+        """Stop worker processes"""
+        for connection in self.connections:
+            connection.close()
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self.connections = list()
+        self.processes = list()
@@ -1,15 +1,39 @@
 """Tests for core functionality of password manager"""
 from functools import partial
+import gc
+import io
 import os
+import pickle
+import random
+import re
+import time
 import tempfile
 import unittest
 import unittest.mock
 from unittest.mock import patch
+import warnings
 
 import constants
+import container
 import core
 
 
+def search_normalized(keys, query, max_results=10):
+    """Full search in normalized KEYS, like KeyValueStore does"""
+    return core.search([core.normalize_key(x) for x in keys], core.normalize_key(query),
+                       lambda x: x, max_results=max_results)
+
+def is_junk(character):
+    """Junk filter for SequenceMatcher in tests of search"""
+    return not character.isalnum()
+
+def memory_file(entries):
+    """PasswordFileManager with ENTRIES, which doesn't read any file"""
+    with patch("core.PasswordFileManager.read_contents"), \
+         patch("core.parse_contents", return_value=list(entries)):
+        return core.PasswordFileManager("", "")
+
+
 # pylint: disable=C0111
 class EncoderDecoderTestCase(unittest.TestCase):
     def test_delete_whitespace(self):
@@ -24,6 +48,15 @@ class EncoderDecoderTestCase(unittest.TestCase):
         self.assertEqual(('my key', 'some\nvalue'),
                          core.parse_entry(b'6 10 my key some\nvalue'))
 
+    def test_parse_entry_format(self):
+        self.assertEqual(('\u00e9 k', 'v'), core.parse_entry('3  1\n \u00e9 k v '.encode()))
+        self.assertEqual(('key', 'val'), core.parse_entry(memoryview(b'xx3 3 key val')[2:]))
+        self.assertEqual(('', ''), core.parse_entry(b'0 0 '))
+        for entry in (b'', b'3 3', b'3 3key val', b'a 3 key val', b'3  key val', b' 3 3 key val',
+                      b'+3 3 key val'):
+            with self.assertRaises(ValueError):
+                core.parse_entry(entry)
+
     def test_parse_contents(self):
         expect = [('l', 'aa'), ('Hello', 'yeti')]
         values = [b'1 2 l aa', b'5 4 Hello yeti']
@@ -32,6 +65,26 @@ class EncoderDecoderTestCase(unittest.TestCase):
         de_cipher = core.Cipher("some long password")
         self.assertEqual(expect, core.parse_contents(hvalues, de_cipher))
 
+    @patch("constants.PARALLEL_MIN_RECORDS", 4)
+    @patch("constants.PARALLEL_BATCH_SIZE", 3)
+    def test_parse_contents_parallel(self):
+        cipher = core.Cipher("some long password")
+        records = [core.serialize_entry("key" + str(i), "val" + str(i))
+                   for i in range(10)]
+        records.insert(5, core.serialize_tombstone([0, 3]))
+        hvalues = [cipher.encrypt(val).hex() for val in records]
+        hvalues.insert(7, core.Cipher("other").encrypt(b'1 1 a b').hex())
+
+        stats = core.LoadStats()
+        serial = core.parse_contents(hvalues, cipher)
+        parallel = core.parse_contents(iter(hvalues), cipher, stats, workers=2)
+        self.assertEqual(8, len(serial))
+        self.assertEqual(serial, parallel)
+        self.assertEqual((12, 11, 3), (stats.records, stats.decrypted, stats.stale))
+        # Too small for pool
+        self.assertEqual([("key0", "val0"), ("key1", "val1")],
+                         core.parse_contents(hvalues[:2], cipher, workers=2))
+
     def test_serialize_deserialize(self):
         password = "abcd1234"
         contents = [("key1", "val1"), ("key2", "val2")]
@@ -76,6 +129,384 @@ class PasswordFileManagerIOTestCase(unittest.TestCase):
         self.assertEqual(write, read)
 
 
+class PasswordFileManagerJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        tup = tempfile.mkstemp(prefix='PasswordFileManagerJournalTestCase')
+        os.close(tup[0])
+        self.file_path = tup[1]
+        self.addCleanup(os.remove, self.file_path)
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        for i in range(5):
+            pass_file.append_entry("key " + str(i), "value " + str(i))
+        pass_file.save_contents()
+
+    def test_append_keeps_file_prefix(self):
+        before = core.read_binary_file(self.file_path)
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        pass_file.append_entry("new key", "new value")
+        pass_file.delete_indices([1, 3])
+        pass_file.save_contents()
+        after = core.read_binary_file(self.file_path)
+        self.assertTrue(after.startswith(before))
+
+        expected = [("key 0", "value 0"), ("key 2", "value 2"),
+                    ("key 4", "value 4"), ("new key", "new value")]
+        pass_file2 = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertEqual(expected, list(pass_file2))
+        self.assertEqual(1, pass_file2.success)
+        self.assertEqual(3, pass_file2.stale)
+
+    def test_truncated_append(self):
+        expected = [("key " + str(i), "value " + str(i)) for i in range(5)]
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        pass_file.append_entry("torn", "entry")
+        pass_file.save_contents()
+        size = core.file_size(self.file_path)
+        for cut in (3, 20):  # In payload and in record header
+            with open(self.file_path, 'r+b') as opened_file:
+                opened_file.truncate(size - cut)
+            for settings in ({}, {constants.SETTINGS_LAZY: True}):
+                pass_file = core.PasswordFileManager(self.file_path, "abcd123", settings)
+                self.addCleanup(pass_file.close)
+                self.assertEqual(expected, list(pass_file))
+                self.assertTrue(pass_file.truncated)
+        # File is rewritten, so appended entry is not lost after torn one
+        pass_file.append_entry("new key", "new value")
+        pass_file.save_contents()
+        pass_file.close()
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertEqual(expected + [("new key", "new value")], list(pass_file))
+        self.assertFalse(pass_file.truncated)
+        self.assertFalse(os.path.exists(self.file_path + constants.TMP_SUFFIX))
+        with open(self.file_path, 'rb') as opened_file:
+            opened_file.seek(container.header_size(opened_file.read()))
+            with self.assertRaises(container.TruncatedError):
+                list(core.stream_records(io.BytesIO(opened_file.read()[:-3])))
+
+    def test_compact_replaces_file(self):
+        """Interrupted compaction leaves old file untouched"""
+        before = core.read_binary_file(self.file_path)
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        with patch("core.map_batches", side_effect=OSError("No space left")):
+            with self.assertRaises(OSError):
+                pass_file.compact()
+        self.assertEqual(before, core.read_binary_file(self.file_path))
+        pass_file.compact()
+        self.assertEqual(list(pass_file), list(core.PasswordFileManager(self.file_path,
+                                                                        "abcd123")))
+
+    @patch("constants.JOURNAL_COMPACT_MIN", 2)
+    def test_compaction(self):
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        pass_file.delete_entry(0)
+        pass_file.save_contents()
+        self.assertEqual(2, core.PasswordFileManager(self.file_path, "abcd123").stale)
+        pass_file.delete_entry(0)
+        pass_file.save_contents()
+
+        pass_file2 = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertEqual(0, pass_file2.stale)
+        self.assertEqual([("key 2", "value 2"), ("key 3", "value 3"),
+                          ("key 4", "value 4")], list(pass_file2))
+
+    def test_parse_tombstone(self):
+        self.assertEqual([1, 3], core.parse_tombstone(core.serialize_tombstone([1, 3])))
+        self.assertIsNone(core.parse_tombstone(b'6 7 delete value12'))
+
+
+class PasswordFileManagerFormatTestCase(unittest.TestCase):
+    def setUp(self):
+        tup = tempfile.mkstemp(prefix='PasswordFileManagerFormatTestCase')
+        os.close(tup[0])
+        self.file_path = tup[1]
+        self.addCleanup(os.remove, self.file_path)
+        self.content = [("key 1", "value\n1"), ("key 2", "value 2")]
+
+    def test_new_file_is_binary(self):
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        for entry in self.content:
+            pass_file.append_entry(entry[0], entry[1])
+        pass_file.save_contents()
+        self.assertTrue(container.is_container(core.read_binary_file(self.file_path)))
+        self.assertEqual(self.content, list(core.PasswordFileManager(self.file_path,
+                                                                     "abcd123")))
+
+    def test_blocks(self):
+        content = [("key " + str(i), "value " + str(i)) for i in range(100)]
+        sizes = list()
+        for block_size in (0, 1024):
+            settings = {constants.SETTINGS_BLOCK_SIZE: block_size}
+            core.write_file(self.file_path, "")
+            pass_file = core.PasswordFileManager(self.file_path, "abcd123", settings)
+            for entry in content:
+                pass_file.append_entry(entry[0], entry[1])
+            pass_file.compact()
+            sizes.append(core.file_size(self.file_path))
+            pass_file.append_entry("new", "entry")
+            pass_file.delete_indices([1, 99])
+            pass_file.append_entry("newer", "entry")
+            pass_file.save_contents()
+            expected = content[:1] + content[2:99] + [("new", "entry"), ("newer", "entry")]
+            self.assertEqual(expected, list(core.PasswordFileManager(self.file_path,
+                                                                     "abcd123")))
+        self.assertLess(sizes[1] * 2, sizes[0])
+
+    def test_legacy_file(self):
+        cipher = core.Cipher("abcd123")
+        core.write_file(self.file_path, core.serialize_contents(self.content, cipher))
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertFalse(pass_file.binary)
+        self.assertEqual(self.content, list(pass_file))
+        # Legacy file stays legacy until converted
+        pass_file.append_entry("key 3", "value 3")
+        pass_file.save_contents()
+        self.assertFalse(core.PasswordFileManager(self.file_path, "abcd123").binary)
+
+        self.assertFalse(core.convert_file(self.file_path, "wrong password"))
+        self.assertTrue(core.convert_file(self.file_path, "abcd123"))
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertTrue(pass_file.binary)
+        self.assertEqual(core.Cipher.NAME, pass_file.cipher.NAME)
+        self.assertEqual(self.content + [("key 3", "value 3")], list(pass_file))
+
+        self.assertTrue(core.convert_file(self.file_path, "abcd123",
+                                          core.ChaChaCipher.NAME))
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertEqual(core.ChaChaCipher.NAME, pass_file.cipher.NAME)
+        self.assertEqual(self.content + [("key 3", "value 3")], list(pass_file))
+
+    def test_verifier(self):
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        pass_file.append_entry("key", "value")
+        pass_file.save_contents()
+        self.assertIn(container.FIELD_VERIFIER, pass_file.fields)
+        with patch("core.decrypt_and_parse") as decrypt_mock:
+            for settings in ({}, {constants.SETTINGS_LAZY: True}):
+                # File is not left open
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always")
+                    with self.assertRaises(core.InvalidPasswordError):
+                        core.PasswordFileManager(self.file_path, "wrong", settings)
+                    gc.collect()
+                self.assertEqual([], [x for x in caught
+                                      if issubclass(x.category, ResourceWarning)])
+            self.assertFalse(core.convert_file(self.file_path, "wrong"))
+            self.assertEqual(0, decrypt_mock.call_count)
+
+    def test_verifier_added(self):
+        """Files without verifier get it with next compaction"""
+        cipher = core.AesGcmCipher("abcd123")
+        header = container.pack_header({container.FIELD_CIPHER: cipher.NAME.encode()})
+        core.write_records(self.file_path, header, [b'1 1 a b'], cipher, raw=True)
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertNotIn(container.FIELD_VERIFIER, pass_file.fields)
+        self.assertEqual(0, core.PasswordFileManager(self.file_path, "wrong").success)
+        pass_file.compact()
+        self.assertIn(container.FIELD_VERIFIER,
+                      core.PasswordFileManager(self.file_path, "abcd123").fields)
+
+    def test_cipher_from_header(self):
+        for name in core.CIPHERS:
+            core.write_file(self.file_path, "")
+            settings = {constants.SETTINGS_CIPHER: name}
+            pass_file = core.PasswordFileManager(self.file_path, "abcd123", settings)
+            pass_file.append_entry("key", "value")
+            pass_file.save_contents()
+            # Setting is used only for new files
+            pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+            self.assertEqual(name, pass_file.cipher.NAME)
+            self.assertEqual([("key", "value")], list(pass_file))
+
+    def test_change_password(self):
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        for entry in self.content:
+            pass_file.append_entry(entry[0], entry[1])
+        pass_file.save_contents()
+        self.assertIn(container.FIELD_WRAPPED_KEY, pass_file.fields)
+        records = core.read_binary_file(self.file_path)[
+            container.header_size(core.read_binary_file(self.file_path)):]
+        size = core.file_size(self.file_path)
+
+        # Interrupted change leaves old file
+        before = core.read_binary_file(self.file_path)
+        with patch("os.replace", side_effect=OSError), self.assertRaises(OSError):
+            pass_file.change_password("new password")
+        self.assertEqual(before, core.read_binary_file(self.file_path))
+
+        with patch("os.fsync", wraps=os.fsync) as fsync:
+            pass_file.change_password("new password")
+        # New file is on disk before it replaces old one, records are untouched
+        fsync.assert_called_once()
+        self.assertFalse(os.path.exists(self.file_path + constants.TMP_SUFFIX))
+        self.assertEqual(size, core.file_size(self.file_path))
+        self.assertTrue(core.read_binary_file(self.file_path).endswith(records))
+        with self.assertRaises(core.InvalidPasswordError):
+            core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertEqual(self.content, list(core.PasswordFileManager(self.file_path,
+                                                                     "new password")))
+
+    def test_change_password_new_file(self):
+        core.write_file(self.file_path, "")
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        pass_file.append_entry("a", "b")
+        pass_file.change_password("new password")
+        self.assertEqual([("a", "b")], list(core.PasswordFileManager(self.file_path,
+                                                                     "new password")))
+
+    def test_change_password_without_wrapped_key(self):
+        """Files without wrapped key use key derived from password, which
+        becomes data key"""
+        cipher = core.AesGcmCipher("abcd123")
+        header = container.pack_header({container.FIELD_CIPHER: cipher.NAME.encode()})
+        core.write_records(self.file_path, header, [b'1 1 a b'], cipher, raw=True)
+        for settings in ({}, {constants.SETTINGS_LAZY: True}):
+            pass_file = core.PasswordFileManager(self.file_path, "abcd123", settings)
+            self.addCleanup(pass_file.close)
+            pass_file.change_password("new password")
+            self.assertEqual([("a", "b")], list(pass_file))
+            self.assertEqual([("a", "b")], list(core.PasswordFileManager(self.file_path,
+                                                                         "new password")))
+            pass_file.change_password("abcd123")
+
+    def test_change_password_legacy(self):
+        core.write_file(self.file_path, core.serialize_contents(self.content,
+                                                                core.Cipher("abcd123")))
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        pass_file.change_password("new password")
+        pass_file = core.PasswordFileManager(self.file_path, "new password")
+        self.assertTrue(pass_file.binary)
+        self.assertEqual(self.content, list(pass_file))
+
+
+class PasswordFileManagerStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        tup = tempfile.mkstemp(prefix='PasswordFileManagerStreamTestCase')
+        os.close(tup[0])
+        self.file_path = tup[1]
+        self.addCleanup(os.remove, self.file_path)
+        self.content = [("key " + str(i), "\n".join(["value"] * i))
+                        for i in range(1, 10)]
+
+    def test_stream_legacy_records(self):
+        data = b' ab|\n cd| \n||ef\n\ngh\n|'
+        for chunk_size in range(1, len(data) + 1):
+            with tempfile.TemporaryFile() as opened_file:
+                opened_file.write(data)
+                opened_file.seek(0)
+                result = list(core.stream_legacy_records(opened_file, chunk_size))
+            self.assertEqual(['ab', 'cd', 'efgh'], result)
+
+    @patch("constants.READ_CHUNK_SIZE", 7)
+    def test_small_chunks(self):
+        cipher = core.Cipher("abcd123")
+        core.write_file(self.file_path, core.serialize_contents(self.content, cipher))
+        self.assertEqual(self.content, list(core.PasswordFileManager(self.file_path,
+                                                                     "abcd123")))
+        self.assertTrue(core.convert_file(self.file_path, "abcd123"))
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertTrue(pass_file.binary)
+        self.assertEqual(self.content, list(pass_file))
+
+
+    @patch("constants.PARALLEL_MIN_RECORDS", 4)
+    @patch("constants.PARALLEL_BATCH_SIZE", 2)
+    def test_parallel_write(self):
+        settings = {constants.SETTINGS_WORKERS: 2}
+        for binary in (True, False):
+            cipher = core.Cipher("abcd123")
+            records = [core.serialize_entry(x[0], x[1]) for x in self.content]
+            header = container.pack_header({}) if binary else b''
+            core.write_records(self.file_path, header, records, cipher,
+                               raw=binary, workers=2)
+            pass_file = core.PasswordFileManager(self.file_path, "abcd123", settings)
+            self.assertEqual(binary, pass_file.binary)
+            self.assertEqual(self.content, list(pass_file))
+            self.assertEqual(1, pass_file.success)
+
+
+class PasswordFileManagerLazyTestCase(unittest.TestCase):
+    def setUp(self):
+        tup = tempfile.mkstemp(prefix='PasswordFileManagerLazyTestCase')
+        os.close(tup[0])
+        self.file_path = tup[1]
+        self.addCleanup(os.remove, self.file_path)
+        self.content = [("key " + str(i), "value " + str(i)) for i in range(6)]
+        # Two entries per block
+        self.settings = {constants.SETTINGS_LAZY: True,
+                         constants.SETTINGS_LAZY_CACHE_SIZE: 2,
+                         constants.SETTINGS_BLOCK_SIZE: 40}
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123", self.settings)
+        for entry in self.content:
+            pass_file.append_entry(entry[0], entry[1])
+        pass_file.delete_entry(5)
+        pass_file.save_contents()
+        del self.content[5]
+
+    def test_lazy_read(self):
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123", self.settings)
+        self.addCleanup(pass_file.close)
+        self.assertTrue(all(isinstance(x, int) for x in pass_file.contents))
+        self.assertEqual([0, 1, 0, 1, 0], [core.split_ref(x)[1] for x in pass_file.contents])
+        self.assertEqual(self.content, list(pass_file))
+        self.assertEqual(self.content[3], pass_file[3])
+        self.assertEqual(2, pass_file.load_record.cache_info().currsize)
+        self.assertEqual(1, pass_file.success)
+        with self.assertRaises(core.InvalidPasswordError):
+            core.PasswordFileManager(self.file_path, "abcd", self.settings)
+
+    def corrupt_record(self, position: int):
+        """Damage authentication tag of record with entry at POSITION"""
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123", self.settings)
+        offset = core.split_ref(pass_file.contents[position])[0]
+        end = container.record_at(pass_file.mapped, offset)[2]
+        pass_file.close()
+        with open(self.file_path, 'r+b') as opened_file:
+            opened_file.seek(end - 1)
+            last = opened_file.read(1)
+            opened_file.seek(end - 1)
+            opened_file.write(bytes([last[0] ^ 1]))
+
+    @patch("constants.JOURNAL_COMPACT_MIN", 0)
+    def test_lazy_corrupted(self):
+        self.corrupt_record(2)
+        expected = self.content[:2] + self.content[4:]
+        eager = core.PasswordFileManager(self.file_path, "abcd123")
+        self.assertEqual(expected, list(eager))
+        self.assertEqual(0, eager.success)
+        # Only tombstone was decrypted while opening
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123", self.settings)
+        self.addCleanup(pass_file.close)
+        self.assertEqual(1, pass_file.success)
+        events = list()
+        pass_file.subscribe(lambda *args: events.append(args))
+        self.assertEqual(self.content[4], pass_file[2])
+        self.assertEqual([(constants.CHANGE_DELETE, [3, 2])], events)
+        self.assertEqual(expected, list(pass_file))
+        self.assertEqual(0, pass_file.success)
+        # Partly deleted record is dropped by compaction
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123", self.settings)
+        self.addCleanup(pass_file.close)
+        pass_file.delete_indices([3])
+        pass_file.save_contents()
+        self.assertEqual(expected, list(pass_file))
+        self.assertEqual(expected, list(core.PasswordFileManager(self.file_path, "abcd123")))
+
+    @patch("constants.JOURNAL_COMPACT_MIN", 0)
+    def test_lazy_modify(self):
+        pass_file = core.PasswordFileManager(self.file_path, "abcd123", self.settings)
+        self.addCleanup(pass_file.close)
+        pass_file.append_entry("new key", "new value")
+        pass_file.delete_indices([0, 2])
+        pass_file.save_contents()
+        expected = [self.content[1], self.content[3], self.content[4],
+                    ("new key", "new value")]
+        self.assertEqual(expected, list(pass_file))
+        self.assertEqual(0, pass_file.stale)
+        self.assertTrue(all(isinstance(x, int) for x in pass_file.contents))
+        self.assertEqual(expected, list(core.PasswordFileManager(self.file_path,
+                                                                 "abcd123")))
+
+
 class PasswordFileManagerTestCase(unittest.TestCase):
     def setUp(self):
         self.content = [("key 1", "some val"),
@@ -97,6 +528,17 @@ class PasswordFileManagerTestCase(unittest.TestCase):
         del expected[1]
         self.assertEqual(expected, pass_man.contents)
 
+    def test_change_events(self):
+        pass_man = core.PasswordFileManager("", "")
+        events = list()
+        pass_man.subscribe(lambda *args: events.append(args))
+        pass_man.append_entry("new", "entry")
+        pass_man.delete_indices([1, 3, 1, 9])
+        pass_man.delete_indices([9])
+        self.assertEqual([(constants.CHANGE_INSERT, ("new", "entry")),
+                          (constants.CHANGE_DELETE, [3, 1, 1])], events)
+        self.assertEqual(2, pass_man.version)
+
     def test_delete_multiple_entries(self):
         pass_man = core.PasswordFileManager("", "")
         pass_man.delete_indices([4, 4, 4, 0, 1])
@@ -131,23 +573,231 @@ class KeyValueSearchTestCase(unittest.TestCase):
         func = partial(core.search, self.tuples_list, max_results=2)
         self.assertEqual(expected, func("item securely", lambda x: x[1]))
 
+    def test_search_pruning(self):
+        rnd = random.Random(0)
+        keys = ["".join(rnd.choice("abcde.@") for _ in range(rnd.randint(0, 8)))
+                for _ in range(500)]
+        matcher = core.SequenceMatcher(is_junk, autojunk=False)
+        for query in ("abc", "e.d@", "aaaa", "", "x"):
+            matcher.set_seq2(query)
+            ratios = [core._get_ratio(matcher, x) for x in keys]  # pylint: disable=W0212
+            for max_results in (0, 1, 10, 600):
+                # Same as sorting by ratio, ties resolved by index
+                expected = [x for _, x in sorted((-y, x) for x, y in enumerate(ratios))]
+                expected = expected[:max_results]
+                self.assertEqual(expected, core.search(keys, query, lambda x: x,
+                                                       is_junk,
+                                                       max_results))
+
+    def test_search_until(self):
+        rnd = random.Random(2)
+        keys = ["".join(rnd.choice("abcde.@") for _ in range(rnd.randint(0, 12)))
+                for _ in range(500)]
+        by_length = core.length_order(keys)
+        bounds = [x for x, _ in core.closest_lengths(by_length, 4)]
+        self.assertEqual(sorted(bounds, reverse=True), bounds)
+        self.assertEqual(len(keys), len(bounds))
+        for query in ("abc", "e.d@a", "", "abcdeabcdeabcde"):
+            for max_results in (0, 1, 10, 600):
+                expected = core.search_scored(keys, query, lambda x: x, None, max_results)
+                self.assertEqual((expected, False),
+                                 core.search_until(keys, query, by_length,
+                                                   time.monotonic() + 100, max_results))
+        # Deadline is checked only after first keys are scored
+        with patch("core.DEADLINE_CHECK", 5):
+            scored, stopped = core.search_until(keys, "abcd", by_length, 0, 3)
+        self.assertTrue(stopped)
+        self.assertEqual(3, len(scored))
+        self.assertTrue(all(len(keys[x]) == 4 for x, _ in scored))
+
+    def test_find_deadline(self):
+        pass_file = memory_file(self.tuples_list)
+        store = core.KeyValueStore(pass_file)
+        self.assertEqual(store.find_key("my key", 2), store.find_key("my key", 2, deadline=10))
+        self.assertFalse(store.partial)
+        self.assertEqual([5, 2], store.find_fulltext("item securely", 2, deadline=10))
+        self.assertFalse(store.partial)
+        with patch("core.DEADLINE_CHECK", 1), patch("index.DEADLINE_CHECK", 1):
+            self.assertEqual(1, len(store.find_key("my ke", 1, deadline=0)))
+            self.assertTrue(store.partial)
+            # Only postings of rarest word are scored
+            self.assertEqual([2], store.find_fulltext("item ssis", 2, deadline=0))
+            self.assertTrue(store.partial)
+            # Partial results are not cached, full results are
+            hits = store.cache_info()[0]
+            store.find_key("my ke", 1, deadline=0)
+            self.assertEqual(hits, store.cache_info()[0])
+            store.find_key("my ke", 1)
+            self.assertFalse(store.partial)
+            store.find_key("my ke", 1)
+            self.assertEqual(hits + 1, store.cache_info()[0])
+        # Index stops after scoring its candidates
+        with patch("constants.SEARCH_INDEX_MIN_ENTRIES", 1), \
+             patch("constants.SEARCH_INDEX_CANDIDATES", 1), patch("core.DEADLINE_CHECK", 1):
+            store = core.KeyValueStore(pass_file)
+            self.assertEqual(store.find_key("securely", 1),
+                             store.find_key("securely", 1, deadline=10))
+            self.assertFalse(store.partial)
+            self.assertIsNotNone(store.columns.index)
+            self.assertEqual([3], store.find_key("reference", 1, deadline=0))
+            self.assertTrue(store.partial)
+
+    def test_search_many(self):
+        keys = [x[0] for x in self.tuples_list]
+        terms = ["my key", "com", "", "pin"]
+        calls = list()
+        results = core.search_many(self.tuples_list, terms, lambda x: calls.append(x) or x[0],
+                                   is_junk, 3)
+        self.assertEqual(len(keys), len(calls))
+        self.assertEqual([core.search(keys, x, lambda y: y, is_junk, 3)
+                          for x in terms], results)
+        self.assertEqual([[], []], core.search_many(keys, ["a", "b"], lambda x: x, None, 0))
+        store = core.KeyValueStore(self.tuples_list)
+        self.assertEqual([store.find_key(x, 3) for x in terms], store.find_key_many(terms, 3))
+        expected = [search_normalized(keys, x, 3) for x in terms]
+        self.assertEqual(expected, store.find_key_many(terms, 3))
+        with patch("constants.SEARCH_INDEX_MIN_ENTRIES", 1):
+            store = core.KeyValueStore(self.tuples_list)
+            self.assertEqual(expected, store.find_key_many(terms, 3))
+            self.assertIsNotNone(store.columns.index)
+
+    @patch("constants.SEARCH_SHARDS_MIN_ENTRIES", 10)
+    def test_search_shards(self):
+        rnd = random.Random(1)
+        entries = [("".join(rnd.choice("abcde.@") for _ in range(rnd.randint(1, 8))), "")
+                   for _ in range(300)]
+        pass_file = memory_file(entries)
+        store = core.KeyValueStore(pass_file, cache_size=0, workers=3)
+        store.start_shards()
+        self.addCleanup(store.close)
+        self.assertEqual([100, 100, 100], store.columns.shards.sizes)
+        for step in range(3):
+            keys = [x[0] for x in pass_file]
+            for query in ("abc", "e.d@", "a", "x"):
+                for max_results in (1, 10):
+                    self.assertEqual(search_normalized(keys, query, max_results),
+                                     store.find_key(query, max_results))
+                    self.assertEqual(search_normalized(keys, query, max_results),
+                                     store.find_key(query, max_results, deadline=10))
+            pass_file.append_entry("abc" * step, "")
+            pass_file.delete_indices([5, 150, 299 - step])
+        self.assertEqual([97, 97, 101], store.columns.shards.sizes)
+        keys = [x[0] for x in pass_file]
+        self.assertEqual(search_normalized(keys, "abc"), store.find_key("abc"))
+        # Dead worker
+        store.columns.shards.processes[0].terminate()
+        store.columns.shards.processes[0].join()
+        self.assertEqual(search_normalized(keys, "ab"), store.find_key("ab"))
+        self.assertIsNone(store.columns.shards)
+
+    def test_find_live(self):
+        rnd = random.Random(2)
+        entries = [("".join(rnd.choice("abcdE.@") for _ in range(rnd.randint(1, 8))), "")
+                   for _ in range(300)]
+        pass_file = memory_file(entries)
+        store = core.KeyValueStore(pass_file)
+
+        def expected(query):
+            query = core.normalize_key(query)
+            if not query:
+                return []
+            keys = [core.normalize_key(x[0]) for x in pass_file]
+            found = [i for i, x in enumerate(keys)
+                     if all(y in it for it in [iter(x)] for y in query)]
+            return [found[x] for x in core.search([keys[x] for x in found], query, lambda x: x)]
+
+        for query in ("a", "ab", "abe", "abe.", "aB", "abd", "", ".", "e"):
+            self.assertEqual(expected(query), store.find_live(query))
+        # Longer query is filtered from keys of shorter one
+        store.find_live("ea")
+        self.assertEqual(["e", "ea"], [x[0] for x in store.narrowing])
+        with patch("re.compile", side_effect=AssertionError):
+            store.find_live("e")
+        self.assertEqual(["e"], [x[0] for x in store.narrowing])
+        pass_file.append_entry("eeee", "")
+        self.assertEqual([], store.narrowing)
+        self.assertEqual(expected("ee"), store.find_live("ee"))
+
+    def test_normalized_keys(self):
+        self.assertEqual("mailgooglecomstrasse", core.normalize_key("Mail.Google.com Straße"))
+        pass_file = memory_file(self.tuples_list)
+        store = core.KeyValueStore(pass_file)
+        self.assertEqual([3], store.find_key("MY-REFERENCE", max_results=1))
+        pass_file.append_entry("New.Key", "")
+        pass_file.delete_indices([0])
+        self.assertEqual([core.normalize_key(x[0]) for x in pass_file], store.columns.normalized)
+        self.assertEqual([5], store.find_key("newkey", max_results=1))
+
+    def test_find_match(self):
+        pass_file = memory_file(self.tuples_list)
+        store = core.KeyValueStore(pass_file)
+        self.assertEqual([3], store.find_match("my reference", constants.SEARCH_MODE_EXACT))
+        self.assertEqual([], store.find_match("My reference", constants.SEARCH_MODE_EXACT))
+        self.assertEqual([3], store.find_match("my", constants.SEARCH_MODE_PREFIX))
+        self.assertEqual([2, 1], store.find_match("*.com", constants.SEARCH_MODE_GLOB))
+        self.assertEqual([4, 5], store.find_match("^[MS]", constants.SEARCH_MODE_REGEX))
+        self.assertEqual([2, 1], store.find_match(r"\.com$", constants.SEARCH_MODE_REGEX))
+        self.assertEqual([4], store.find_match("e", constants.SEARCH_MODE_REGEX, 1))
+        with self.assertRaises(re.error):
+            store.find_match("(", constants.SEARCH_MODE_REGEX)
+        pass_file.append_entry("my reference", "")
+        pass_file.delete_indices([0])
+        self.assertEqual([2, 5], store.find_match("my reference", constants.SEARCH_MODE_EXACT))
+        # Glob and regex check only keys with literal prefix
+        with patch("fnmatch.translate", return_value="."):
+            self.assertEqual([2, 5], store.find_match("my*", constants.SEARCH_MODE_GLOB))
+
     def test_find_fulltext(self):
         expected = [5, 2]
         store = core.KeyValueStore(self.tuples_list)
         self.assertEqual(expected, store.find_fulltext("item securely", max_results=2))
 
     def test_find_fulltext2(self):
-        expected = [0, 3]
+        # Only "my" matches (key1 is other word), shortest entries rank first
+        expected = [0, 4]
         store = core.KeyValueStore(self.tuples_list)
         self.assertEqual(expected, store.find_fulltext("my key", max_results=2))
 
     def test_find_key(self):
-        expected = [0, 3]
+        # Keys are compared without case and non-word characters, "mykey"
+        # is closer to "mypincode" than to "myreference"
+        expected = [0, 4]
         store = core.KeyValueStore(self.tuples_list)
         self.assertEqual(expected, store.find_key("my key", max_results=2))
 
+    def test_search_cache(self):
+        pass_file = memory_file(self.tuples_list)
+        store = core.KeyValueStore(pass_file)
+        self.assertEqual([0, 4], store.find_key("my key", max_results=2))
+        store.find_key("my key", max_results=2)[:] = []  # Result is copy
+        self.assertEqual([0, 4], store.find_key("my key", max_results=2))
+        self.assertEqual([5, 2], store.find_fulltext("item securely", max_results=2))
+        self.assertEqual((2, 2), store.cache_info()[:2])
+        # Same normalized key
+        self.assertEqual([0, 4], store.find_key("My-Key", max_results=2))
+        self.assertEqual((3, 2), store.cache_info()[:2])
+        # New version of file
+        pass_file.append_entry("my key", "")
+        self.assertEqual([6, 0], store.find_key("my key", max_results=2))
+        self.assertEqual((3, 3), store.cache_info()[:2])
+
+        store = core.KeyValueStore(pass_file, cache_size=0)
+        store.find_key("my key")
+        store.find_key("my key")
+        self.assertEqual((0, 2), store.cache_info()[:2])
+
 
 class EncryptionDecryptionTestCase(unittest.TestCase):
+    def test_ciphers(self):
+        plaintext = b'Hello, how are you?'
+        for cipher_class in core.CIPHERS.values():
+            cipher = cipher_class('pass')
+            copy = pickle.loads(pickle.dumps(cipher))
+            self.assertEqual(plaintext, copy.decrypt(cipher.encrypt(plaintext)))
+            self.assertEqual(plaintext, copy.decrypt_raw(cipher.encrypt_raw(plaintext)))
+            self.assertEqual(b'', cipher_class('other').decrypt(cipher.encrypt(plaintext)))
+            self.assertEqual(b'', cipher.decrypt(b'abc'))
+
     def test_simple_encryption(self):
         cipher1 = core.Cipher('pass')
         cipher2 = core.Cipher('pass')
@@ -0,0 +1,19 @@
+"""Random keys similar to real ones, used by tests and benchmarks of
+search"""
+import random
+from typing import List
+
+
+def create_corpus(count: int, seed=0) -> List[str]:
+    """Create COUNT keys similar to real ones (urls, emails)"""
+    rnd = random.Random(seed)
+    words = ["mail", "google", "bank", "github", "amazon", "shop", "work",
+             "home", "server", "router", "wifi", "vpn", "cloud", "forum"]
+    keys = list()
+    for _ in range(count):
+        key = "".join(rnd.sample(words, rnd.randint(1, 2))) + str(rnd.randint(0, 99))
+        key += rnd.choice([".com", ".org", ".sk", ""])
+        if rnd.random() < 0.3:
+            key = rnd.choice(["user@", "Admin@", "me@"]) + key
+        keys.append(key)
+    return keys
@@ -4,7 +4,9 @@ import getpass
 import os
 from typing import Any, Dict
 
+import agent
 import constants
+import core
 import interaction
 import session
 
@@ -41,12 +43,50 @@ def parse_arguments(settings: Dict[str, Any], frontend: Module, backend: Module)
                         help=constants.ARG_PASSOWRD_DESCRIPTION, type=str, dest='password')
     parser.add_argument(constants.ARG_FILEPATH, constants.ARG_FILEPATH_SHORT,
                         help=constants.ARG_FILEPATH_DESCRIPTION, type=str, dest='path')
+    parser.add_argument(constants.ARG_CONVERT, help=constants.ARG_CONVERT_DESCRIPTION,
+                        action='store_true', dest='convert')
+    parser.add_argument(constants.ARG_CIPHER, help=constants.ARG_CIPHER_DESCRIPTION,
+                        choices=sorted(core.CIPHERS), dest='cipher')
+    parser.add_argument(constants.ARG_LAZY, help=constants.ARG_LAZY_DESCRIPTION,
+                        action='store_true', dest='lazy')
+    parser.add_argument(constants.ARG_WORKERS, help=constants.ARG_WORKERS_DESCRIPTION,
+                        type=int, dest='workers')
+    parser.add_argument(constants.ARG_SEARCH_WORKERS,
+                        help=constants.ARG_SEARCH_WORKERS_DESCRIPTION,
+                        type=int, dest='search_workers')
+    parser.add_argument(constants.ARG_SEARCH_DEADLINE,
+                        help=constants.ARG_SEARCH_DEADLINE_DESCRIPTION,
+                        type=float, dest='search_deadline')
+    parser.add_argument(constants.ARG_AGENT, help=constants.ARG_AGENT_DESCRIPTION,
+                        action='store_true', dest='agent')
+    parser.add_argument(constants.ARG_SOCKET, help=constants.ARG_SOCKET_DESCRIPTION,
+                        type=str, dest='socket')
+    parser.add_argument(constants.ARG_TIMEOUT, help=constants.ARG_TIMEOUT_DESCRIPTION,
+                        type=float, dest='timeout')
     args = parser.parse_args()
 
     if args.password:
         settings[constants.SETTINGS_PASSWORD] = args.password
     if args.path:
         settings[constants.SETTINGS_FILE_PATH] = args.path
+    if args.convert:
+        settings[constants.SETTINGS_CONVERT] = True
+    if args.lazy:
+        settings[constants.SETTINGS_LAZY] = True
+    if args.cipher:
+        settings[constants.SETTINGS_CIPHER] = args.cipher
+    if args.workers is not None:
+        settings[constants.SETTINGS_WORKERS] = args.workers
+    if args.search_workers is not None:
+        settings[constants.SETTINGS_SEARCH_WORKERS] = args.search_workers
+    if args.search_deadline is not None:
+        settings[constants.SETTINGS_SEARCH_DEADLINE] = args.search_deadline
+    if args.agent:
+        settings[constants.SETTINGS_AGENT] = True
+    if args.socket:
+        settings[constants.SETTINGS_AGENT_SOCKET] = args.socket
+    if args.timeout is not None:
+        settings[constants.SETTINGS_AGENT_TIMEOUT] = args.timeout
     return True
 
 def set_settings(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
@@ -59,6 +99,34 @@ def set_settings(settings: Dict[str, Any], frontend: Module, backend: Module) ->
         return False
     given_path = os.path.expanduser(settings[constants.SETTINGS_FILE_PATH])
     settings[constants.SETTINGS_FILE_PATH] = os.path.abspath(given_path)
+    if constants.SETTINGS_AGENT_SOCKET in settings:
+        socket_path = os.path.expanduser(settings[constants.SETTINGS_AGENT_SOCKET])
+        settings[constants.SETTINGS_AGENT_SOCKET] = os.path.abspath(socket_path)
+    return True
+
+def connect_agent(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
+    """If agent is running and has same password file unlocked, use it as
+    backend.  Then password is not needed and file is not loaded again.
+    Never fails, without agent backend is loaded normally"""
+    if settings.get(constants.SETTINGS_AGENT) or settings.get(constants.SETTINGS_CONVERT):
+        return True
+    if not agent.is_supported() or constants.SETTINGS_AGENT_SOCKET not in settings:
+        return True
+    try:
+        client = agent.AgentClient(settings[constants.SETTINGS_AGENT_SOCKET])
+    except OSError:
+        return True
+    # Agent reports its file in stats, other file must not be served
+    ret = client.process({constants.COMMAND: constants.COMMAND_STATS})
+    values = ret.get(constants.RESPONSE_VALUES)
+    file_path = values.get(constants.RESPONSE_STATS_FILE_PATH) if isinstance(values, dict) \
+        else None
+    if ret.get(constants.RESPONSE) == constants.RESPONSE_OK and isinstance(file_path, str) \
+       and os.path.realpath(file_path) == \
+       os.path.realpath(settings.get(constants.SETTINGS_FILE_PATH, "")):
+        backend.module = client
+    else:
+        client.close()
     return True
 
 def load_frontend(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
@@ -81,7 +149,10 @@ def load_frontend(settings: Dict[str, Any], frontend: Module, backend: Module) -
     return True
 
 def load_backend(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
-    """Just load backend. If password is not already in settings, return False."""
+    """Just load backend. If password is not already in settings, return
+    False.  Do nothing if backend is agent"""
+    if backend.is_loaded():
+        return True
     assert constants.SETTINGS_FILE_PATH in settings
     assert constants.SETTINGS_PASSWORD in settings
 
@@ -112,8 +183,9 @@ def create_password_file(settings: Dict[str, Any], frontend: Module, backend: Mo
         return False
 
 def get_password(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
-    """If password is not set, get password from stdin"""
-    if not constants.SETTINGS_PASSWORD in settings:
+    """If password is not set, get password from stdin.  Agent doesn't
+    need password"""
+    if not constants.SETTINGS_PASSWORD in settings and not backend.is_loaded():
         password = ""
         while not password:
             password = getpass.getpass()
@@ -121,8 +193,20 @@ def get_password(settings: Dict[str, Any], frontend: Module, backend: Module) ->
         settings[constants.SETTINGS_PASSWORD] = password
     return True
 
+def convert_password_file(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
+    """If requested by settings, convert password file to binary format
+    (and cipher from settings).  Fails if not all entries could be
+    decrypted"""
+    if not settings.get(constants.SETTINGS_CONVERT, False):
+        return True
+    return core.convert_file(settings[constants.SETTINGS_FILE_PATH],
+                             settings[constants.SETTINGS_PASSWORD],
+                             settings.get(constants.SETTINGS_CIPHER))
+
 def check_password(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
-    """Check if password is correct, and if not quit.
+    """Check if password is correct, and if not quit.  Files with
+    verifier in header fail to load with wrong password, without
+    decrypting any entry.  Other files must decrypt all entries.
 
     In future also check for settings IGNORE_ERRORS, and continue if
     set."""
@@ -131,20 +215,40 @@ def check_password(settings: Dict[str, Any], frontend: Module, backend: Module)
     try:
         ret = backend.process({constants.COMMAND: constants.COMMAND_STATS})
         values = ret[constants.RESPONSE_VALUES]
-        if values[constants.RESPONSE_STATS_DECRYPTION_RATE] is not 1:
+        if values[constants.RESPONSE_STATS_DECRYPTION_RATE] != 1:
             return False
     except (KeyError, ValueError):
         return False
     return True
 
+def connect_frontend(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
+    """Let frontend ask backend while user types (completion of keys,
+    live search)"""
+    if frontend.is_loaded() and not settings.get(constants.SETTINGS_AGENT):
+        frontend.module.set_backend(backend.process)
+    return True
+
 def main(settings: Dict[str, Any], frontend: Module, backend: Module) -> bool:
     """Transport messages between frontend and backend.  Loop until
-    frontend fails(if user types quit)"""
+    frontend fails(if user types quit).  In agent mode, serve backend
+    over socket instead"""
+    if settings.get(constants.SETTINGS_AGENT):
+        if not agent.is_supported():
+            return False
+        server = agent.AgentServer(backend.module,
+                                   settings[constants.SETTINGS_AGENT_SOCKET],
+                                   settings[constants.SETTINGS_AGENT_TIMEOUT])
+        try:
+            server.serve()
+        except OSError as error:
+            print(error)
+            return False
+        return True
     while True:
         command = frontend.module.repl()
         ret = backend.module.process(command)
         front_ret = frontend.module.process(ret)[constants.RESPONSE]
-        if front_ret is not constants.RESPONSE_OK:
+        if front_ret != constants.RESPONSE_OK:
             break
     return True
 
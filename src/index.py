@@ -0,0 +1,391 @@
+"""Indexes over keys of password file, which make search faster than
+comparing query with every entry.  Indexes only select candidates, final
+ordering is always done by same scoring as full search.  Full-text search
+over keys and values is ranked by FullTextIndex itself (BM25).
+
+If NumPy is installed, NumpyIndex scores all keys at once.  Postings are
+columns of sparse (trigram x key) matrix, so product of matrix and query
+vector is just bincount of postings of query trigrams.
+"""
+import bisect
+import collections
+import heapq
+import itertools
+import math
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # type: ignore
+
+NGRAM_SIZE = 3
+
+# Parameters of BM25 ranking used by FullTextIndex.  K1 limits effect of
+# repeated word, B is how much long entries are penalized
+BM25_K1 = 1.2
+BM25_B = 0.75
+WORD_PATTERN = re.compile(r"\w+")
+# Number of entries scored between checks of deadline of search
+DEADLINE_CHECK = 256
+
+
+def normalize(text: str) -> str:
+    """Form of text used by indexes"""
+    return text.lower()
+
+def ngrams(text: str) -> set:
+    """Return set of distinct n-grams (of NGRAM_SIZE characters) in
+    normalized TEXT"""
+    text = normalize(text)
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+def tokenize(text: str) -> List[str]:
+    """Return list of words of normalized TEXT"""
+    return WORD_PATTERN.findall(normalize(text))
+
+def char_slots(text: str) -> List[Tuple[str, int]]:
+    """Return list of (character, n) for each n-th occurrence of character
+    in TEXT"""
+    return [(char, slot) for char, count in collections.Counter(text).items()
+            for slot in range(count)]
+
+def remove_posting(columns: Dict[Any, List[int]], features: Iterable[Any], entry_id: int):
+    """Remove ENTRY_ID from sorted postings of FEATURES in COLUMNS and drop
+    postings, which become empty"""
+    for feature in features:
+        posting = columns[feature]
+        del posting[bisect.bisect_left(posting, entry_id)]
+        if not posting:
+            del columns[feature]
+
+
+class EntryIndex:
+    """Base of indexes.  Outside, entries are identified by position.
+    Inside index, entries have stable ids, so deleting entry doesn't
+    renumber postings of others.  Ids only grow and order of entries
+    never changes, so position of id is found by bisect.
+
+     ids - id of entry at each position
+     next_id - id of next inserted entry"""
+
+    def __init__(self) -> None:
+        self.ids: List[int] = list()
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_id(self) -> int:
+        """Create id for entry inserted after last one"""
+        entry_id = self.next_id
+        self.next_id += 1
+        self.ids.append(entry_id)
+        return entry_id
+
+    def remove_id(self, position: int) -> int:
+        """Forget entry at POSITION and return its id"""
+        return self.ids.pop(position)
+
+    def positions(self, ids: Iterable[int]) -> List[int]:
+        """Translate IDS of entries to their positions"""
+        if len(self.ids) == self.next_id:  # Nothing was deleted
+            return list(ids)
+        return [bisect.bisect_left(self.ids, x) for x in ids]
+
+
+class TrigramIndex(EntryIndex):
+    """Inverted index over keys of entries (positions in KEYS).
+
+     postings - trigram of normalized key -> sorted ids of entries
+     slots - (character, n) -> sorted ids of entries with more than n
+     occurrences of character in key (case sensitive, like search)
+     lengths - length of key for each id"""
+
+    def __init__(self, keys: Iterable[str]) -> None:
+        super().__init__()
+        self.postings: Dict[str, List[int]] = collections.defaultdict(list)
+        self.slots: Dict[Tuple[str, int], List[int]] = collections.defaultdict(list)
+        self.lengths: List[int] = list()
+        for key in keys:
+            self.insert(key)
+
+    def insert(self, key: str):
+        """Add entry with KEY after last entry"""
+        entry_id = self.add_id()
+        for gram in ngrams(key):
+            self.postings[gram].append(entry_id)
+        for slot in char_slots(key):
+            self.slots[slot].append(entry_id)
+        self.lengths.append(len(key))
+
+    def delete(self, position: int, key: str):
+        """Remove entry with KEY at POSITION.  Following entries move one
+        position up"""
+        entry_id = self.remove_id(position)
+        remove_posting(self.postings, ngrams(key), entry_id)
+        remove_posting(self.slots, char_slots(key), entry_id)
+
+    def candidates(self, text: str, limit: int) -> List[int]:
+        """Return positions of max LIMIT entries sharing most trigrams with
+        TEXT, sorted.  Shared trigrams are weighted by length of key like
+        ratio of SequenceMatcher (match of N characters shares N-2
+        trigrams), so short keys containing TEXT come first"""
+        counts: collections.Counter = collections.Counter()
+        for gram in ngrams(text):
+            counts.update(self.postings.get(gram, ()))
+        size = len(text)
+        best = heapq.nlargest(limit, sorted(counts.items()),
+                              key=lambda x: (x[1] + NGRAM_SIZE - 1) / (self.lengths[x[0]] + size))
+        return self.positions(sorted(x[0] for x in best))
+
+    def bounded(self, text: str, threshold: float) -> List[int]:
+        """Return positions of entries, whose ratio with TEXT can be at least
+        THRESHOLD.  Bound is same as SequenceMatcher.quick_ratio (count of
+        common characters), which is never less than ratio.  Entries
+        without common character are never returned"""
+        common: collections.Counter = collections.Counter()
+        for slot in char_slots(text):
+            common.update(self.slots.get(slot, ()))
+        size = len(text)
+        return self.positions(sorted(
+            entry_id for entry_id, matches in common.items()
+            if 2.0 * matches / (self.lengths[entry_id] + size) >= threshold))
+
+
+class NumpyIndex(TrigramIndex):
+    """Same index as TrigramIndex, scores for all keys are computed at
+    once by NumPy.  Postings are converted to arrays when they are first
+    used, and again after they change"""
+
+    def __init__(self, keys: Iterable[str]) -> None:
+        assert numpy is not None
+        self.arrays: Dict[Any, Any] = dict()
+        self.key_lengths = numpy.zeros(0, dtype=numpy.float64)
+        super().__init__(keys)
+        self.key_lengths = numpy.array(self.lengths, dtype=numpy.float64)
+
+    def insert(self, key: str):
+        super().insert(key)
+        self.forget(key)
+        if len(self.key_lengths) < len(self.lengths):
+            # Grow twice, so appending is cheap
+            grown = numpy.zeros(2 * len(self.lengths), dtype=numpy.float64)
+            grown[:len(self.key_lengths)] = self.key_lengths
+            self.key_lengths = grown
+        self.key_lengths[len(self.lengths) - 1] = len(key)
+
+    def delete(self, position: int, key: str):
+        super().delete(position, key)
+        self.forget(key)
+
+    def forget(self, key: str):
+        """Drop cached arrays of postings, which contain KEY"""
+        if self.arrays:
+            for feature in itertools.chain(ngrams(key), char_slots(key)):
+                self.arrays.pop(feature, None)
+
+    def count(self, columns: Dict[Any, Any], features: Iterable[Any]) -> Any:
+        """Multiply sparse matrix COLUMNS by binary vector of FEATURES.
+        Return array with count of features for each id"""
+        found = list()
+        for feature in features:
+            if feature in columns:
+                if feature not in self.arrays:
+                    self.arrays[feature] = numpy.array(columns[feature], dtype=numpy.int32)
+                found.append(self.arrays[feature])
+        if not found:
+            return numpy.zeros(len(self.lengths), dtype=numpy.int64)
+        return numpy.bincount(numpy.concatenate(found), minlength=len(self.lengths))
+
+    def candidates(self, text: str, limit: int) -> List[int]:
+        counts = self.count(self.postings, ngrams(text))
+        shared = numpy.flatnonzero(counts)
+        scores = (counts[shared] + NGRAM_SIZE - 1) / (self.key_lengths[shared] + len(text))
+        if len(shared) > limit:
+            # Ties are resolved by index, like in TrigramIndex
+            kth = numpy.partition(scores, len(scores) - limit)[len(scores) - limit]
+            better = shared[scores > kth]
+            ties = shared[scores == kth][:limit - len(better)]
+            shared = numpy.concatenate([better, ties])
+        return self.positions(sorted(shared.tolist()))
+
+    def bounded(self, text: str, threshold: float) -> List[int]:
+        common = self.count(self.slots, char_slots(text))
+        bound = 2.0 * common / (self.key_lengths[:len(common)] + len(text))
+        return self.positions(numpy.flatnonzero((common > 0) & (bound >= threshold)).tolist())
+
+
+class FullTextIndex(EntryIndex):
+    """Inverted index over words of keys and values of entries (TEXTS),
+    which ranks entries by BM25.  Search costs only as much as postings
+    of words in query.
+
+     postings - word -> {id: occurrences of word in entry}
+     words - distinct words of entry for each id (to remove postings)
+     lengths - count of words of entry for each id"""
+
+    def __init__(self, texts: Iterable[str]) -> None:
+        super().__init__()
+        self.postings: Dict[str, Dict[int, int]] = collections.defaultdict(dict)
+        self.words: Dict[int, Tuple[str, ...]] = dict()
+        self.lengths: Dict[int, int] = dict()
+        self.total_length = 0
+        for text in texts:
+            self.insert(text)
+
+    def insert(self, text: str):
+        """Add entry with TEXT after last entry"""
+        entry_id = self.add_id()
+        counts = collections.Counter(map(sys.intern, tokenize(text)))
+        for word, count in counts.items():
+            self.postings[word][entry_id] = count
+        self.words[entry_id] = tuple(counts)
+        self.lengths[entry_id] = sum(counts.values())
+        self.total_length += self.lengths[entry_id]
+
+    def delete(self, position: int):
+        """Remove entry at POSITION.  Following entries move one position
+        up"""
+        entry_id = self.remove_id(position)
+        for word in self.words.pop(entry_id):
+            posting = self.postings[word]
+            del posting[entry_id]
+            if not posting:
+                del self.postings[word]
+        self.total_length -= self.lengths.pop(entry_id)
+
+    def search(self, text: str, max_results: int) -> List[int]:
+        """Return positions of max MAX_RESULTS entries with best BM25
+        score for words of TEXT, best first.  Entries without any word
+        of TEXT are never returned.  Ties are resolved by position"""
+        return self.search_until(text, max_results)[0]
+
+    def search_until(self, text: str, max_results: int,
+                     until: Optional[float] = None) -> Tuple[List[int], bool]:
+        """Same as search, but stop when time.monotonic() reaches UNTIL.
+        Return (positions, partial), partial is True if some postings
+        were not scored.  Words in fewest entries (highest idf) are
+        scored first, so partial results are ranked by rarest words"""
+        if not self.ids:
+            return [], False
+        average = self.total_length / len(self.ids)
+        scores: Dict[int, float] = collections.defaultdict(float)
+        words = sorted((len(self.postings[x]), x) for x in set(tokenize(text))
+                       if x in self.postings)
+        scored = 0
+        partial = False
+        for _, word in words:
+            posting = self.postings[word]
+            idf = math.log((len(self.ids) - len(posting) + 0.5) / (len(posting) + 0.5) + 1)
+            for entry_id, count in posting.items():
+                if until is not None and scored % DEADLINE_CHECK == 0 and scored and \
+                   time.monotonic() >= until:
+                    partial = True
+                    break
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[entry_id] / average)
+                scores[entry_id] += idf * count * (BM25_K1 + 1) / (count + norm)
+                scored += 1
+            if partial:
+                break
+        best = heapq.nlargest(max_results, sorted(scores.items()), key=lambda x: x[1])
+        return self.positions(x[0] for x in best), partial
+
+
+class PrefixIndex(EntryIndex):
+    """Keys of entries with their ids sorted in list, so keys with same
+    prefix are next to each other and are found by bisect.  Insert and
+    delete move part of list, which is still fast for hundred thousands
+    of keys.  Entries with exactly same key are also found in dict.
+
+     items - sorted (key, id) of all entries
+     exact - key -> sorted ids of entries"""
+
+    def __init__(self, keys: Iterable[str]) -> None:
+        super().__init__()
+        self.items: List[Tuple[str, int]] = list()
+        self.exact: Dict[str, List[int]] = collections.defaultdict(list)
+        for key in keys:
+            entry_id = self.add_id()
+            self.items.append((key, entry_id))
+            self.exact[key].append(entry_id)
+        self.items.sort()
+
+    def insert(self, key: str):
+        """Add entry with KEY after last entry"""
+        entry_id = self.add_id()
+        bisect.insort(self.items, (key, entry_id))
+        self.exact[key].append(entry_id)
+
+    def delete(self, position: int, key: str):
+        """Remove entry with KEY at POSITION.  Following entries move one
+        position up"""
+        entry_id = self.remove_id(position)
+        del self.items[bisect.bisect_left(self.items, (key, entry_id))]
+        ids = self.exact[key]
+        ids.remove(entry_id)
+        if not ids:
+            del self.exact[key]
+
+    def find(self, key: str, limit: int) -> List[int]:
+        """Return positions of max LIMIT entries with KEY, sorted"""
+        return self.positions(self.exact.get(key, [])[:limit])
+
+    def iterate(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        """Yield sorted (key, id) of entries, whose key starts with PREFIX"""
+        position = bisect.bisect_left(self.items, (prefix,))
+        while position < len(self.items) and self.items[position][0].startswith(prefix):
+            yield self.items[position]
+            position += 1
+
+    def matching(self, prefix: str, limit: int,
+                 predicate: Optional[Callable[[str], Any]] = None) -> List[int]:
+        """Return positions of max LIMIT entries, whose key starts with
+        PREFIX and satisfies PREDICATE (if given), sorted by key"""
+        found = (entry_id for key, entry_id in self.iterate(prefix)
+                 if predicate is None or predicate(key))
+        return self.positions(itertools.islice(found, limit))
+
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        """Return max LIMIT distinct keys starting with PREFIX, sorted"""
+        found: List[str] = list()
+        for key, _ in self.iterate(prefix):
+            if len(found) >= limit:
+                break
+            if not found or found[-1] != key:
+                found.append(key)
+        return found
+
+
+def glob_prefix(pattern: str) -> str:
+    """Return text, which starts every string matching glob PATTERN"""
+    return re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+def regex_prefix(pattern: str) -> str:
+    """Return text, which starts every string matching regular expression
+    PATTERN (searched anywhere in string), may be empty"""
+    if not pattern.startswith("^") or "|" in pattern:
+        return ""
+    literal = re.match(r"[^.^$*+?{}\[\]\\|()]*", pattern[1:]).group()  # type: ignore
+    if pattern[1 + len(literal):][:1] in ("*", "?", "{"):
+        literal = literal[:-1]  # Last character is optional
+    return literal
+
+
+# Search engines selectable in KeyValueStore
+ENGINES: Dict[str, Any] = {
+    "trigram": TrigramIndex,
+}
+if numpy is not None:
+    ENGINES["numpy"] = NumpyIndex
+
+def default_engine() -> str:
+    """Fastest available engine"""
+    return "numpy" if numpy is not None else "trigram"
+
+def create_index(keys: Iterable[str], engine: Optional[str] = None) -> TrigramIndex:
+    """Create index over KEYS used by ENGINE (default engine if None)"""
+    return ENGINES[engine or default_engine()](keys)
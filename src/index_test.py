@@ -0,0 +1,220 @@
+"""Tests for search indexes"""
+# pylint: disable=C0111
+import random
+import time
+import unittest
+from unittest.mock import patch
+
+import core
+import corpus
+import index
+from core_test import memory_file
+
+
+class TrigramIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.keys = ["github.com", "GitLab", "mail.google.com", "bank", "abc"]
+        self.index = index.TrigramIndex(self.keys)
+
+    def test_ngrams(self):
+        self.assertEqual({"git", "itl", "tla", "lab"}, index.ngrams("GitLab"))
+        self.assertEqual(set(), index.ngrams("ab"))
+        self.assertEqual([("a", 0), ("a", 1), ("b", 0)], sorted(index.char_slots("aba")))
+
+    def test_candidates(self):
+        self.assertEqual([0, 1], self.index.candidates("git", 10))
+        self.assertEqual([1], self.index.candidates("gitla", 1))
+        self.assertEqual([], self.index.candidates("xyz", 10))
+
+    def test_bounded(self):
+        # "bank" shares 4 characters with "bank", "abc" only 2 ("a", "b")
+        self.assertEqual([3], self.index.bounded("bank", 0.9))
+        self.assertEqual([3, 4], sorted(self.index.bounded("bank", 0.5)))
+        self.assertEqual([1, 3, 4], sorted(self.index.bounded("bank", 0.4)))
+
+
+class FullTextIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.texts = ["mail.google.com me@gmail.com pin 1234",
+                      "bank card pin 9876 and bank account",
+                      "router admin password",
+                      "Bank of somewhere"]
+        self.index = index.FullTextIndex(self.texts)
+
+    def test_tokenize(self):
+        self.assertEqual(["mail", "google", "com", "me", "gmail", "com"],
+                         index.tokenize("Mail.google.com me@GMAIL.com"))
+
+    def test_search(self):
+        # Repeated word in entry ranks it first, ties are resolved by position
+        self.assertEqual([1, 3], self.index.search("bank", 10))
+        self.assertEqual([1], self.index.search("BANK", 1))
+        # Rare word outweighs common one
+        self.assertEqual([3, 1, 0], self.index.search("pin somewhere", 10))
+        self.assertEqual(self.index.search("pin", 10), self.index.search("pin pin", 10))
+        self.assertEqual([], self.index.search("xyz", 10))
+        self.assertEqual([], index.FullTextIndex([]).search("bank", 10))
+
+    def test_search_until(self):
+        self.assertEqual((self.index.search("bank pin", 10), False),
+                         self.index.search_until("bank pin", 10, time.monotonic() + 100))
+        # Rarer word (bank) is scored first, stop is checked after each entry
+        with patch("index.DEADLINE_CHECK", 1):
+            self.assertEqual(([1], True), self.index.search_until("pin bank", 10, 0))
+
+    def test_delete(self):
+        self.index.delete(1)
+        self.index.insert("bank bank bank")
+        fresh = index.FullTextIndex([self.texts[0], self.texts[2], self.texts[3],
+                                     "bank bank bank"])
+        for query in ("bank", "pin", "password admin", "com"):
+            self.assertEqual(fresh.search(query, 10), self.index.search(query, 10))
+        self.assertEqual(set(fresh.postings), set(self.index.postings))
+        self.assertEqual(fresh.total_length, self.index.total_length)
+
+
+class PrefixIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.keys = ["github.com", "gitlab", "git", "Git", "bank", "gitlab"]
+        self.index = index.PrefixIndex(self.keys)
+
+    def test_complete(self):
+        self.assertEqual(["git", "github.com", "gitlab"], self.index.complete("git", 10))
+        self.assertEqual(["git", "github.com"], self.index.complete("git", 2))
+        self.assertEqual(["Git"], self.index.complete("G", 10))
+        self.assertEqual([], self.index.complete("x", 10))
+        self.assertEqual(5, len(self.index.complete("", 10)))
+
+    def test_matching(self):
+        self.assertEqual([1, 5], self.index.find("gitlab", 10))
+        self.assertEqual([1], self.index.find("gitlab", 1))
+        self.assertEqual([], self.index.find("gitl", 10))
+        # Sorted by key, then by position
+        self.assertEqual([2, 0, 1, 5], self.index.matching("git", 10))
+        self.assertEqual([0, 1], self.index.matching("git", 2, lambda x: "." in x or "l" in x))
+
+    def test_update(self):
+        self.index.delete(1, "gitlab")
+        self.index.delete(2, "Git")
+        self.index.insert("gitea")
+        self.index.insert("gitlab")
+        self.keys = ["github.com", "git", "bank", "gitlab", "gitea", "gitlab"]
+        fresh = index.PrefixIndex(self.keys)
+        self.assertEqual(["git", "gitea", "github.com", "gitlab"], self.index.complete("git", 10))
+        for prefix in ("", "git", "gitlab", "G"):
+            self.assertEqual(fresh.matching(prefix, 10), self.index.matching(prefix, 10))
+            self.assertEqual(fresh.find(prefix, 10), self.index.find(prefix, 10))
+        self.assertEqual([3, 5], self.index.find("gitlab", 10))
+        self.assertNotIn("Git", self.index.exact)
+
+    def test_literal_prefix(self):
+        self.assertEqual("git", index.glob_prefix("git*.com"))
+        self.assertEqual("a", index.glob_prefix("a[bc]"))
+        self.assertEqual("", index.glob_prefix("*x"))
+        self.assertEqual("abc", index.regex_prefix("^abc"))
+        self.assertEqual("ab", index.regex_prefix("^abc*d"))
+        self.assertEqual("abc", index.regex_prefix("^abc+"))
+        self.assertEqual("a", index.regex_prefix("^a\\.b"))
+        self.assertEqual("", index.regex_prefix("abc"))
+        self.assertEqual("", index.regex_prefix("^ab|^c"))
+
+
+@unittest.skipIf(index.numpy is None, "NumPy is not installed")
+class NumpyIndexTestCase(unittest.TestCase):
+    def test_same_as_trigram_index(self):
+        keys = corpus.create_corpus(500)
+        trigram = index.TrigramIndex(keys)
+        vector = index.NumpyIndex(keys)
+        for query in ("bank", "mail.sk", "user@git", "xyz", "Ad"):
+            for limit in (1, 5, 50):
+                self.assertEqual(trigram.candidates(query, limit),
+                                 vector.candidates(query, limit))
+            for threshold in (0.2, 0.5):
+                self.assertEqual(sorted(trigram.bounded(query, threshold)),
+                                 vector.bounded(query, threshold))
+
+    def test_default_engine(self):
+        self.assertEqual("numpy", index.default_engine())
+        self.assertIsInstance(index.create_index(["abc"]), index.NumpyIndex)
+
+
+class IndexedSearchTestCase(unittest.TestCase):
+    @patch("constants.SEARCH_INDEX_MIN_ENTRIES", 100)
+    @patch("constants.SEARCH_INDEX_CANDIDATES", 20)
+    def test_same_as_full_search(self):
+        keys = corpus.create_corpus(1000)
+        entries = [(x, "value") for x in keys]
+        stores = [core.KeyValueStore(entries, x) for x in sorted(index.ENGINES)]
+        rnd = random.Random(1)
+        queries = [rnd.choice(keys)[:rnd.randint(3, 9)] for _ in range(20)]
+        queries += ["gmail", "githb", "Admin", "bank 12", "router.sk", "xyz", "ab"]
+        for query in queries:
+            for max_results in (1, 10):
+                expected = core.search(entries, core.normalize_key(query),
+                                       lambda x: core.normalize_key(x[0]),
+                                       max_results=max_results)
+                for store in stores:
+                    self.assertEqual(expected, store.find_key(query, max_results), query)
+        for store in stores:
+            self.assertIs(index.ENGINES[store.columns.engine], type(store.columns.index))
+
+    @patch("constants.SEARCH_INDEX_MIN_ENTRIES", 100)
+    @patch("constants.SEARCH_INDEX_CANDIDATES", 20)
+    def test_incremental_update(self):
+        keys = corpus.create_corpus(400)
+        pass_file = memory_file([(x, "value") for x in keys])
+        stores = [core.KeyValueStore(pass_file, x) for x in sorted(index.ENGINES)]
+        queries = ["gmail", "bank1", "Admin@vpn", "xyz"]
+        for store in stores:
+            store.find_key("warm up")
+        rnd = random.Random(2)
+        for new_key in corpus.create_corpus(30, seed=3):
+            pass_file.append_entry(new_key, "value")
+            pass_file.delete_indices(rnd.sample(range(len(pass_file)), 2))
+        keys = [x[0] for x in pass_file]
+        normalized = [core.normalize_key(x) for x in keys]
+        fresh = index.TrigramIndex(normalized)
+        for store in stores:
+            self.assertEqual(keys, store.columns.keys)
+            self.assertEqual(normalized, store.columns.normalized)
+            self.assertEqual(pass_file.version, store.version)
+            self.assertEqual(len(keys), len(store.columns.index))
+            trigrams = store.columns.index
+            for query in queries:
+                self.assertEqual(fresh.candidates(query, 20), trigrams.candidates(query, 20))
+                self.assertEqual(fresh.bounded(query, 0.3), trigrams.bounded(query, 0.3))
+                self.assertEqual(core.search(normalized, core.normalize_key(query), lambda x: x),
+                                 store.find_key(query))
+
+    def test_incremental_complete(self):
+        entries = [(x, "") for x in corpus.create_corpus(300)]
+        pass_file = memory_file(entries)
+        store = core.KeyValueStore(pass_file)
+        store.complete("")
+        rnd = random.Random(6)
+        for new_key in corpus.create_corpus(20, seed=7):
+            pass_file.append_entry(new_key, "")
+            pass_file.delete_indices(rnd.sample(range(len(pass_file)), 2))
+        self.assertEqual(sorted(x[0] for x in pass_file),
+                         [x[0] for x in store.columns.prefixes.items])
+        for prefix in ("user@", "bank", "me@github1", ""):
+            expected = sorted({x[0] for x in pass_file if x[0].startswith(prefix)})
+            self.assertEqual(expected[:5], store.complete(prefix, 5))
+
+    def test_incremental_fulltext(self):
+        entries = [(x, "value {}".format(i % 7)) for i, x in enumerate(corpus.create_corpus(200))]
+        pass_file = memory_file(entries)
+        store = core.KeyValueStore(pass_file)
+        store.find_fulltext("warm up")
+        rnd = random.Random(4)
+        for new_key in corpus.create_corpus(20, seed=5):
+            pass_file.append_entry(new_key, "value 3")
+            pass_file.delete_indices(rnd.sample(range(len(pass_file)), 2))
+        fresh = core.KeyValueStore(list(pass_file))
+        self.assertIsNone(store.columns.keys)
+        for query in ("bank", "value 3", "mail com", "user"):
+            self.assertEqual(fresh.find_fulltext(query), store.find_fulltext(query))
+
+
+if __name__ == '__main__':
+    unittest.main()
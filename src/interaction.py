@@ -10,11 +10,22 @@ manager - parsing input displaying messages etc.
 # pylint: disable=R0201
 
 import abc
+import sys
 from contextlib import suppress
 from pprint import pprint
 from pydoc import pager
 from textwrap import TextWrapper
-from typing import Any, Dict, List, Optional, Tuple, Type
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Type
+
+try:
+    import readline
+except ImportError:  # Windows
+    readline = None  # type: ignore
+try:
+    import termios
+    import tty
+except ImportError:  # Windows
+    termios = None  # type: ignore
 
 import constants
 
@@ -32,6 +43,11 @@ class InputNeeded(Exception):
         self.key_name = key_name
         self.key_description = key_description
 
+
+class CommandCancelled(Exception):
+    """Thrown by interaction commands, which read input themselves, when
+    user cancels them (Ctrl-C).  Repl then asks for next command"""
+
 ###########################################################################
 
 
@@ -46,7 +62,8 @@ class InteractionCommand(abc.ABC):
     HELP: Optional[str] = None  # Help message for command
 
     def __init__(self):
-        pass
+        # Process function of backend, if command needs it while parsing
+        self.backend: Optional[Callable[[dict], dict]] = None
 
     @abc.abstractmethod
     def parse(self, user_input: str, additional_input: dict) -> Dict[str, Any]:
@@ -76,6 +93,11 @@ class InteractionCommand(abc.ABC):
                 print("  " + str(item))
         return True
 
+    def completion_prefix(self, user_input: str) -> Optional[str]:
+        """Return part of USER_INPUT (without command type), which should
+        be completed as key, or None if command doesn't take keys"""
+        return None
+
     @classmethod
     def create_empty(cls):
         """Return new command.  Protection against passing already instantiated
@@ -163,6 +185,11 @@ class InteractiveSession:
         self.keyword = ""
         self.show_prompt = True
         self.show_help = True
+        # Command which raised InputNeeded
+        self.pending: Optional[InteractionCommand] = None
+        # Backend process function used for completion of keys
+        self.backend: Optional[Callable[[dict], dict]] = None
+        self.completions: List[str] = list()
         # TODO: Check for command name uniqueness
         # TODO: Generate help command
 
@@ -172,19 +199,21 @@ class InteractiveSession:
         command = data.get(constants.COMMAND, constants.RESPONSE_MISSING)
         values = data.get(constants.RESPONSE_VALUES, {})
         error = data.get(constants.RESPONSE_ERROR, "")
+        # Flags of response are passed to call only if they are set
+        flags = {x: True for x in (constants.RESPONSE_PARTIAL,) if data.get(x)}
         success = False
 
-        if response is constants.RESPONSE_OK and command:
+        if response == constants.RESPONSE_OK and command:
             command_instance = self.get_command(command)
             # Pass dict/list/int/str correctly
             if isinstance(values, dict):
-                success = command_instance.call(**values)
+                success = command_instance.call(**values, **flags)
             else:
                 try:
-                    success = command_instance.call(*values)
+                    success = command_instance.call(*values, **flags)
                 except TypeError:
-                    success = command_instance.call(values)
-        elif response is constants.RESPONSE_ERROR:
+                    success = command_instance.call(values, **flags)
+        elif response == constants.RESPONSE_ERROR:
             print("Error")
             print(error)
             success = True
@@ -220,8 +249,12 @@ class InteractiveSession:
                 return command.parse(self.remove_command_part(user_input, command),
                                      additional_input)
 
+            except CommandCancelled:
+                user_input, additional_input, self.keyword = "", {}, ""
+                print()
             except InputNeeded as inpn:
                 self.keyword = inpn.key_name
+                self.pending = command
                 if self.show_help and inpn.key_description:
                     # Ctrl-C breaks pager first, then whole app
                     with suppress(KeyboardInterrupt):
@@ -256,6 +289,50 @@ class InteractiveSession:
             return ret[0]
         return HelpMessageCommand("Critical error command not found")
 
+    def set_backend(self, backend: Callable[[dict], dict]):
+        """Let session and commands send requests to BACKEND (process
+        function) while user types.  Keys are completed on Tab using
+        readline (if it is available), by COMMAND_COMPLETE"""
+        self.backend = backend
+        for command in self.command_list:
+            command.backend = backend
+        if readline is None:
+            return
+        # Whole line is completed, so keys may contain spaces
+        readline.set_completer_delims("")
+        readline.set_completer(self.complete)
+        readline.parse_and_bind("tab: complete")
+
+    def complete(self, text: str, state: int) -> Optional[str]:
+        """Readline completer, return STATE-th completion of TEXT"""
+        if state == 0:
+            self.completions = self.get_completions(text)
+        if state < len(self.completions):
+            return self.completions[state]
+        return None
+
+    def get_completions(self, line: str) -> List[str]:
+        """Return possible lines, which complete key at the end of
+        LINE.  Command is found like in repl"""
+        if self.backend is None:
+            return []
+        if self.keyword and self.pending is not None:
+            command, user_input = self.pending, line
+        else:
+            command = self.find_command(line)
+            user_input = self.remove_command_part(line, command)
+            if not user_input[:1].isspace():  # Command is not typed yet
+                return []
+        prefix = command.completion_prefix(user_input)
+        if prefix is None:
+            return []
+        response = self.backend({constants.COMMAND: constants.COMMAND_COMPLETE,
+                                 constants.COMMAND_COMPLETE_VALUE: prefix})
+        if response.get(constants.RESPONSE) != constants.RESPONSE_OK:
+            return []
+        head = line[:len(line) - len(prefix)]
+        return [head + x for x in response.get(constants.RESPONSE_VALUES, [])]
+
     def get_input(self):
         """Function for getting user input"""
         prompt = ""
@@ -322,6 +399,44 @@ def get_best_match(search_for: str, search_in: list) -> Tuple[int, str]:
     except ValueError as _ve:
         return (0, '')
 
+def read_keys() -> Generator[str, None, None]:
+    """Yield characters as user types them, without echo and without
+    waiting for Enter.  Terminal is restored when generator is closed.
+    Without terminal, whole line is read"""
+    if termios is None or not sys.stdin.isatty():
+        yield from sys.stdin.readline()
+        return
+    descriptor = sys.stdin.fileno()
+    old_attributes = termios.tcgetattr(descriptor)
+    try:
+        tty.setcbreak(descriptor)
+        while True:
+            char = sys.stdin.read(1)
+            if not char:
+                return
+            yield char
+    finally:
+        termios.tcsetattr(descriptor, termios.TCSADRAIN, old_attributes)
+
+def skip_escapes(keys: Iterable[str]) -> Iterator[str]:
+    """Yield characters of KEYS without escape sequences sent by special
+    keys (arrows send ESC [ parameters final byte, or ESC O byte).
+    Character after lone ESC is kept"""
+    keys = iter(keys)
+    for char in keys:
+        if char != "\x1b":
+            yield char
+            continue
+        char = next(keys, "")
+        if char == "[":
+            for char in keys:
+                if "@" <= char <= "~":  # Final byte of CSI sequence
+                    break
+        elif char == "O":
+            next(keys, "")
+        elif char:
+            yield char
+
 def parse_numbers(input_string: str) -> List[int]:
     """Given string with numbers, extract theese numbers,
     and return them as list of ints.
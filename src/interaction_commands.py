@@ -5,9 +5,11 @@ defined in interaction
 # Disable no self use warning
 # pylint: disable=R0201
 
+import getpass
 import os
+import sys
 from textwrap import TextWrapper
-from typing import Any, Dict, List, Tuple, Type
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
 
 import constants
 import interaction
@@ -18,7 +20,10 @@ COMMAND_MAP: Dict[str, Type[Any]] = dict()
 class SearchInteractionCommand(interaction.InteractionCommand):
     """Class for handling user search on keys.  User can type search
     and pattern, or type search and hit return. Then propmt will show
-    search mode and user will know that he is in search mode
+    search mode and user will know that he is in search mode.  With
+    --full before pattern, search is on words of keys and values.  With
+    --live, best keys are shown after each typed character.  Other flags
+    select match modes (see constants.SEARCH_MATCH_MODES)
     """
     COMMANDS = ['search', 'find']
     COMMAND_NAME = constants.COMMAND_SEARCH
@@ -31,25 +36,107 @@ class SearchInteractionCommand(interaction.InteractionCommand):
         self.wrapper = TextWrapper(subsequent_indent=indent,
                                    max_lines=2, initial_indent=indent)
 
+    MODE_FLAGS = {constants.SEARCH_INTERACTION_FULL: constants.SEARCH_MODE_FULL,
+                  constants.SEARCH_INTERACTION_LIVE: constants.SEARCH_MODE_LIVE}
+    MODE_FLAGS.update((constants.SEARCH_INTERACTION_FLAG + x, x)
+                      for x in constants.SEARCH_MATCH_MODES)
+
     def parse(self, user_input: str, additional_input: dict) -> Dict[str, Any]:
+        user_input = user_input.strip()
+        flag = "".join(user_input.split(maxsplit=1)[:1])
+        mode = self.MODE_FLAGS.get(flag)
+        if mode:
+            user_input = user_input[len(flag):].strip()
+        if mode == constants.SEARCH_MODE_LIVE and self.backend and not additional_input:
+            keys = interaction.read_keys()
+            try:
+                user_input = self.live_search(keys, user_input)
+            finally:
+                keys.close()
+
         term = additional_input.get(constants.SEARCH_INTERACTION_PROMPT, "")
 
         if term == "":
-            term = user_input.strip()
+            term = user_input
 
         if not term:
             raise interaction.InputNeeded(constants.SEARCH_INTERACTION_PROMPT,
                                           constants.SEARCH_INTERACTION_INFO)
 
-        return {constants.COMMAND: constants.COMMAND_SEARCH,
-                constants.COMMAND_SEARCH_VALUE: term}
+        ret = {constants.COMMAND: constants.COMMAND_SEARCH,
+               constants.COMMAND_SEARCH_VALUE: term}
+        if mode:
+            ret[constants.COMMAND_SEARCH_MODE] = mode
+        return ret
+
+    def live_search(self, keys: Iterable[str], query: str) -> str:
+        """Edit QUERY by typed KEYS (characters) until Enter and show best
+        keys after each change.  Return final query.  Special keys
+        (arrows) are ignored, Ctrl-C cancels command"""
+        self.show_live(query)
+        try:
+            for char in interaction.skip_escapes(keys):
+                if char in "\r\n":
+                    break
+                if char in "\x7f\b":  # Backspace
+                    query = query[:-1]
+                elif char.isprintable():
+                    query += char
+                else:
+                    continue
+                self.show_live(query)
+        except KeyboardInterrupt:
+            raise interaction.CommandCancelled() from None
+        finally:
+            # Clear shown keys, final results are printed by call
+            sys.stdout.write("\r\x1b[J")
+            sys.stdout.flush()
+        return query
+
+    def show_live(self, query: str):
+        """Replace prompt and keys shown below it by QUERY and best keys
+        for it.  Cursor stays after QUERY"""
+        assert self.backend is not None
+        # Backend is set by InteractiveSession.set_backend, pylint sees only None
+        backend = self.backend
+        found: List[str] = list()
+        if query:
+            response = backend({constants.COMMAND: constants.COMMAND_SEARCH,  # pylint: disable=E1102
+                                constants.COMMAND_SEARCH_VALUE: query,
+                                constants.COMMAND_SEARCH_MODE: constants.SEARCH_MODE_LIVE})
+            if response.get(constants.RESPONSE) == constants.RESPONSE_OK:
+                found = [x[constants.SECRET_KEY] for x in response.get(
+                    constants.RESPONSE_VALUES, [])[:constants.SEARCH_INTERACTION_LIVE_RESULTS]]
+        prompt = constants.SEARCH_INTERACTION_PROMPT + constants.PROMPT_SYMBOL + query
+        # Clear from start of prompt line to end of screen
+        output = "\r\x1b[J" + prompt
+        for index, key in enumerate(found):
+            output += "\n  {}. {}".format(index, key)
+        if found:  # Back to end of prompt line
+            output += "\x1b[{}A\r\x1b[{}C".format(len(found), len(prompt))
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+    def completion_prefix(self, user_input: str) -> Optional[str]:
+        user_input = user_input.lstrip()
+        flag = "".join(user_input.split(maxsplit=1)[:1])
+        if self.MODE_FLAGS.get(flag) in (constants.SEARCH_MODE_EXACT,
+                                         constants.SEARCH_MODE_PREFIX):
+            return user_input[len(flag):].lstrip()
+        if flag in self.MODE_FLAGS:
+            return None  # Words of values and patterns are not completed
+        return user_input
 
     def call(self, *args, **kwargs) -> bool:
         """Format and print key,value pairs in args
 
         Values are printed only for first 2 matches.  Rest should be obtained
-        by show command"""
+        by show command.  If search stopped at deadline (partial in
+        kwargs), it is noted after matches.  Empty ARGS mean nothing was
+        found"""
 
+        if not args:
+            print(constants.SEARCH_INTERACTION_NOTHING)
         index = 0
         for index, entry in enumerate(args):
             print(str(index) + ". ", end="")
@@ -62,6 +149,8 @@ class SearchInteractionCommand(interaction.InteractionCommand):
         if index >= 2 and self.verbose:
             print()
             print(constants.HELP_SEARCH_MANY)
+        if kwargs.get(constants.RESPONSE_PARTIAL):
+            print(constants.SEARCH_INTERACTION_PARTIAL)
         return True
 
 
@@ -70,6 +159,43 @@ COMMAND_MAP["SearchInteractionCommand"] = SearchInteractionCommand
 ###########################################################################
 
 
+class LookupInteractionCommand(interaction.InteractionCommand):
+    """Search for more terms at once (separated by ;).  For each term,
+    key and value of best match is shown, keys of other matches are
+    only listed"""
+    COMMANDS = ['lookup', 'many']
+    COMMAND_NAME = constants.COMMAND_SEARCH_MANY
+    HELP = constants.HELP_LOOKUP_COMMAND
+
+    def parse(self, user_input: str, additional_input: dict) -> Dict[str, Any]:
+        user_input = additional_input.get(constants.LOOKUP_INTERACTION_PROMPT, user_input)
+        terms = [x.strip() for x in user_input.split(constants.LOOKUP_INTERACTION_SEPARATOR)]
+        terms = [x for x in terms if x]
+        if not terms:
+            raise interaction.InputNeeded(constants.LOOKUP_INTERACTION_PROMPT,
+                                          constants.LOOKUP_INTERACTION_INFO)
+        return {constants.COMMAND: constants.COMMAND_SEARCH_MANY,
+                constants.COMMAND_SEARCH_MANY_VALUE: terms}
+
+    def call(self, *args, **kwargs) -> bool:
+        """Print results of each term in ARGS"""
+        for result in args:
+            entries = result.get(constants.RESPONSE_VALUES, [])
+            print("=== {} ===".format(result.get(constants.COMMAND_SEARCH_VALUE, "")))
+            for index, entry in enumerate(entries):
+                print(entry[constants.SECRET_KEY])
+                if index == 0:
+                    print("--------------------")
+                    print(entry[constants.SECRET_VALUE])
+                    print("--------------------")
+        return True
+
+
+COMMAND_MAP["LookupInteractionCommand"] = LookupInteractionCommand
+
+###########################################################################
+
+
 class AddInteractionCommand(interaction.InteractionCommand):
     """Class for handling addition of entries.  User must enter keyword an
     then some text.  Keyword will be on one line and text must be finished
@@ -232,3 +358,32 @@ class QuitInteractionCommand(interaction.InteractionCommand):
         os.system('cls' if os.name == 'nt' else 'clear')
 
 COMMAND_MAP["QuitInteractionCommand"] = QuitInteractionCommand
+
+###########################################################################
+
+class PasswordInteractionCommand(interaction.InteractionCommand):
+    """Change password of password file.  New password is read by getpass,
+    so it is not shown on screen"""
+    COMMANDS = ['password', 'passwd']
+    COMMAND_NAME = constants.COMMAND_CHANGE_PASSWORD
+    HELP = constants.HELP_PASSWORD_COMMAND
+
+    def parse(self, user_input: str, additional_input: dict) -> Dict[str, Any]:
+        """Ignore input and ask for new password twice.  Ctrl-C cancels
+        command"""
+        try:
+            password = getpass.getpass(constants.PASSWORD_INTERACTION_NEW)
+            repeated = getpass.getpass(constants.PASSWORD_INTERACTION_REPEAT)
+        except KeyboardInterrupt:
+            raise interaction.CommandCancelled() from None
+        if not password or password != repeated:
+            raise interaction.InputNeeded(
+                key_description=constants.PASSWORD_INTERACTION_MISMATCH)
+        return {constants.COMMAND: constants.COMMAND_CHANGE_PASSWORD,
+                constants.COMMAND_CHANGE_PASSWORD_VALUE: password}
+
+    def call(self, *args, **kwargs) -> bool:
+        print(constants.PASSWORD_INTERACTION_CHANGED)
+        return True
+
+COMMAND_MAP["PasswordInteractionCommand"] = PasswordInteractionCommand
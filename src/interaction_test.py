@@ -2,14 +2,17 @@
 # Disable missing docstring
 # pylint: disable=C0111
 
+import io
 import unittest
 import unittest.mock
 
 import constants
 from interaction_commands import SearchInteractionCommand
 from interaction_commands import AddInteractionCommand
+from interaction_commands import LookupInteractionCommand
 from interaction_commands import ViewInteractionCommand
 from interaction_commands import DeleteInteractionCommand
+from interaction_commands import PasswordInteractionCommand
 import interaction
 import session
 
@@ -72,6 +75,120 @@ class SearchCommandsTestCase(unittest.TestCase):
         ret = parser.parse("    ",
                            {constants.SEARCH_INTERACTION_PROMPT: "abcd"})
         self.assertEqual("abcd", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertNotIn(constants.COMMAND_SEARCH_MODE, ret)
+
+    def test_search_command_full(self):
+        parser = SearchInteractionCommand()
+        ret = parser.parse(" --full abcd efgh ", {})
+        self.assertEqual("abcd efgh", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertEqual(constants.SEARCH_MODE_FULL, ret[constants.COMMAND_SEARCH_MODE])
+        self.assertEqual("--fullabc", parser.parse("--fullabc", {})[constants.COMMAND_SEARCH_VALUE])
+        with self.assertRaises(interaction.InputNeeded):
+            parser.parse("--full", {})
+        ret = parser.parse("--regex ^a.c$", {})
+        self.assertEqual("^a.c$", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertEqual(constants.SEARCH_MODE_REGEX, ret[constants.COMMAND_SEARCH_MODE])
+        self.assertEqual("gitlab", parser.completion_prefix(" --exact  gitlab"))
+        self.assertIsNone(parser.completion_prefix("--glob git"))
+        ret = parser.parse("--live abc", {})
+        self.assertEqual("abc", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertEqual(constants.SEARCH_MODE_LIVE, ret[constants.COMMAND_SEARCH_MODE])
+        ret = parser.parse("--full", {constants.SEARCH_INTERACTION_PROMPT: "abcd"})
+        self.assertEqual("abcd", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertEqual(constants.SEARCH_MODE_FULL, ret[constants.COMMAND_SEARCH_MODE])
+
+
+    @unittest.mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_live_search(self, stdout):
+        parser = SearchInteractionCommand()
+        keys = {"g": ["github.com", "gitlab"], "gl": ["gitlab"], "glx": []}
+        backend = unittest.mock.Mock(side_effect=lambda x: session.SessionController.ok_to_dict(
+            constants.COMMAND_SEARCH, [{constants.SECRET_KEY: y, constants.SECRET_VALUE: "secret"}
+                                       for y in keys.get(x[constants.COMMAND_SEARCH_VALUE], [])]))
+        parser.backend = backend
+        typed = ["l", "x", "\x7f", "\x1b", "\n", "ignored"]
+        with unittest.mock.patch("interaction.read_keys", return_value=(x for x in typed)):
+            ret = parser.parse("--live g", {})
+        self.assertEqual("gl", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertEqual(constants.SEARCH_MODE_LIVE, ret[constants.COMMAND_SEARCH_MODE])
+        self.assertEqual(["g", "gl", "glx", "gl"],
+                         [x[0][0][constants.COMMAND_SEARCH_VALUE] for x in backend.call_args_list])
+        self.assertIn("0. github.com\n  1. gitlab", stdout.getvalue())
+        self.assertNotIn("secret", stdout.getvalue())
+        # Empty query is not searched
+        with unittest.mock.patch("interaction.read_keys", return_value=(x for x in "a\b\r")):
+            with self.assertRaises(interaction.InputNeeded):
+                parser.parse("--live", {})
+        self.assertEqual(5, backend.call_count)
+        # Left arrow, Home in application mode, Alt+x, F5
+        typed = "ab\x1b[Dc\x1bOH\x1bx\x1b[15~\r"
+        with unittest.mock.patch("interaction.read_keys", return_value=(x for x in typed)):
+            ret = parser.parse("--live", {})
+        self.assertEqual("abcx", ret[constants.COMMAND_SEARCH_VALUE])
+
+    @unittest.mock.patch('interaction.readline', unittest.mock.Mock())
+    @unittest.mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_live_search_cancel(self, stdout):
+        def typed():
+            yield "a"
+            raise KeyboardInterrupt()
+
+        parser = SearchInteractionCommand()
+        parser.backend = unittest.mock.Mock(return_value={})
+        interactive = interaction.InteractiveSession([SearchInteractionCommand])
+        interactive.set_backend(parser.backend)
+        interactive.get_input = unittest.mock.Mock(side_effect=["search --live", "search x"])
+        with unittest.mock.patch("interaction.read_keys", return_value=typed()):
+            ret = interactive.repl()
+        # Live search was cancelled, next command was read
+        self.assertEqual("x", ret[constants.COMMAND_SEARCH_VALUE])
+        self.assertEqual(2, interactive.get_input.call_count)
+        self.assertTrue(stdout.getvalue().endswith("\r\x1b[J\n"))
+
+
+    @unittest.mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_partial(self, stdout):
+        interactive = interaction.InteractiveSession([SearchInteractionCommand])
+        entry = {constants.SECRET_KEY: "github", constants.SECRET_VALUE: "secret"}
+        response = session.SessionController.ok_to_dict(constants.COMMAND_SEARCH, [entry])
+        interactive.process(response)
+        self.assertNotIn(constants.SEARCH_INTERACTION_PARTIAL, stdout.getvalue())
+        self.assertNotIn(constants.SEARCH_INTERACTION_NOTHING, stdout.getvalue())
+        empty = session.SessionController.ok_to_dict(constants.COMMAND_SEARCH)
+        empty[constants.RESPONSE_VALUES] = []
+        self.assertEqual(constants.RESPONSE_OK, interactive.process(empty)[constants.RESPONSE])
+        self.assertIn(constants.SEARCH_INTERACTION_NOTHING, stdout.getvalue())
+        response[constants.RESPONSE_PARTIAL] = True
+        self.assertEqual(constants.RESPONSE_OK, interactive.process(response)[constants.RESPONSE])
+        self.assertIn("secret\n--------------------\n" + constants.SEARCH_INTERACTION_PARTIAL,
+                      stdout.getvalue())
+
+
+class LookupCommandTestCase(unittest.TestCase):
+    def test_parse(self):
+        parser = LookupInteractionCommand()
+        ret = parser.parse(" github ; my bank;;", {})
+        self.assertEqual({constants.COMMAND: constants.COMMAND_SEARCH_MANY,
+                          constants.COMMAND_SEARCH_MANY_VALUE: ["github", "my bank"]}, ret)
+        with self.assertRaises(interaction.InputNeeded) as exc:
+            parser.parse(" ; ", {})
+        self.assertEqual(constants.LOOKUP_INTERACTION_PROMPT, exc.exception.key_name)
+        ret = parser.parse("", {constants.LOOKUP_INTERACTION_PROMPT: "a;b"})
+        self.assertEqual(["a", "b"], ret[constants.COMMAND_SEARCH_MANY_VALUE])
+
+    @unittest.mock.patch('sys.stdout', new_callable=io.StringIO)
+    def test_process(self, stdout):
+        interactive = interaction.InteractiveSession([SearchInteractionCommand,
+                                                      LookupInteractionCommand])
+        self.assertIsInstance(interactive.find_command("lookup a; b"), LookupInteractionCommand)
+        self.assertIsInstance(interactive.find_command("search a"), SearchInteractionCommand)
+        entry = {constants.SECRET_KEY: "github", constants.SECRET_VALUE: "secret"}
+        response = session.SessionController.ok_to_dict(constants.COMMAND_SEARCH_MANY, [
+            {constants.COMMAND_SEARCH_VALUE: "git", constants.RESPONSE_VALUES: [entry, entry]},
+            {constants.COMMAND_SEARCH_VALUE: "xyz", constants.RESPONSE_VALUES: []}])
+        self.assertEqual(constants.RESPONSE_OK, interactive.process(response)[constants.RESPONSE])
+        self.assertEqual(1, stdout.getvalue().count("secret"))
+        self.assertIn("=== xyz ===", stdout.getvalue())
 
 
 class AddCommandsTestCase(unittest.TestCase):
@@ -173,6 +290,29 @@ class DeleteCommandTestCase(unittest.TestCase):
                          [1, 3])
 
 
+class PasswordCommandTestCase(unittest.TestCase):
+    @unittest.mock.patch('interaction_commands.getpass.getpass')
+    def test_parse(self, getpass_mock):
+        getpass_mock.side_effect = ["new", "new"]
+        expected = {constants.COMMAND: constants.COMMAND_CHANGE_PASSWORD,
+                    constants.COMMAND_CHANGE_PASSWORD_VALUE: "new"}
+        self.assertEqual(expected, PasswordInteractionCommand().parse("", {}))
+
+    @unittest.mock.patch('interaction_commands.getpass.getpass')
+    def test_mismatch(self, getpass_mock):
+        for passwords in (["new", "other"], ["", ""]):
+            getpass_mock.side_effect = passwords
+            with self.assertRaises(interaction.InputNeeded) as exc:
+                PasswordInteractionCommand().parse("", {})
+            self.assertEqual("", exc.exception.key_name)
+
+    @unittest.mock.patch('interaction_commands.getpass.getpass')
+    def test_cancel(self, getpass_mock):
+        getpass_mock.side_effect = ["new", KeyboardInterrupt()]
+        with self.assertRaises(interaction.CommandCancelled):
+            PasswordInteractionCommand().parse("", {})
+
+
 class InteractiveSessionTestCase(unittest.TestCase):
     def setUp(self):
         self.command_list = [SearchInteractionCommand,
@@ -198,6 +338,34 @@ class InteractiveSessionTestCase(unittest.TestCase):
         self.assertEqual(expected, interactive_session.repl())
         input_mock.assert_called_once_with()
 
+    @unittest.mock.patch('interaction.pager', unittest.mock.Mock())
+    @unittest.mock.patch('interaction.readline')
+    def test_completions(self, readline):
+        interactive_session = interaction.InteractiveSession(self.command_list)
+        self.assertEqual([], interactive_session.get_completions("search gi"))
+        backend = unittest.mock.Mock(return_value=session.SessionController.ok_to_dict(
+            constants.COMMAND_COMPLETE, ["git", "github.com"]))
+        interactive_session.set_backend(backend)
+        # Mocked readline, so completer of test process is not changed
+        readline.set_completer.assert_called_once_with(interactive_session.complete)
+        self.assertEqual(["search  git", "search  github.com"],
+                         interactive_session.get_completions("search  gi"))
+        backend.assert_called_once_with({constants.COMMAND: constants.COMMAND_COMPLETE,
+                                         constants.COMMAND_COMPLETE_VALUE: "gi"})
+        self.assertEqual(["sea git", "sea github.com"],
+                         interactive_session.get_completions("sea "))
+        self.assertEqual("sea git", interactive_session.complete("sea ", 0))
+        self.assertEqual("sea github.com", interactive_session.complete("sea ", 1))
+        self.assertIsNone(interactive_session.complete("sea ", 2))
+        # Command is not complete, command doesn't take keys, full-text search
+        for line in ("sea", "help gi", "search --full gi"):
+            self.assertEqual([], interactive_session.get_completions(line))
+        # Prompt of InputNeeded
+        interactive_session.get_input = unittest.mock.Mock(side_effect=["search", "abc"])
+        interactive_session.repl()
+        interactive_session.keyword = constants.SEARCH_INTERACTION_PROMPT
+        self.assertEqual(["git", "github.com"], interactive_session.get_completions("g"))
+
     @unittest.mock.patch('interaction.InteractionCommand.call')
     def test_call_to_command(self, base_mock=None):
         """Test argument propagation to command object"""
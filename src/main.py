@@ -9,11 +9,14 @@ import helpers
 INIT_LIST = [
     helpers.parse_arguments,
     helpers.set_settings,
+    helpers.connect_agent,
     helpers.create_password_file,
     helpers.get_password,
+    helpers.convert_password_file,
     helpers.load_frontend,
     helpers.load_backend,
     helpers.check_password,
+    helpers.connect_frontend,
     helpers.main
 ]
 
@@ -10,13 +10,16 @@ Calls:
  Show
  Delete
  Stats
+ Change password
 """
 
-from typing import Any, List, Dict, Optional
+import re
+from typing import Any, Callable, List, Dict, Optional
 
 import constants
 from core import PasswordFileManager
 from core import KeyValueStore
+from core import InvalidPasswordError
 
 
 class SessionController:
@@ -29,6 +32,7 @@ class SessionController:
 
     def __init__(self, settings: dict) -> None:
         self.state = False # Valid or invalid state
+        self.settings = settings
         self.file_path = settings[constants.SETTINGS_FILE_PATH]
         self.password = settings[constants.SETTINGS_PASSWORD]
         self.pass_file: Optional[PasswordFileManager] = None
@@ -42,9 +46,18 @@ class SessionController:
         ret = ""
         try:
             if self.pass_file is None:
-                self.pass_file = PasswordFileManager(self.file_path, self.password)
-            self.store = KeyValueStore(self.pass_file)
-        except OSError as error:
+                self.pass_file = PasswordFileManager(self.file_path, self.password,
+                                                     self.settings)
+            # Store follows changes of password file, so it is created once
+            if self.store is None:
+                self.store = KeyValueStore(
+                    self.pass_file, self.settings.get(constants.SETTINGS_SEARCH_ENGINE),
+                    self.settings.get(constants.SETTINGS_SEARCH_CACHE_SIZE,
+                                      constants.SEARCH_CACHE_SIZE),
+                    self.settings.get(constants.SETTINGS_SEARCH_WORKERS, 0))
+                if self.store.workers > 1:
+                    self.store.start_shards()
+        except (OSError, InvalidPasswordError) as error:
             self.state = False
             ret = str(error)
         return ret
@@ -58,38 +71,67 @@ class SessionController:
                 return self.error_to_dict(result)
 
         command = data.get(constants.COMMAND, "")
-        ret = self.error_to_dict(constants.RESPONSE_ERROR_UNKNOWN_COMMAND)
-        # ADD
-        if command is constants.COMMAND_ADD:
-            key = data.get(constants.COMMAND_ADD_KEY, "")
-            val = data.get(constants.COMMAND_ADD_VALUE, "")
-            if not key or not val:
-                ret = self.error_to_dict(constants.RESPONSE_ERROR_ARGUMENTS)
-            else:
-                ret = self.add(key, val)
-        # SEARCH
-        elif command is constants.COMMAND_SEARCH:
-            ret = self.search(data.get(constants.COMMAND_SEARCH_VALUE, ""))
-        # VIEW - SHOW
-        elif command is constants.COMMAND_SHOW:
-            indices = data.get(constants.COMMAND_SHOW_INDICES, None)
-            ret = self.show(indices)
-        # DELETE
-        elif command is constants.COMMAND_DELETE:
-            indices = data.get(constants.COMMAND_DELETE_INDICES, [])
-            try:
-                iter(indices)
-                ret = self.delete(indices)
-            except TypeError:
-                ret = self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
-        # STATS
-        elif command is constants.COMMAND_STATS:
-            ret = self.stats()
-        # QUIT
-        elif command is constants.COMMAND_QUIT:
-            ret = self.quit()
+        handler = HANDLERS.get(command) if isinstance(command, str) else None
+        if handler is None:
+            return self.error_to_dict(constants.RESPONSE_ERROR_UNKNOWN_COMMAND)
+        return handler(self, data)
 
-        return ret
+    def process_add(self, data: dict) -> dict:
+        """Check arguments of add request DATA and add entry"""
+        key = data.get(constants.COMMAND_ADD_KEY, "")
+        val = data.get(constants.COMMAND_ADD_VALUE, "")
+        if not isinstance(key, str) or not isinstance(val, str):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        if not key or not val:
+            return self.error_to_dict(constants.RESPONSE_ERROR_ARGUMENTS)
+        return self.add(key, val)
+
+    def process_search(self, data: dict) -> dict:
+        """Check arguments of search request DATA and search"""
+        mode = data.get(constants.COMMAND_SEARCH_MODE, constants.SEARCH_MODE_KEY)
+        term = data.get(constants.COMMAND_SEARCH_VALUE, "")
+        if mode not in constants.SEARCH_MODES or not isinstance(term, str):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        return self.search(term, mode)
+
+    def process_search_many(self, data: dict) -> dict:
+        """Check arguments of search many request DATA and search"""
+        terms = data.get(constants.COMMAND_SEARCH_MANY_VALUE, [])
+        if not isinstance(terms, list) or not all(isinstance(x, str) for x in terms):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        if not terms:
+            return self.error_to_dict(constants.RESPONSE_ERROR_ARGUMENTS)
+        return self.search_many(terms)
+
+    def process_show(self, data: dict) -> dict:
+        """Check arguments of show request DATA and show entries"""
+        indices = data.get(constants.COMMAND_SHOW_INDICES, None)
+        if indices is not None and not is_index_list(indices):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        return self.show(indices)
+
+    def process_delete(self, data: dict) -> dict:
+        """Check arguments of delete request DATA and delete entries"""
+        indices = data.get(constants.COMMAND_DELETE_INDICES, [])
+        if not is_index_list(indices):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        return self.delete(indices)
+
+    def process_complete(self, data: dict) -> dict:
+        """Check arguments of complete request DATA and complete key"""
+        prefix = data.get(constants.COMMAND_COMPLETE_VALUE, "")
+        if not isinstance(prefix, str):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        return self.complete(prefix)
+
+    def process_change_password(self, data: dict) -> dict:
+        """Check arguments of change password request DATA and change it"""
+        password = data.get(constants.COMMAND_CHANGE_PASSWORD_VALUE, "")
+        if not isinstance(password, str):
+            return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        if not password:
+            return self.error_to_dict(constants.RESPONSE_ERROR_ARGUMENTS)
+        return self.change_password(password)
 
     def show(self, indices: Optional[List[int]] = None) -> Dict[str, Any]:
         """Return indices from search which already happened.  In INDICES
@@ -100,7 +142,8 @@ class SessionController:
             indices = list(range(len(self.search_indices)))
         unique_indices = set(indices)
 
-        if not unique_indices or max(unique_indices) >= len(self.search_indices):
+        if not unique_indices or min(unique_indices) < 0 or \
+           max(unique_indices) >= len(self.search_indices):
             return self.error_to_dict(constants.RESPONSE_ERROR_OUT_OF_RANGE)
 
         selected_indices = [self.search_indices[x] for x in unique_indices]
@@ -114,24 +157,69 @@ class SessionController:
                          value_list)
         return self.ok_to_dict(constants.COMMAND_SHOW, list(value_dict))
 
-    def search(self, search_pattern: str) -> dict:
+    def search(self, search_pattern: str, mode=constants.SEARCH_MODE_KEY) -> dict:
         """Method representing command search. Usually called only from
-        process"""
+        process.  MODE is SEARCH_MODE_KEY (search on keys),
+        SEARCH_MODE_FULL (ranked search on words of keys and values) or
+        SEARCH_MODE_LIVE (keys containing characters of pattern, see
+        KeyValueStore.find_live) or one of SEARCH_MATCH_MODES (see
+        KeyValueStore.find_match).  Search on keys and full-text search
+        stop at SETTINGS_SEARCH_DEADLINE, response then has
+        RESPONSE_PARTIAL.  If nothing is found, values are empty"""
         assert self.store is not None
         assert self.pass_file is not None
 
-        self.search_indices = self.store.find_key(search_pattern)
-        ret_dict = self.show()
-        ret_dict[constants.COMMAND] = constants.COMMAND_SEARCH
+        deadline = self.settings.get(constants.SETTINGS_SEARCH_DEADLINE)
+        self.store.partial = False
+        if mode == constants.SEARCH_MODE_FULL:
+            self.search_indices = self.store.find_fulltext(search_pattern, deadline=deadline)
+        elif mode == constants.SEARCH_MODE_LIVE:
+            self.search_indices = self.store.find_live(search_pattern)
+        elif mode in constants.SEARCH_MATCH_MODES:
+            try:
+                self.search_indices = self.store.find_match(search_pattern, mode)
+            except re.error:
+                self.search_indices = list()
+                return self.error_to_dict(constants.RESPONSE_ERROR_INVALID_ARGUMENT)
+        else:
+            self.search_indices = self.store.find_key(search_pattern, deadline=deadline)
+        if self.search_indices:
+            ret_dict = self.show()
+            ret_dict[constants.COMMAND] = constants.COMMAND_SEARCH
+        else:  # Nothing found is not error
+            ret_dict = self.ok_to_dict(constants.COMMAND_SEARCH)
+            ret_dict[constants.RESPONSE_VALUES] = list()
+        if self.store.partial:
+            ret_dict[constants.RESPONSE_PARTIAL] = True
         return ret_dict
 
+    def search_many(self, terms: List[str]) -> dict:
+        """Search for each of TERMS on keys.  Return list of dicts with
+        term and found entries.  Indices of last search are kept"""
+        assert self.store is not None
+        assert self.pass_file is not None
+        results = list()
+        for term, indices in zip(terms, self.store.find_key_many(terms)):
+            entries = [self.pass_file[x] for x in indices]
+            results.append({constants.COMMAND_SEARCH_VALUE: term,
+                            constants.RESPONSE_VALUES: [
+                                {constants.SECRET_KEY: x[0], constants.SECRET_VALUE: x[1]}
+                                for x in entries]})
+        return self.ok_to_dict(constants.COMMAND_SEARCH_MANY, results)
+
+    def complete(self, prefix: str) -> dict:
+        """Return keys starting with PREFIX.  Doesn't change results of
+        last search"""
+        assert self.store is not None
+        return self.ok_to_dict(constants.COMMAND_COMPLETE, self.store.complete(prefix))
+
     def add(self, key: str, value: str) -> dict:
         """Append key and value to password file. Called from process"""
         assert self.store is not None
         assert self.pass_file is not None
         assert self.state is True
 
-        self.state = False # Force reload of key value store
+        self.search_indices = list()
         try:
             self.pass_file.append_entry(key, value)
             self.pass_file.save_contents()
@@ -148,14 +236,16 @@ class SessionController:
 
         if not self.search_indices:
             return self.error_to_dict(constants.RESPONSE_ERROR_REQUIRES_SEARCH)
-        if max(indices) >= len(self.search_indices):
+        if not indices:
+            return self.error_to_dict(constants.RESPONSE_ERROR_ARGUMENTS)
+        if min(indices) < 0 or max(indices) >= len(self.search_indices):
             return self.error_to_dict(constants.RESPONSE_ERROR_OUT_OF_RANGE)
 
-        self.state = False # Reload contents after delete
-
+        delete_indices = [self.search_indices[x] for x in set(indices)]
+        # Indices from search are not valid after delete
+        self.search_indices = list()
         try:
-            delete_indices = map(lambda x: self.search_indices[x], set(indices))
-            self.pass_file.delete_indices(list(delete_indices))
+            self.pass_file.delete_indices(delete_indices)
             self.pass_file.save_contents()
         except OSError:
             return self.error_to_dict(constants.RESPONSE_ERROR_UNKNOWN_ERROR)
@@ -168,11 +258,30 @@ class SessionController:
         ret: Dict[str, Any] = dict()
         ret[constants.RESPONSE_STATS_STATUS] = constants.RESPONSE_ERROR
         ret[constants.RESPONSE_STATS_DECRYPTION_RATE] = 0
+        ret[constants.RESPONSE_STATS_FILE_PATH] = self.file_path
         if self.state: # This is always true when called from process
             ret[constants.RESPONSE_STATS_STATUS] = constants.RESPONSE_OK
             ret[constants.RESPONSE_STATS_DECRYPTION_RATE] = self.pass_file.success
+            cache_info = self.store.cache_info()
+            ret[constants.RESPONSE_STATS_CACHE_HITS] = cache_info.hits
+            ret[constants.RESPONSE_STATS_CACHE_MISSES] = cache_info.misses
         return self.ok_to_dict(constants.COMMAND_STATS, ret)
 
+    def change_password(self, password: str) -> dict:
+        """Change password of password file to PASSWORD.  Only header of
+        file is written"""
+        assert self.pass_file is not None
+
+        try:
+            self.pass_file.change_password(password)
+        except OSError as error:
+            self.state = False
+            return self.error_to_dict(str(error))
+        except ValueError as error:  # Invalid header, file is not changed
+            return self.error_to_dict(str(error))
+        self.password = password
+        return self.ok_to_dict(constants.COMMAND_CHANGE_PASSWORD)
+
     def quit(self):
         """For now do nothing just return ok.  Later we can do some
         cleanups/backups. """
@@ -193,3 +302,24 @@ class SessionController:
         if value:
             ret[constants.RESPONSE_VALUES] = value
         return ret
+
+
+# Methods of SessionController handling request by command, they check
+# arguments of request
+HANDLERS: Dict[str, Callable[[SessionController, dict], dict]] = {
+    constants.COMMAND_ADD: SessionController.process_add,
+    constants.COMMAND_SEARCH: SessionController.process_search,
+    constants.COMMAND_SEARCH_MANY: SessionController.process_search_many,
+    constants.COMMAND_SHOW: SessionController.process_show,
+    constants.COMMAND_DELETE: SessionController.process_delete,
+    constants.COMMAND_COMPLETE: SessionController.process_complete,
+    constants.COMMAND_STATS: lambda session, _: session.stats(),
+    constants.COMMAND_QUIT: lambda session, _: session.quit(),
+    constants.COMMAND_CHANGE_PASSWORD: SessionController.process_change_password,
+}
+
+
+def is_index_list(value: Any) -> bool:
+    """True if VALUE is list of integers (indices of search results)"""
+    return isinstance(value, list) and \
+        all(isinstance(x, int) and not isinstance(x, bool) for x in value)
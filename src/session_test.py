@@ -53,6 +53,34 @@ class SessionControllerTestCase(unittest.TestCase):
         session_controller.update_status()
         self.assertEqual(False, session_controller.state)
 
+    def test_update_status_invalid_password(self):
+        session_controller = session.SessionController(self.settings)
+        self.import_mock.side_effect = session.InvalidPasswordError("abc")
+        self.assertEqual("abc", session_controller.update_status())
+        self.assertEqual(False, session_controller.state)
+
+    def test_change_password(self):
+        session_controller = session.SessionController(self.settings)
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_CHANGE_PASSWORD,
+                                          constants.COMMAND_CHANGE_PASSWORD_VALUE: "new"})
+        self.assertEqual(constants.RESPONSE_OK, ret[constants.RESPONSE])
+        self.mock.change_password.assert_called_once_with("new")
+        self.assertEqual("new", session_controller.password)
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_CHANGE_PASSWORD})
+        self.assertEqual(constants.RESPONSE_ERROR, ret[constants.RESPONSE])
+        self.mock.change_password.side_effect = ValueError("File header is truncated")
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_CHANGE_PASSWORD,
+                                          constants.COMMAND_CHANGE_PASSWORD_VALUE: "other"})
+        self.assertEqual("File header is truncated", ret[constants.RESPONSE_ERROR])
+        self.assertEqual("new", session_controller.password)
+
+    def test_process_decoded_command(self):
+        """Commands decoded from JSON are not same objects as constants"""
+        session_controller = session.SessionController(self.settings)
+        command = "".join(list(constants.COMMAND_STATS))
+        ret = session_controller.process({constants.COMMAND: command})
+        self.assertEqual(constants.RESPONSE_OK, ret[constants.RESPONSE])
+
     def test_error_to_dict(self):
         ret = session.SessionController.error_to_dict("abc")
         self.assertEqual(ret[constants.RESPONSE_ERROR], "abc")
@@ -70,6 +98,10 @@ class SessionControllerTestCase(unittest.TestCase):
         self.mock.append_entry.assert_called_once_with("my key", "my_value")
         self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_OK)
         self.assertEqual(self.mock.save_contents.call_count, 1)
+        # Store follows changes, it is not created again
+        store = session_controller.store
+        session_controller.process({constants.COMMAND: constants.COMMAND_STATS})
+        self.assertIs(store, session_controller.store)
 
     def test_add_failure(self):
         session_controller = session.SessionController(self.settings)
@@ -85,6 +117,112 @@ class SessionControllerTestCase(unittest.TestCase):
         self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_OK)
         self.assertEqual(len(ret[constants.RESPONSE_VALUES]), 3)
 
+    def test_complete(self):
+        session_controller = session.SessionController(self.settings)
+        session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                    constants.COMMAND_SEARCH_VALUE: "key"})
+        indices = session_controller.search_indices
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_COMPLETE,
+                                          constants.COMMAND_COMPLETE_VALUE: "ke"})
+        self.assertEqual(constants.COMMAND_COMPLETE, ret[constants.COMMAND])
+        self.assertEqual(["key1", "key2", "key3"], ret[constants.RESPONSE_VALUES])
+        self.assertEqual(indices, session_controller.search_indices)
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_COMPLETE,
+                                          constants.COMMAND_COMPLETE_VALUE: 1})
+        self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_ERROR)
+
+    def test_search_many(self):
+        session_controller = session.SessionController(self.settings)
+        session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                    constants.COMMAND_SEARCH_VALUE: "key1"})
+        indices = session_controller.search_indices
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH_MANY,
+                                          constants.COMMAND_SEARCH_MANY_VALUE: ["key3", "val2"]})
+        self.assertEqual(constants.COMMAND_SEARCH_MANY, ret[constants.COMMAND])
+        values = ret[constants.RESPONSE_VALUES]
+        self.assertEqual(["key3", "val2"], [x[constants.COMMAND_SEARCH_VALUE] for x in values])
+        self.assertEqual({constants.SECRET_KEY: "key3", constants.SECRET_VALUE: "val3"},
+                         values[0][constants.RESPONSE_VALUES][0])
+        self.assertEqual(3, len(values[1][constants.RESPONSE_VALUES]))
+        self.assertEqual(indices, session_controller.search_indices)
+        for terms in ("key3", [1], []):
+            ret = session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH_MANY,
+                                              constants.COMMAND_SEARCH_MANY_VALUE: terms})
+            self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_ERROR)
+
+    def test_search_match(self):
+        session_controller = session.SessionController(self.settings)
+        data = {constants.COMMAND: constants.COMMAND_SEARCH,
+                constants.COMMAND_SEARCH_VALUE: "key[23]",
+                constants.COMMAND_SEARCH_MODE: constants.SEARCH_MODE_GLOB}
+        ret = session_controller.process(data)
+        self.assertEqual(["key2", "key3"],
+                         [x[constants.SECRET_KEY] for x in ret[constants.RESPONSE_VALUES]])
+        # Nothing found is not error
+        for mode, term in ((constants.SEARCH_MODE_EXACT, "key"),
+                           (constants.SEARCH_MODE_PREFIX, "x"),
+                           (constants.SEARCH_MODE_FULL, "xyz")):
+            ret = session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                              constants.COMMAND_SEARCH_VALUE: term,
+                                              constants.COMMAND_SEARCH_MODE: mode})
+            self.assertEqual({constants.RESPONSE: constants.RESPONSE_OK,
+                              constants.COMMAND: constants.COMMAND_SEARCH,
+                              constants.RESPONSE_VALUES: []}, ret)
+        data = {constants.COMMAND: constants.COMMAND_SEARCH,
+                constants.COMMAND_SEARCH_VALUE: "key[",
+                constants.COMMAND_SEARCH_MODE: constants.SEARCH_MODE_REGEX}
+        ret = session_controller.process(data)
+        self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_ERROR)
+        self.assertEqual([], session_controller.search_indices)
+
+    def test_search_live(self):
+        session_controller = session.SessionController(self.settings)
+        data = {constants.COMMAND: constants.COMMAND_SEARCH,
+                constants.COMMAND_SEARCH_VALUE: "K2",
+                constants.COMMAND_SEARCH_MODE: constants.SEARCH_MODE_LIVE}
+        ret = session_controller.process(data)
+        self.assertEqual([{constants.SECRET_KEY: "key2", constants.SECRET_VALUE: "value2"}],
+                         ret[constants.RESPONSE_VALUES])
+
+    @patch("session.KeyValueStore.start_shards")
+    def test_search_workers(self, start_shards):
+        session.SessionController(self.settings).update_status()
+        start_shards.assert_not_called()
+        self.settings[constants.SETTINGS_SEARCH_WORKERS] = 2
+        session_controller = session.SessionController(self.settings)
+        session_controller.update_status()
+        session_controller.update_status()
+        start_shards.assert_called_once_with()
+
+    def test_search_fulltext(self):
+        session_controller = session.SessionController(self.settings)
+        data = {constants.COMMAND: constants.COMMAND_SEARCH,
+                constants.COMMAND_SEARCH_VALUE: "Val3",
+                constants.COMMAND_SEARCH_MODE: constants.SEARCH_MODE_FULL}
+        ret = session_controller.process(data)
+        self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_OK)
+        self.assertEqual([{constants.SECRET_KEY: "key3", constants.SECRET_VALUE: "val3"}],
+                         ret[constants.RESPONSE_VALUES])
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                          constants.COMMAND_SEARCH_VALUE: "val3",
+                                          constants.COMMAND_SEARCH_MODE: "other"})
+        self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_ERROR)
+
+    def test_search_deadline(self):
+        self.settings[constants.SETTINGS_SEARCH_DEADLINE] = 0
+        session_controller = session.SessionController(self.settings)
+        ret = session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                          constants.COMMAND_SEARCH_VALUE: "key2"})
+        self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_OK)
+        self.assertNotIn(constants.RESPONSE_PARTIAL, ret)
+        with patch("core.DEADLINE_CHECK", 1):
+            ret = session_controller.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                                              constants.COMMAND_SEARCH_VALUE: "key3"})
+        # Keys have same length, search stopped after first one
+        self.assertTrue(ret[constants.RESPONSE_PARTIAL])
+        self.assertEqual([{constants.SECRET_KEY: "key1", constants.SECRET_VALUE: "value1"}],
+                         ret[constants.RESPONSE_VALUES])
+
     def test_search_many_entries(self):
         """Test for bug"""
         file_contents = [("key1", "value1")] * 100000
@@ -166,6 +304,36 @@ class SessionControllerTestCase(unittest.TestCase):
         self.assertEqual(ret[constants.RESPONSE], constants.RESPONSE_ERROR)
         self.assertEqual(ret[constants.RESPONSE_ERROR], constants.RESPONSE_ERROR_INVALID_ARGUMENT)
 
+    @patch("session.KeyValueStore.find_key")
+    def test_invalid_argument_types(self, key_value_mock):
+        session_cont = session.SessionController(self.settings)
+        key_value_mock.return_value = [0, 1]
+        session_cont.update_status()
+        session_cont.search("aa")
+        for data, error in (
+                ({constants.COMMAND: constants.COMMAND_DELETE,
+                  constants.COMMAND_DELETE_INDICES: []}, constants.RESPONSE_ERROR_ARGUMENTS),
+                ({constants.COMMAND: constants.COMMAND_DELETE,
+                  constants.COMMAND_DELETE_INDICES: [-1]}, constants.RESPONSE_ERROR_OUT_OF_RANGE),
+                ({constants.COMMAND: constants.COMMAND_DELETE,
+                  constants.COMMAND_DELETE_INDICES: ["1"]},
+                 constants.RESPONSE_ERROR_INVALID_ARGUMENT),
+                ({constants.COMMAND: constants.COMMAND_SHOW,
+                  constants.COMMAND_SHOW_INDICES: [True]},
+                 constants.RESPONSE_ERROR_INVALID_ARGUMENT),
+                ({constants.COMMAND: constants.COMMAND_SHOW,
+                  constants.COMMAND_SHOW_INDICES: [-1]}, constants.RESPONSE_ERROR_OUT_OF_RANGE),
+                ({constants.COMMAND: constants.COMMAND_SEARCH,
+                  constants.COMMAND_SEARCH_VALUE: 5}, constants.RESPONSE_ERROR_INVALID_ARGUMENT),
+                ({constants.COMMAND: constants.COMMAND_ADD, constants.COMMAND_ADD_KEY: 5,
+                  constants.COMMAND_ADD_VALUE: "v"}, constants.RESPONSE_ERROR_INVALID_ARGUMENT),
+                ({constants.COMMAND: constants.COMMAND_CHANGE_PASSWORD,
+                  constants.COMMAND_CHANGE_PASSWORD_VALUE: ["a"]},
+                 constants.RESPONSE_ERROR_INVALID_ARGUMENT)):
+            self.assertEqual(error, session_cont.process(data)[constants.RESPONSE_ERROR])
+        self.assertEqual(0, self.mock.delete_indices.call_count)
+        self.assertEqual(0, self.mock.append_entry.call_count)
+
     @patch("session.KeyValueStore.find_key")
     def test_delete_array(self, key_value_mock):
         session_cont = session.SessionController(self.settings)
@@ -201,12 +369,18 @@ class SessionControllerTestCase(unittest.TestCase):
             constants.COMMAND_STATS,
             {
                 constants.RESPONSE_STATS_STATUS: constants.RESPONSE_OK,
-                constants.RESPONSE_STATS_DECRYPTION_RATE: rate
-
+                constants.RESPONSE_STATS_DECRYPTION_RATE: rate,
+                constants.RESPONSE_STATS_CACHE_HITS: 1,
+                constants.RESPONSE_STATS_CACHE_MISSES: 1,
+                constants.RESPONSE_STATS_FILE_PATH: "abcd",
             }
         )
         arg = {constants.COMMAND: constants.COMMAND_STATS}
 
+        session_cont.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                              constants.COMMAND_SEARCH_VALUE: "key"})
+        session_cont.process({constants.COMMAND: constants.COMMAND_SEARCH,
+                              constants.COMMAND_SEARCH_VALUE: "key"})
         ret = session_cont.process(arg)
         self.assertEqual(expected, ret)
 